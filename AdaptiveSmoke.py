@@ -0,0 +1,118 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+AdaptiveSmoke.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Adaptive Smoke mode auger cycle, replacing the fixed P-setting pause cycle
+Smoke comes from smouldering pellets, so the smallest fire that holds the band gives the most smoke. The grill is
+modelled per auger cycle as first order in the fire, with the cycle's duty lagged by FIRE_TIME as the fire:
+ dT/dt = (ambient + gain * fire - T) / tau
+which is linear in (1, fire, T) once divided through by the cycle length, so every cycle a recursive least squares
+update with forgetting refines it, and the model is only adopted while tau and gain are plausible (as in MPC). The next
+duty is the model's steady-state duty for MARGIN above the bottom of the band, plus a slow integral correction that
+covers error while the model catches up with a change (wind, a new bag of pellets), rate-limited per cycle.
+Auger on-time stays at the P-setting's 15s pulse (small loads smoulder rather than flare up) and off-time carries the
+adjustment, until off-time reaches its minimum and on-time grows instead.
+"""
+
+import math
+import sys
+from MPC import GAIN_RANGE, TAU_RANGE
+
+ON_TIME = 15.0				# Auger pulse (s), as in Smoker.set_pause_cycle
+ON_TIME_MAX = 30.0
+OFF_TIME_MIN = 25.0			# Shortest pause (s), below this pellets pile up in the fire pot
+OFF_TIME_MAX = 150.0		# Longest pause (s), beyond this the fire pot risks burning out
+DUTY_MIN = ON_TIME / (ON_TIME + OFF_TIME_MAX)
+DUTY_MAX = ON_TIME_MAX / (ON_TIME_MAX + OFF_TIME_MIN)
+TARGET = 180.0				# Smoke target (°F) when the program step doesn't set one
+BAND = 15.0					# Allowed deviation (°F) from target
+MARGIN = 8.0				# Aim this far (°F) above the bottom of the band, clear of the ripple from long pauses
+DUTY_STEP = 0.25			# Largest fractional duty change per cycle
+FORGETTING = 0.97			# RLS forgetting factor per cycle, ~30 cycle memory
+FIRE_TIME = 90.0			# Pellet travel plus burn (s), lag from auger duty to fire
+INTEGRAL_TIME = 900.0		# Integral time (s) of the correction for error the model hasn't learned yet
+BIAS_MAX = 40.0				# Largest integral correction (°F)
+PRIOR = (300.0, 500.0, 70.0)	# Initial (tau s, gain °F per unit duty, ambient °F), P2 holds ~165°F
+PRIOR_VARIANCE = (0.1, 4.0, 1e-5)	# Initial RLS variance of (ambient / tau, gain / tau, -1 / tau)
+
+class AdaptiveSmoke:
+	"""
+	Per-cycle auger on / off time controller for Smoke mode
+	"""
+	def __init__(self, target=TARGET):
+		tau, gain, ambient = PRIOR
+		self.parameters = [ambient / tau, gain / tau, -1.0 / tau]
+		self.covariance = [[PRIOR_VARIANCE[i] if i == j else 0.0 for j in range(3)] for i in range(3)]
+		self.model = PRIOR
+		self.reset(target)
+
+	def reset(self, target=None, duty=None):
+		"""
+		Start a Smoke period at the P2 cycle, the learned model is kept
+		"""
+		self.target = TARGET if target is None else target
+		self.duty = ON_TIME / (ON_TIME + 65.0) if duty is None else duty
+		self.fire = self.duty
+		self.last_temp = None
+		self.bias = 0.0
+		self.on_time, self.off_time = cycle_times(self.duty)
+
+	def band(self):
+		return self.target - BAND, self.target + BAND
+
+	def learn(self, rate, fire, temp):
+		"""
+		Recursive least squares update for rate (°F/s) = parameters . (1, fire, temp), returns Boolean if the model changed
+		"""
+		regressor = (1.0, fire, temp)
+		P = self.covariance
+		Px = [sum(P[i][j] * regressor[j] for j in range(3)) for i in range(3)]
+		denominator = FORGETTING + sum(regressor[i] * Px[i] for i in range(3))
+		K = [value / denominator for value in Px]
+		error = rate - sum(parameter * value for parameter, value in zip(self.parameters, regressor))
+		self.parameters = [parameter + k * error for parameter, k in zip(self.parameters, K)]
+		self.covariance = [[(P[i][j] - K[i] * Px[j]) / FORGETTING for j in range(3)] for i in range(3)]
+		if any(self.covariance[i][i] > 100 * PRIOR_VARIANCE[i] for i in range(3)): # Wind-up without excitation
+			self.covariance = [[PRIOR_VARIANCE[i] if i == j else 0.0 for j in range(3)] for i in range(3)]
+		offset, slope, decay = self.parameters
+		if decay >= 0:
+			return False
+		tau, gain, ambient = -1.0 / decay, -slope / decay, -offset / decay
+		if not (TAU_RANGE[0] < tau < TAU_RANGE[1] and GAIN_RANGE[0] < gain < GAIN_RANGE[1]):
+			return False
+		self.model = (tau, gain, ambient)
+		return True
+
+	def update(self, temp, cycle_time, learn=True):
+		"""
+		Feed grill temp (°F) at the end of the cycle just finished, returns (on time s, off time s) for the next cycle
+		learn=False skips the model update, e.g. during lid-open / flame-out
+		"""
+		fire = self.fire
+		self.fire += (1 - math.exp(-cycle_time / FIRE_TIME)) * (self.duty - self.fire)
+		if learn and self.last_temp is not None:
+			self.learn((temp - self.last_temp) / cycle_time, (fire + self.fire) / 2, (temp + self.last_temp) / 2)
+		self.last_temp = temp if learn else None
+		tau, gain, ambient = self.model
+		aim = self.band()[0] + MARGIN
+		if learn:
+			self.bias = min(max(self.bias + (aim - temp) * cycle_time / INTEGRAL_TIME, -BIAS_MAX), BIAS_MAX)
+		duty = (aim + self.bias - ambient) / gain
+		duty = min(max(duty, self.duty * (1 - DUTY_STEP)), self.duty * (1 + DUTY_STEP))
+		self.duty = min(max(duty, DUTY_MIN), DUTY_MAX)
+		self.on_time, self.off_time = cycle_times(self.duty)
+		return self.on_time, self.off_time
+
+def cycle_times(duty):
+	"""
+	Returns (on time s, off time s) for duty: ON_TIME pulses with a variable pause, longer pulses once the pause is at its minimum
+	"""
+	off_time = ON_TIME * (1 - duty) / duty
+	if off_time >= OFF_TIME_MIN:
+		return ON_TIME, min(off_time, OFF_TIME_MAX)
+	return min(duty * OFF_TIME_MIN / (1 - duty), ON_TIME_MAX), OFF_TIME_MIN
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
@@ -0,0 +1,160 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Benchmark.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Microbenchmarks for firmware hot paths, runnable on any Linux box against Simulator hardware.
+Each benchmark is timed in repeats of a calibrated number of iterations; the minimum per-iteration time is the
+headline figure (least disturbed by other load), median is reported alongside it.
+
+Usage: Benchmark.py [--output results.json] [--compare baseline.json] [--threshold 0.10] [--filter name]
+ --output     write results as JSON
+ --compare    compare against a previous --output file, exit 1 if any benchmark's minimum regressed by more than threshold
+"""
+
+import argparse
+import itertools
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import Simulator
+
+Simulator.install()
+
+import SmokeLog # pylint: disable=C0413
+SmokeLog.common.set_level("error") # Production runs at notice; keep formatting of dropped messages out of the numbers
+
+import MPC # pylint: disable=C0413
+import PID # pylint: disable=C0413
+import Smoker # pylint: disable=C0413
+import Smokestack # pylint: disable=C0413
+import Watchdog # pylint: disable=C0413
+
+REPEATS = 7
+MIN_REPEAT_TIME = 0.05 # Minimum time (s) per repeat, iterations are scaled up until a repeat takes at least this long
+
+def setup():
+	"""
+	Build a Smoker on simulated hardware holding 225°F with one probe at 150°F, wired into Smokestack globals
+	Timers are pushed into the future so a runloop iteration is the steady-state path between samples / heartbeats
+	"""
+	Simulator.hardware.grill = 225.0
+	Simulator.hardware.probes[(0, 1)] = 150.0
+	smoker = Smoker.Smoker()
+	Smokestack.smoker = smoker
+	Smokestack.watchdog = Watchdog.Watchdog(smoker.relays)
+	Smokestack.SMOKESTACK_API_ROOT = "http://localhost/api"
+	Smokestack.SMOKESTACK_PASSWORD = ""
+	smoker.read_temps()
+	smoker.state.mode = "Hold"
+	smoker.set_relay("fan", True)
+	smoker.set_relay("auger", True)
+	smoker.state.grillTarget = 225
+	smoker.pid.set_pid_target(225)
+	smoker.pid_values["cycle_timer"] = Smokestack.FREQUENCY_UPDATE_PID
+	smoker.pid_values["u"] = Smokestack.U_MIN
+	future = time.time() + 10 ** 6
+	for timer in ["last_heartbeat", "last_read_temps", "last_grill_sample", "last_pid_update"]:
+		smoker.timers[timer] = future
+	return smoker
+
+def benchmarks(smoker):
+	"""
+	Returns {name: zero-argument callable}
+	"""
+	probes = smoker.sensors["probes"]
+	probe = probes.probes[0]
+	frame = probe.read_32()
+	grill = smoker.sensors["grill"]
+	pid = PID.PID(60.0, 180.0, 45.0, target=225)
+	mpc = MPC.MPC()
+	mpc_temps = itertools.cycle([225 + 20 * math.sin(sample / 5) for sample in range(MPC.WINDOW)]) # Enough excitation to re-identify every update, the expensive path
+	for _ in range(MPC.WINDOW):
+		mpc.update(next(mpc_temps), 225)
+	return {
+		"MAX31855.read": lambda: probe.read(frame), # Decode + correction table lookup of an already-read frame
+		"MAX31855.read_linearized_temp": probe.read_linearized_temp,
+		"MAX31865.read": grill.read, # SPI read + conversion table lookup, the grill sample path
+		"ProbeArray.scan": probes.scan,
+		"MPC.update": lambda: mpc.update(next(mpc_temps), 225),
+		"PID.update": lambda: pid.update(224.5),
+		"Smoker.read_temps": smoker.read_temps,
+		"Smokestack.heartbeat_payload": Smokestack.heartbeat_payload,
+		"Smokestack.runloop": Smokestack.runloop
+	}
+
+def measure(function):
+	"""
+	Returns dict of per-iteration timings (s) for function
+	"""
+	iterations = 1
+	while True:
+		started = time.perf_counter()
+		for _ in range(iterations):
+			function()
+		if time.perf_counter() - started >= MIN_REPEAT_TIME:
+			break
+		iterations *= 2
+	timings = []
+	for _ in range(REPEATS):
+		started = time.perf_counter()
+		for _ in range(iterations):
+			function()
+		timings.append((time.perf_counter() - started) / iterations)
+	return {"min": min(timings), "median": statistics.median(timings), "iterations": iterations, "repeats": REPEATS}
+
+def compare(results, baseline, threshold):
+	"""
+	Print per-benchmark change against baseline, returns list of regressed benchmark names
+	"""
+	regressions = []
+	for name, result in results["results"].items():
+		if name not in baseline["results"]:
+			print("{name:<32} {new:>10.2f}us   (new)".format(name=name, new=result["min"] * 1e6))
+			continue
+		old = baseline["results"][name]["min"]
+		change = result["min"] / old - 1
+		flag = ""
+		if change > threshold:
+			flag = "REGRESSION"
+			regressions.append(name)
+		print("{name:<32} {old:>10.2f}us -> {new:>10.2f}us {change:>+7.1%} {flag}".format(name=name, old=old * 1e6, new=result["min"] * 1e6, change=change, flag=flag))
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Smokestack firmware microbenchmarks")
+	parser.add_argument("--output", help="write results JSON to this path")
+	parser.add_argument("--compare", help="baseline results JSON to compare against")
+	parser.add_argument("--threshold", type=float, default=0.10, help="fractional slowdown that counts as a regression (default 0.10)")
+	parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this string")
+	args = parser.parse_args()
+
+	results = {
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"firmware": Smokestack.SMOKESTACK_FIRMWARE_VERSION,
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"platform": platform.platform(),
+		"results": {}
+	}
+	for name, function in benchmarks(setup()).items():
+		if args.filter in name:
+			results["results"][name] = measure(function)
+			print("{name:<32} min {min:>10.2f}us  median {median:>10.2f}us".format(name=name, min=results["results"][name]["min"] * 1e6, median=results["results"][name]["median"] * 1e6))
+
+	if args.output:
+		with open(args.output, "w") as output_file:
+			json.dump(results, output_file, indent=2)
+
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			baseline = json.load(baseline_file)
+		if baseline.get("machine") != results["machine"]:
+			print("warning: baseline is from {machine}, comparisons across machines are not meaningful".format(machine=baseline.get("machine")))
+		regressed = compare(results, baseline, args.threshold)
+		if regressed:
+			sys.exit("regressions: {names}".format(names=", ".join(regressed)))
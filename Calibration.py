@@ -0,0 +1,124 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Calibration.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Multi-point sensor calibration
+Calibration points pair a sensor's raw code and uncorrected reading with a reference temperature (e.g. ice bath,
+boiling water, reference thermometer in the grill). For each bus / chip select, the error (reference - reading) is
+fit as a polynomial in the reading by vectorized least squares, and the coefficients are persisted to
+calibration.yaml. At boot the correction is folded into a precomputed lookup table, so a corrected read costs a
+single list index. Chip select 0.0 is the grill RTD (MAX31865), all others are MAX31855 probes.
+
+Usage:
+  Calibration.py record <bus> <chip select> <reference °F>   take a reading and store it as a calibration point
+  Calibration.py fit <bus> <chip select> [degree]            fit correction curve (default degree 2, capped by points - 1)
+  Calibration.py clear <bus> <chip select>                   remove calibration points and coefficients
+  Calibration.py show                                        print stored calibration
+"""
+
+import os
+import sys
+import numpy
+import yaml
+
+CALIBRATION_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "calibration.yaml")
+MAX31855_RANGE = (-328, 2462) # Thermocouple range (°F) covered by the MAX31855 correction table
+
+def key(bus, chip_select):
+	return "{bus}.{chip_select}".format(bus=bus, chip_select=chip_select)
+
+def load_all(path=CALIBRATION_PATH):
+	"""
+	Returns {"bus.cs": {"sensor": str, "points": [[raw, reading °F, reference °F], ...], "coefficients": [c0, c1, ...]}}
+	"""
+	if not os.path.exists(path):
+		return {}
+	with open(path) as calibration_file:
+		return yaml.safe_load(calibration_file) or {}
+
+def save_all(calibrations, path=CALIBRATION_PATH):
+	with open(path, "w") as calibration_file:
+		yaml.safe_dump(calibrations, calibration_file, default_flow_style=None)
+
+def coefficients(bus, chip_select, path=CALIBRATION_PATH):
+	"""
+	Returns fitted correction coefficients (lowest order first) for a sensor, or None if it is uncalibrated
+	"""
+	return load_all(path).get(key(bus, chip_select), {}).get("coefficients")
+
+def fit(points, degree=2):
+	"""
+	Least squares fit of (reference - reading) as a polynomial in reading, returns coefficients lowest order first
+	Degree is capped at len(points) - 1, so a single point yields a plain offset
+	"""
+	points = numpy.asarray(points, dtype=float)
+	readings, references = points[:, 1], points[:, 2]
+	degree = min(degree, len(points) - 1)
+	vandermonde = numpy.vander(readings, degree + 1, increasing=True)
+	solution, _, _, _ = numpy.linalg.lstsq(vandermonde, references - readings, rcond=None)
+	return solution.tolist()
+
+def correct(readings, correction):
+	"""
+	Apply correction coefficients to a numpy array of readings (°F)
+	"""
+	if not correction:
+		return readings
+	return readings + numpy.polynomial.polynomial.polyval(readings, correction)
+
+def max31865_table(r_value, r_reference, A, B, correction=None):
+	"""
+	Returns list mapping every 15-bit MAX31865 RTD code to its corrected temperature in integer °F
+	Codes with no real Callendar-Van Dusen solution map to 0, matching MAX31865.read() for a missing RTD
+	"""
+	r_measured = numpy.arange(2 ** 15, dtype=float) * r_reference / 2 ** 15
+	with numpy.errstate(invalid="ignore"):
+		celsius = (-A + numpy.sqrt(A * A - 4 * B * (1 - r_measured / r_value))) / (2 * B)
+	fahrenheit = numpy.round(correct(numpy.round(celsius * 1.8 + 32, 1), correction), 1)
+	return numpy.nan_to_num(numpy.trunc(fahrenheit), nan=0.0).astype(int).tolist()
+
+def max31855_table(correction):
+	"""
+	Returns list mapping integer °F readings from MAX31855_RANGE[0] upwards to corrected integer °F
+	"""
+	readings = numpy.arange(MAX31855_RANGE[0], MAX31855_RANGE[1] + 1, dtype=float)
+	return numpy.trunc(numpy.round(correct(readings, correction), 1)).astype(int).tolist()
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2 or sys.argv[1] not in ["record", "fit", "clear", "show"]:
+		sys.exit(__doc__.strip())
+	calibrations = load_all()
+	if sys.argv[1] == "show":
+		print(yaml.safe_dump(calibrations, default_flow_style=None) if calibrations else "no calibration stored")
+		sys.exit()
+	bus, chip_select = int(sys.argv[2]), int(sys.argv[3])
+	entry = calibrations.setdefault(key(bus, chip_select), {"points": [], "coefficients": None})
+	if sys.argv[1] == "record":
+		import TempSensor # pylint: disable=C0415
+		reference = float(sys.argv[4])
+		if (bus, chip_select) == (0, 0): # Grill RTD, see Smoker.sensors
+			sensor = TempSensor.MAX31865(chip_select, bus=bus)
+			raw = sensor.read_code()
+			reading = max31865_table(sensor.r_value, sensor.r_reference, sensor.A, sensor.B)[raw]
+		else:
+			sensor = TempSensor.MAX31855(chip_select, bus=bus)
+			raw = sensor.read_32()
+			reading = sensor.read(raw, corrected=False)
+			if reading is None:
+				sys.exit("probe {key} is disconnected, calibration point not recorded".format(key=key(bus, chip_select)))
+		reading = float(reading)
+		entry["sensor"] = type(sensor).__name__
+		entry["points"].append([raw, reading, reference])
+		print("{sensor} {key}: raw {raw}, reading {reading}F, reference {reference}F ({count} points)".format(sensor=entry["sensor"], key=key(bus, chip_select), raw=raw, reading=reading, reference=reference, count=len(entry["points"])))
+	elif sys.argv[1] == "fit":
+		if len(entry["points"]) == 0:
+			sys.exit("no calibration points recorded for {key}".format(key=key(bus, chip_select)))
+		entry["coefficients"] = fit(entry["points"], degree=int(sys.argv[4]) if len(sys.argv) > 4 else 2)
+		points = numpy.asarray(entry["points"], dtype=float)
+		residuals = points[:, 2] - correct(points[:, 1], entry["coefficients"])
+		print("{key}: coefficients {coefficients}, max residual {residual:.2f}F".format(key=key(bus, chip_select), coefficients=entry["coefficients"], residual=numpy.abs(residuals).max()))
+	elif sys.argv[1] == "clear":
+		del calibrations[key(bus, chip_select)]
+	save_all(calibrations)
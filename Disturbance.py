@@ -0,0 +1,120 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Disturbance.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Streaming lid-open and flame-out detection on the grill RTD signal
+Both detectors are one-sided CUSUM tests on the grill's rate of fall, integrated over time so thresholds are in °F
+and independent of sample period:
+ - lid-open: fast drop (°F/s between samples) well beyond sensor noise, flags within seconds
+ - flame-out: slow, sustained drop (smoothed °F/s) while pellets are being fed and the grill is already more than
+   FLAME_BAND below target, flags within a minute or two
+Events end when the grill starts climbing again: lid-open on a positive smoothed rate, flame-out once the grill
+has recovered FLAME_RECOVERY °F above the lowest temp seen during the event or is back within FLAME_BAND of target.
+A lid-open that is still falling after LID_TIMEOUT is escalated to flame-out.
+A falling grill above target - FLAME_BAND is the controller coasting down (a lower setpoint, overshoot), not a dying
+fire, so the flame-out test only runs below it; callers should also reset() whenever the target or mode changes.
+"""
+
+import math
+import sys
+
+LID_DRIFT = 0.5				# Rate of fall (°F/s) tolerated before lid CUSUM accumulates, ~1 RTD LSB per 2s sample
+LID_THRESHOLD = 8.0			# Accumulated excess fall (°F) that flags lid-open
+LID_TIMEOUT = 5 * 60		# Time (s) after which a lid-open that is still falling is treated as flame-out
+FLAME_DRIFT = 0.04			# Smoothed rate of fall (°F/s) tolerated before flame-out CUSUM accumulates
+FLAME_THRESHOLD = 6.0		# Accumulated excess fall (°F) that flags flame-out
+FLAME_RECOVERY = 10			# Rise (°F) above event minimum that ends flame-out
+FLAME_BAND = 30				# Distance (°F) below target the grill must be before flame-out can accumulate, beyond PID / MPC undershoot
+RATE_TIME_CONSTANT = 60		# Time constant (s) of smoothed rate filter
+
+class CUSUM:
+	"""
+	One-sided cumulative sum change detector
+	"""
+	def __init__(self, drift, threshold):
+		self.drift = drift
+		self.threshold = threshold
+		self.sum = 0.0
+
+	def update(self, value, weight=1.0):
+		"""
+		Accumulate weight * (value in excess of drift), returns True once the sum crosses threshold
+		"""
+		self.sum = max(0.0, self.sum + (value - self.drift) * weight)
+		return self.sum > self.threshold
+
+	def reset(self):
+		self.sum = 0.0
+
+class DisturbanceDetector:
+	"""
+	Tracks grill disturbance event: None, "lidOpen" or "flameOut"
+	"""
+	def __init__(self):
+		self.lid = CUSUM(LID_DRIFT, LID_THRESHOLD)
+		self.flame = CUSUM(FLAME_DRIFT, FLAME_THRESHOLD)
+		self.reset()
+
+	def reset(self):
+		"""
+		Clear event and filter state
+		"""
+		self.event = None
+		self.event_time = None
+		self.last_time = None
+		self.last_temp = None
+		self.rate = 0.0
+		self.event_min = None
+		self.lid.reset()
+		self.flame.reset()
+
+	def update(self, timestamp, temp, armed, target=None):
+		"""
+		Add grill sample (°F) taken at timestamp (s), returns current event
+		armed should be True only while the controller is feeding pellets to hold a temperature (Smoke / Hold), and
+		target is the temperature (°F) it is holding; without a target only lid-open is detected
+		"""
+		if temp is None:
+			return self.event
+		if not armed:
+			self.reset()
+			self.last_time, self.last_temp = timestamp, temp
+			return self.event
+		if self.last_time is None or timestamp <= self.last_time:
+			self.last_time, self.last_temp = timestamp, temp
+			return self.event
+		elapsed = timestamp - self.last_time
+		fall = (self.last_temp - temp) / elapsed
+		alpha = 1 - math.exp(-elapsed / RATE_TIME_CONSTANT)
+		self.rate += alpha * (-fall - self.rate)
+		self.last_time, self.last_temp = timestamp, temp
+
+		below = target is not None and temp < target - FLAME_BAND
+		if self.event is None:
+			if not below:
+				self.flame.reset()
+			if self.lid.update(fall, elapsed):
+				self.start_event("lidOpen", timestamp, temp)
+			elif below and self.flame.update(-self.rate, elapsed):
+				self.start_event("flameOut", timestamp, temp)
+		else:
+			self.event_min = min(self.event_min, temp)
+			if self.event == "lidOpen" and self.rate > 0:
+				self.event = None
+			elif self.event == "lidOpen" and timestamp - self.event_time > LID_TIMEOUT:
+				self.start_event("flameOut", timestamp, temp)
+			elif self.event == "flameOut" and (temp - self.event_min >= FLAME_RECOVERY or not below):
+				self.event = None
+		return self.event
+
+	def start_event(self, event, timestamp, temp):
+		self.event = event
+		self.event_time = timestamp
+		self.event_min = temp
+		self.lid.reset()
+		self.flame.reset()
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
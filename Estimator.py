@@ -0,0 +1,132 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Estimator.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Cook completion estimator for meat probes
+Fits probe temperature against time with exponentially-weighted least squares, so each sample is an O(1)
+update of a handful of running sums and no history is stored. The fit's slope and standard error give the ETA and
+confidence; a slope that collapses in the collagen-rendering band is flagged as a stall, and the ETA falls back
+to the pre-stall rate with reduced confidence.
+"""
+
+import math
+import sys
+
+HALF_LIFE = 15 * 60			# Age (s) at which a sample's weight in the fit has halved
+MIN_SPAN = 5 * 60			# Minimum weighted time span (s) of samples before publishing an ETA
+STALL_RANGE = (145, 180)	# Probe temps (°F) where evaporative stalls happen
+STALL_RATE = 3.0 / 3600		# Slope (°F/s) below which the cook is considered stalled
+STALL_CONFIDENCE = 0.25		# Confidence ceiling while stalled
+
+class CookEstimator:
+	"""
+	Incremental probe trajectory fit for a single probe
+	"""
+	def __init__(self, half_life=HALF_LIFE):
+		self.decay_rate = math.log(2) / half_life
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget all samples
+		"""
+		self.origin = None
+		self.last_time = None
+		self.weight = 0.0 # Running sums: w, w^2, w*x, w*y, w*x^2, w*x*y, w*y^2
+		self.sum_ww = 0.0
+		self.sum_x = 0.0
+		self.sum_y = 0.0
+		self.sum_xx = 0.0
+		self.sum_xy = 0.0
+		self.sum_yy = 0.0
+		self.samples = 0
+		self.stalled = False
+		self.pre_stall_rate = None
+
+	def update(self, timestamp, temp):
+		"""
+		Add probe sample (°F) taken at timestamp (s), O(1)
+		"""
+		if temp is None:
+			return
+		if self.origin is None:
+			self.origin = timestamp
+		elif timestamp > self.last_time:
+			decay = math.exp(-self.decay_rate * (timestamp - self.last_time))
+			self.weight *= decay
+			self.sum_ww *= decay * decay
+			self.sum_x *= decay
+			self.sum_y *= decay
+			self.sum_xx *= decay
+			self.sum_xy *= decay
+			self.sum_yy *= decay
+		x = timestamp - self.origin
+		self.weight += 1.0
+		self.sum_ww += 1.0
+		self.sum_x += x
+		self.sum_y += temp
+		self.sum_xx += x * x
+		self.sum_xy += x * temp
+		self.sum_yy += temp * temp
+		self.samples += 1
+		self.last_time = timestamp
+		self.update_stall()
+
+	def fit(self):
+		"""
+		Returns (slope °F/s, fitted temp at last sample, standard error of slope), or None if there are too few samples
+		"""
+		if self.samples < 3:
+			return None
+		mean_x = self.sum_x / self.weight
+		mean_y = self.sum_y / self.weight
+		var_x = self.sum_xx / self.weight - mean_x * mean_x
+		if var_x * 12 < MIN_SPAN * MIN_SPAN: # Uniform samples over span s have variance s^2 / 12
+			return None
+		cov_xy = self.sum_xy / self.weight - mean_x * mean_y
+		var_y = max(self.sum_yy / self.weight - mean_y * mean_y, 0.0)
+		slope = cov_xy / var_x
+		residual = max(var_y - slope * cov_xy, 0.0)
+		effective_samples = self.weight * self.weight / self.sum_ww # Kish effective sample size
+		standard_error = math.sqrt(residual / (var_x * max(effective_samples - 2, 1)))
+		current = mean_y + slope * (self.last_time - self.origin - mean_x)
+		return slope, current, standard_error
+
+	def update_stall(self):
+		"""
+		Track stall state and remember the last healthy rate so ETA can be projected through a stall
+		"""
+		result = self.fit()
+		if result is None:
+			return
+		slope, current, _ = result
+		in_stall_range = STALL_RANGE[0] <= current <= STALL_RANGE[1]
+		if not in_stall_range and slope >= STALL_RATE: # Rate inside the band is already decelerating into the stall
+			self.pre_stall_rate = slope
+		self.stalled = in_stall_range and slope < STALL_RATE
+
+	def estimate(self, target):
+		"""
+		Returns (seconds until probe reaches target, confidence 0-1), or (None, 0.0) if no estimate is possible
+		"""
+		result = self.fit()
+		if target is None or result is None:
+			return None, 0.0
+		slope, current, standard_error = result
+		if current >= target:
+			return 0, 1.0
+		if self.stalled:
+			if self.pre_stall_rate is None:
+				return None, 0.0
+			confidence = STALL_CONFIDENCE
+			slope = self.pre_stall_rate
+		elif slope <= 0:
+			return None, 0.0
+		else:
+			confidence = max(0.0, 1.0 - standard_error / slope)
+		return int((target - current) / slope), round(confidence, 2)
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
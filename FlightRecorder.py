@@ -0,0 +1,143 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+FlightRecorder.py
+https://github.com/magnolialogic/smokestack-firmware
+
+In-memory flight recorder for crash forensics
+Recent events are packed into a fixed-size binary ring buffer (no allocation or I/O per event), and the buffer is
+written to disk as a gzip file only on exit, on an uncaught exception, on SIGTERM, or on demand with SIGUSR1.
+
+Usage: FlightRecorder.py <dump.bin.gz>
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import os
+import signal
+import struct
+import sys
+import time
+import SmokeLog
+
+SAMPLE = 1		# Sensor sample: (temp °F, -, -)
+RELAY = 2		# Relay edge: (new state, -, -)
+PID = 3			# Controller update: (P, I, D) on channel "pid", (u, model gain °F, dead time samples) on channel "mpc", (u, model gain °F, integral correction °F) on channel "smoke"
+HTTP = 4		# Vapor request: (status code or 0 on exception, latency s, -)
+EVENT = 5		# Mode / disturbance / watchdog transition: (-, -, -), channel names the event
+KINDS = {SAMPLE: "sample", RELAY: "relay", PID: "pid", HTTP: "http", EVENT: "event"}
+
+RECORD = struct.Struct("<dBBxxfff") # timestamp, kind, channel, padding, 3 values = 24 bytes
+MAGIC = b"SMOKEFR1"
+CAPACITY = 16384 # ~384 KB, several hours of history at normal event rates
+KEEP_DUMPS = 10
+
+class FlightRecorder:
+	"""
+	Fixed-size ring buffer of packed event records
+	"""
+	def __init__(self, capacity=CAPACITY):
+		self.capacity = capacity
+		self.buffer = bytearray(RECORD.size * capacity)
+		self.index = 0
+		self.count = 0
+		self.channels = {}
+		self.directory = None
+		self.faulted = False
+
+	def channel(self, name):
+		"""
+		Returns small integer id for channel name, registering it on first use
+		"""
+		channel = self.channels.get(name)
+		if channel is None:
+			channel = self.channels[name] = len(self.channels) & 0xFF
+		return channel
+
+	def record(self, kind, name, a=0.0, b=0.0, c=0.0):
+		"""
+		Append event to ring buffer, overwriting the oldest record once full
+		"""
+		RECORD.pack_into(self.buffer, self.index * RECORD.size, time.time(), kind, self.channel(name), a or 0.0, b or 0.0, c or 0.0)
+		self.index = (self.index + 1) % self.capacity
+		self.count = min(self.count + 1, self.capacity)
+
+	def records(self):
+		"""
+		Returns raw records in chronological order as bytes
+		"""
+		if self.count < self.capacity:
+			return bytes(self.buffer[:self.index * RECORD.size])
+		split = self.index * RECORD.size
+		return bytes(self.buffer[split:] + self.buffer[:split])
+
+	def dump(self, reason):
+		"""
+		Write compressed buffer to directory, returns path or None if no dump directory is configured
+		"""
+		if self.directory is None:
+			return None
+		path = os.path.join(self.directory, "flight-{timestamp}-{reason}.bin.gz".format(timestamp=time.strftime("%Y%m%d-%H%M%S"), reason=reason))
+		header = json.dumps({"reason": reason, "channels": {str(v): k for k, v in self.channels.items()}, "kinds": KINDS}).encode()
+		try:
+			with gzip.open(path, "wb", compresslevel=6) as dump_file:
+				dump_file.write(MAGIC + struct.pack("<I", len(header)) + header + self.records())
+			for stale in sorted(glob.glob(os.path.join(self.directory, "flight-*.bin.gz")))[:-KEEP_DUMPS]:
+				os.remove(stale)
+		except OSError as error:
+			SmokeLog.common.error("failed to write {path}: {error}".format(path=path, error=error))
+			return None
+		SmokeLog.common.notice("{count} records -> {path}".format(count=self.count, path=path))
+		return path
+
+	def install(self, directory):
+		"""
+		Dump to directory on interpreter exit (including sys.exit and uncaught exceptions), SIGTERM, and SIGUSR1 (without exiting)
+		"""
+		os.makedirs(directory, exist_ok=True)
+		self.directory = directory
+		pid = os.getpid()
+		def on_exit():
+			if os.getpid() == pid: # Forked children (e.g. Watchdog) hold a stale copy of the buffer
+				self.dump("fault" if self.faulted else "exit")
+		def on_sigterm(signum, frame):
+			sys.exit(SmokeLog.common.notice("caught SIGTERM"))
+		def on_sigusr1(signum, frame):
+			self.dump("signal")
+		previous_hook = sys.excepthook
+		def on_exception(exc_type, exc_value, exc_traceback):
+			self.record(EVENT, "exception:" + exc_type.__name__)
+			self.faulted = True
+			previous_hook(exc_type, exc_value, exc_traceback)
+		atexit.register(on_exit)
+		signal.signal(signal.SIGTERM, on_sigterm)
+		signal.signal(signal.SIGUSR1, on_sigusr1)
+		sys.excepthook = on_exception
+
+def load(path):
+	"""
+	Returns (header dict, list of (timestamp, kind, channel name, a, b, c)) from a dump file
+	"""
+	with gzip.open(path, "rb") as dump_file:
+		data = dump_file.read()
+	if not data.startswith(MAGIC):
+		raise ValueError("{path} is not a flight recorder dump".format(path=path))
+	header_length = struct.unpack_from("<I", data, len(MAGIC))[0]
+	offset = len(MAGIC) + 4
+	header = json.loads(data[offset:offset + header_length])
+	records = []
+	for timestamp, kind, channel, a, b, c in RECORD.iter_unpack(data[offset + header_length:]):
+		records.append((timestamp, KINDS.get(kind, kind), header["channels"].get(str(channel), channel), a, b, c))
+	return header, records
+
+common = FlightRecorder() # Create shared / singleton recorder
+
+if __name__ == "__main__":
+	if len(sys.argv) != 2:
+		sys.exit(__doc__.strip())
+	dump_header, dump_records = load(sys.argv[1])
+	print("reason: {reason}, {count} records".format(reason=dump_header["reason"], count=len(dump_records)))
+	for record in dump_records:
+		print("{time}.{ms:03d} {kind:<6} {channel:<24} {a:10.3f} {b:10.3f} {c:10.3f}".format(time=time.strftime("%H:%M:%S", time.localtime(record[0])), ms=int(record[0] % 1 * 1000), kind=record[1], channel=record[2], a=record[3], b=record[4], c=record[5]))
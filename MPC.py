@@ -0,0 +1,144 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+MPC.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Model-predictive Hold controller
+Grill temperature is modelled as first-order-plus-dead-time (FOPDT) in the controller's sample period Ts:
+ T[k+1] = a T[k] + b u[k-d] + c
+ a = exp(-Ts / tau), b / (1 - a) = gain per unit auger duty, c / (1 - a) = ambient offset, d = dead time in samples
+The model is re-identified every sample by least squares over a sliding window of recent (T, u) history, trying
+each candidate dead time and keeping the best fit; a conservative prior is used until the data supports a model.
+Each sample the controller holds one duty u over a horizon of H samples after the dead time, and picks the u that
+minimises squared tracking error plus a move penalty. With a single free move the optimum is closed-form and costs a
+few hundred multiplications; identification dominates an update, with one numpy least squares fit per candidate dead
+time (DEAD_TIME_MAX + 1) over the window, a few hundred µs in total on a desktop CPU (Benchmark.py MPC.update).
+"""
+
+import collections
+import math
+import sys
+import numpy
+import SmokeLog
+
+SAMPLE_PERIOD = 20				# Controller period (s), matches FREQUENCY_UPDATE_PID
+HORIZON = 15					# Prediction horizon (samples) after the dead time
+MOVE_PENALTY = 2000.0			# Weight on (u - u_previous)^2 relative to squared °F error summed over horizon
+WINDOW = 90						# Samples of history used for identification (30 min)
+DEAD_TIME_MAX = 9				# Largest dead time (samples) considered during identification
+PRIOR = (300.0, 500.0, 60.0)	# Fallback (tau s, gain °F per unit duty, dead time s) until a model is identified
+TAU_RANGE = (60.0, 1800.0)		# Plausible time constants (s), fits outside this are rejected
+GAIN_RANGE = (100.0, 1500.0)	# Plausible °F rise above ambient at full duty, fits outside this are rejected
+
+class FOPDT:
+	"""
+	Discrete first-order-plus-dead-time model
+	"""
+	def __init__(self, a, b, c, dead_time):
+		self.a = a
+		self.b = b
+		self.c = c
+		self.dead_time = dead_time
+		self.powers = [a ** j for j in range(1, HORIZON + 1)] # Precomputed per model, reused every update
+
+	@classmethod
+	def from_physical(cls, tau, gain, dead_time, ambient=70.0, period=SAMPLE_PERIOD):
+		a = math.exp(-period / tau)
+		return cls(a, gain * (1 - a), ambient * (1 - a), int(round(dead_time / period)))
+
+	def __repr__(self):
+		tau = -SAMPLE_PERIOD / math.log(self.a)
+		return "FOPDT(tau={tau:.0f}s, gain={gain:.0f}F, dead_time={dead:d}s)".format(tau=tau, gain=self.b / (1 - self.a), dead=self.dead_time * SAMPLE_PERIOD)
+
+	def step(self, temp, u):
+		return self.a * temp + self.b * u + self.c
+
+def identify(temps, duties):
+	"""
+	Returns best FOPDT for history (temps[k] measured at the start of period k, duties[k] applied during it), or None
+	duties may be one shorter than temps, when the duty for the latest period has not been chosen yet
+	"""
+	best, best_residual = None, math.inf
+	temps = numpy.asarray(temps, dtype=float)
+	duties = numpy.asarray(duties, dtype=float)
+	if len(temps) < DEAD_TIME_MAX + 10 or numpy.ptp(duties) < 0.05: # Not enough excitation to tell gain from offset
+		return None
+	for dead_time in range(DEAD_TIME_MAX + 1):
+		rows = len(temps) - 1 - dead_time
+		regressors = numpy.column_stack((temps[dead_time:-1], duties[:rows], numpy.ones(rows)))
+		solution, residual, rank, _ = numpy.linalg.lstsq(regressors, temps[dead_time + 1:], rcond=None)
+		if rank < 3 or len(residual) == 0:
+			continue
+		a, b, c = solution
+		if not math.exp(-SAMPLE_PERIOD / TAU_RANGE[0]) < a < math.exp(-SAMPLE_PERIOD / TAU_RANGE[1]):
+			continue
+		if GAIN_RANGE[0] < b / (1 - a) < GAIN_RANGE[1] and residual[0] < best_residual:
+			best, best_residual = FOPDT(a, b, c, dead_time), residual[0]
+	return best
+
+class MPC:
+	"""
+	Short-horizon predictive controller for auger duty
+	"""
+	def __init__(self, u_min=0.15, u_max=1.0):
+		self.u_min = u_min
+		self.u_max = u_max
+		self.prior = FOPDT.from_physical(*PRIOR)
+		self.model = self.prior
+		self.temps = collections.deque(maxlen=WINDOW) # T[k-WINDOW+1] .. T[k]
+		self.duties = collections.deque(maxlen=WINDOW - 1) # u[k-WINDOW+1] .. u[k-1], u[i] applied from T[i] to T[i+1]
+		self.u = u_min
+
+	def reset(self, u=None):
+		"""
+		Forget history (model is kept), e.g. when entering Hold
+		"""
+		self.temps.clear()
+		self.duties.clear()
+		self.u = self.u_min if u is None else u
+
+	def update(self, temp, target, learn=True):
+		"""
+		Returns auger duty for the next period given current grill temp and target
+		learn=False skips identification on this sample, e.g. during lid-open / flame-out
+		"""
+		if learn:
+			self.temps.append(temp)
+			model = identify(self.temps, self.duties)
+			if model is not None:
+				if repr(model) != repr(self.model):
+					SmokeLog.common.debug("identified {model}".format(model=model))
+				self.model = model
+		else:
+			self.reset(self.u)
+		self.u = self.optimize(temp, target)
+		if learn:
+			self.duties.append(self.u)
+		return self.u
+
+	def optimize(self, temp, target):
+		"""
+		Closed-form optimal constant duty over the horizon
+		Past duties still in the dead time are replayed to predict the temp when the new duty takes effect
+		"""
+		model = self.model
+		predicted = temp
+		pending = list(self.duties)[-model.dead_time:] if model.dead_time > 0 else []
+		pending = [self.u] * (model.dead_time - len(pending)) + pending
+		for u in pending:
+			predicted = model.step(predicted, u)
+		# Over the horizon T[j] = free[j] + forced[j] * u
+		numerator = MOVE_PENALTY * self.u
+		denominator = MOVE_PENALTY
+		geometric = 0.0
+		for power in model.powers:
+			geometric = geometric * model.a + 1.0 # (1 - a^j) / (1 - a)
+			free = power * predicted + model.c * geometric
+			forced = model.b * geometric
+			numerator += forced * (target - free)
+			denominator += forced * forced
+		return min(max(numerator / denominator, self.u_min), self.u_max)
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
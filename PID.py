@@ -27,6 +27,8 @@ class PID:
 		self.derv = 0.0
 		self.inter = 0.0
 		self.inter_max = abs(0.5 / self.Ki)
+		self.frozen = False
+		self.inter_frozen = 0.0
 
 		self.previous_temp = target
 
@@ -46,7 +48,8 @@ class PID:
 		#I
 		time_since_last_update = time.time() - self.last_updated_time
 		#if self.P > 0 and self.P < 1: #Ensure we are in the PB, otherwise do not calculate I to avoid windup
-		self.inter += error * time_since_last_update
+		if not self.frozen: #Lid-open / flame-out error is not process error, don't integrate it
+			self.inter += error * time_since_last_update
 		self.inter = max(self.inter, -self.inter_max)
 		self.inter = min(self.inter, self.inter_max)
 
@@ -54,7 +57,7 @@ class PID:
 
 		#D
 		self.derv = (current_temp - self.previous_temp) / time_since_last_update
-		self.D = self.Kd * self.derv
+		self.D = self.Kd * self.derv if not self.frozen else 0.0
 
 		#PID
 		self.u = self.P + self.I + self.D
@@ -68,10 +71,32 @@ class PID:
 
 		return self.u
 
+	def freeze(self):
+		"""
+		Stop integrating (and suppress derivative kick) during a disturbance, saving the integrator for restore()
+		"""
+		if not self.frozen:
+			self.frozen = True
+			self.inter_frozen = self.inter
+			SmokeLog.common.notice("integrator frozen at {inter}".format(inter=self.inter))
+
+	def restore(self, current_temp):
+		"""
+		Resume from the integrator saved by freeze(), restarting derivative history at current_temp
+		"""
+		if self.frozen:
+			self.frozen = False
+			self.inter = self.inter_frozen
+			self.previous_temp = current_temp
+			self.last_updated_time = time.time()
+			SmokeLog.common.notice("integrator restored to {inter}".format(inter=self.inter))
+
 	def	set_pid_target(self, target_temp: float):
 		self.target_temp = target_temp
 		self.error = 0.0
 		self.inter = 0.0
+		self.inter_frozen = 0.0
+		self.frozen = False
 		self.derv = 0.0
 		self.last_updated_time = time.time()
 		SmokeLog.common.notice(target_temp)
@@ -0,0 +1,86 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+ProgramCache.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Local cache of program steps keyed by program id, persisted as JSON so the current program is available immediately
+after a restart. Each entry keeps the ETag Vapor returned with it, for conditional revalidation with If-None-Match.
+"""
+
+import json
+import os
+import sys
+import SmokeLog
+
+CACHE_SIZE = 10 # Programs kept, least recently stored are evicted first
+
+class ProgramCache:
+	"""
+	Program steps cache
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.programs = {}
+		self.current_id = None
+		try:
+			with open(path) as cache_file:
+				cache = json.load(cache_file)
+			self.programs = cache["programs"]
+			self.current_id = cache["current"]
+		except FileNotFoundError:
+			pass
+		except (ValueError, KeyError, TypeError):
+			SmokeLog.common.error("discarding unreadable program cache {path}".format(path=path))
+
+	def get(self, program_id):
+		"""
+		Returns {"etag": str or None, "steps": list} for program_id, or None if not cached
+		"""
+		return self.programs.get(program_id)
+
+	def current(self):
+		"""
+		Returns (program id, cache entry) for the last program Vapor reported as current, or (None, None)
+		"""
+		if self.current_id is None or self.current_id not in self.programs:
+			return None, None
+		return self.current_id, self.programs[self.current_id]
+
+	def store(self, program_id, steps, etag=None, current=True):
+		"""
+		Cache program steps, persisting only if something changed
+		"""
+		entry = {"etag": etag, "steps": steps}
+		changed = self.programs.get(program_id) != entry or (current and self.current_id != program_id)
+		self.programs.pop(program_id, None)
+		self.programs[program_id] = entry # Re-insert so dict order tracks recency
+		while len(self.programs) > CACHE_SIZE:
+			del self.programs[next(iter(self.programs))]
+		if current:
+			self.current_id = program_id
+		if changed:
+			self.save()
+
+	def clear_current(self):
+		"""
+		Forget which program is current, cached steps are kept for revalidation
+		"""
+		if self.current_id is not None:
+			self.current_id = None
+			self.save()
+
+	def save(self):
+		"""
+		Atomically replace cache file
+		"""
+		temporary_path = self.path + ".tmp"
+		try:
+			with open(temporary_path, "w") as cache_file:
+				json.dump({"current": self.current_id, "programs": self.programs}, cache_file)
+			os.replace(temporary_path, self.path)
+		except OSError as error:
+			SmokeLog.common.error("failed to write {path}: {error}".format(path=self.path, error=error))
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
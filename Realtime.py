@@ -0,0 +1,261 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Realtime.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Split-process control loop
+The control loop (sensors, relays, PID) runs in a forked child with SCHED_FIFO priority, pinned to its own CPU and with
+its memory locked, so networking, logging and garbage collection in the parent can't delay relay decisions. The child
+publishes telemetry through a shared-memory seqlock block, and the parent sends commands back over a queue.
+Sensor, relay and controller records land in the child's copy of the flight recorder, so the child dumps it whenever it
+stops: on a fault, on SIGTERM, when stopped, and when the parent disappears.
+Scheduling, affinity and mlockall each degrade to a logged error if the platform or privileges don't allow them.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import math
+import multiprocessing
+import os
+import queue
+import struct
+import sys
+import time
+import FlightRecorder
+import SmokeLog
+
+PRIORITY = 40				# SCHED_FIFO priority (1-99), below PREEMPT_RT's threaded IRQ handlers (50) so SPI interrupts still run
+MCL_CURRENT = 1				# mlockall flags from <sys/mman.h>
+MCL_FUTURE = 2
+STATS_WINDOW = 4096			# Loop wake-up latencies kept for percentiles
+STATS_INTERVAL = 40			# Loops between latency summaries, percentiles are too slow to compute every loop
+LOOP_STATS = struct.Struct("<Qffffff") # loops, wake-up latency p50 / p99 / max, command latency max, step time max, step time mean
+
+def to_field(value):
+	"""
+	Returns value for a float telemetry field, None is sent as NaN
+	"""
+	return math.nan if value is None else value
+
+def from_field(value, integral=False):
+	"""
+	Returns telemetry field value, NaN as None, optionally restoring whole numbers (e.g. sensor temps) to int
+	"""
+	if math.isnan(value):
+		return None
+	return int(value) if integral and value.is_integer() else value
+
+def set_realtime(priority=PRIORITY, cpus=None):
+	"""
+	Apply SCHED_FIFO priority, CPU affinity and mlockall to the calling process, returns list of what was applied
+	"""
+	applied = []
+	try:
+		os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+		applied.append("SCHED_FIFO {priority}".format(priority=priority))
+	except (AttributeError, OSError) as error:
+		SmokeLog.common.error("failed to set SCHED_FIFO: {error}".format(error=error))
+	if cpus:
+		try:
+			os.sched_setaffinity(0, cpus)
+			applied.append("cpus {cpus}".format(cpus=sorted(cpus)))
+		except (AttributeError, OSError) as error:
+			SmokeLog.common.error("failed to set affinity {cpus}: {error}".format(cpus=cpus, error=error))
+	if lock_memory():
+		applied.append("mlockall")
+	return applied
+
+def lock_memory():
+	"""
+	Lock current and future pages into RAM so the control loop never waits on a page fault, returns Boolean
+	"""
+	path = ctypes.util.find_library("c")
+	if path is None:
+		SmokeLog.common.error("failed to find libc for mlockall")
+		return False
+	libc = ctypes.CDLL(path, use_errno=True)
+	if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+		SmokeLog.common.error("mlockall failed: {error}".format(error=os.strerror(ctypes.get_errno())))
+		return False
+	return True
+
+class SeqlockBlock:
+	"""
+	Single-writer shared-memory block of fixed-layout values
+	The writer makes the sequence number odd, writes, then makes it even again; readers retry until they see the same
+	even sequence number before and after copying, so they never return a torn record
+	Plain shared-memory loads and stores can be reordered on ARM, so every sequence access is made under a lock:
+	acquiring and releasing the underlying semaphore is a full memory barrier in both processes. The lock only covers
+	the sequence number, never the copy, so the writer waits at most for a reader's single load
+	"""
+	def __init__(self, layout, context=None):
+		context = context or multiprocessing.get_context("fork")
+		self.layout = struct.Struct(layout)
+		self.sequence = context.RawValue("Q", 0)
+		self.barrier = context.Lock()
+		self.buffer = context.RawArray("B", self.layout.size)
+		self.view = memoryview(self.buffer).cast("B")
+
+	def bump(self):
+		with self.barrier:
+			self.sequence.value += 1
+
+	def load(self):
+		with self.barrier:
+			return self.sequence.value
+
+	def write(self, *values):
+		self.bump() # Odd is visible before any of the new values
+		self.layout.pack_into(self.view, 0, *values)
+		self.bump() # All of the new values are visible before even
+
+	def read(self):
+		"""
+		Returns (sequence, values tuple), sequence 0 means nothing has been written yet
+		"""
+		while True:
+			before = self.load()
+			if before % 2 == 0:
+				values = self.layout.unpack_from(self.view, 0)
+				if self.load() == before:
+					return before // 2, values
+			time.sleep(0)
+
+class LatencyStats:
+	"""
+	Rolling wake-up latency and step time statistics for the control loop
+	"""
+	def __init__(self):
+		self.loops = 0
+		self.latencies = collections.deque(maxlen=STATS_WINDOW)
+		self.step_time_max = 0.0
+		self.step_time_total = 0.0
+		self.command_latency_max = 0.0
+		self.summary = (0.0, 0.0, 0.0)
+
+	def record(self, latency, step_time):
+		self.loops += 1
+		self.latencies.append(latency)
+		self.step_time_max = max(self.step_time_max, step_time)
+		self.step_time_total += step_time
+		if self.loops % STATS_INTERVAL == 0:
+			self.summarize()
+
+	def summarize(self):
+		if len(self.latencies) == 0:
+			return self.summary
+		ordered = sorted(self.latencies)
+		self.summary = (ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], ordered[-1])
+		return self.summary
+
+	def values(self):
+		return (self.loops,) + self.summary + (self.command_latency_max, self.step_time_max, self.step_time_total / max(self.loops, 1))
+
+class ControlProcess:
+	"""
+	Runs step() every period seconds in a real-time child process
+	handlers maps command names to functions run in the child, telemetry() returns values for layout (struct format)
+	"""
+	def __init__(self, step, handlers, layout, telemetry, period=0.25, priority=PRIORITY, cpus=None):
+		self.step = step
+		self.handlers = handlers
+		self.telemetry = telemetry
+		self.period = period
+		self.priority = priority
+		self.cpus = cpus
+		context = multiprocessing.get_context("fork") # Child inherits Smoker, GPIO setup and sensors from parent
+		fields = struct.Struct("<" + layout.lstrip("<"))
+		self.telemetry_size = len(fields.unpack(bytes(fields.size))) # Number of telemetry values, loop stats follow them
+		self.block = SeqlockBlock(fields.format + LOOP_STATS.format.lstrip("<"), context)
+		self.commands = context.SimpleQueue()
+		self.stop_event = context.Event()
+		self.process = context.Process(target=self.run, name="smokestack-control", daemon=True)
+		self.in_child = False
+		self.stats = LatencyStats()
+
+	def start(self):
+		"""
+		Fork control process
+		"""
+		self.process.start()
+		SmokeLog.common.notice("control loop running in pid {pid}".format(pid=self.process.pid))
+
+	def stop(self):
+		self.stop_event.set()
+		self.process.join(timeout=self.period * 8)
+
+	def alive(self):
+		return self.process.is_alive()
+
+	def send(self, command, *args):
+		"""
+		Queue command for the control process (parent side)
+		"""
+		self.commands.put((command, time.time(), args))
+
+	def read(self):
+		"""
+		Returns (sequence, telemetry values tuple, loop stats dict) from the control process (parent side)
+		"""
+		sequence, values = self.block.read()
+		loops, p50, p99, latency_max, command_max, step_max, step_mean = values[self.telemetry_size:]
+		stats = {"loops": loops, "latency_p50": p50, "latency_p99": p99, "latency_max": latency_max, "command_latency_max": command_max, "step_time_max": step_max, "step_time_mean": step_mean}
+		return sequence, values[:self.telemetry_size], stats
+
+	def run(self):
+		"""
+		Control process entry point
+		"""
+		self.in_child = True
+		parent = os.getppid()
+		SmokeLog.common.notice("realtime: {applied}".format(applied=", ".join(set_realtime(self.priority, self.cpus)) or "none"))
+		reason = "control-exit"
+		try:
+			self.loop(lambda: self.stop_event.is_set() or os.getppid() != parent)
+		except Exception:
+			reason = "control-fault"
+			FlightRecorder.common.record(FlightRecorder.EVENT, "control:fault")
+			raise
+		finally: # Also on SystemExit from the inherited SIGTERM handler, multiprocessing skips atexit in children
+			FlightRecorder.common.dump(reason)
+
+	def loop(self, done):
+		"""
+		Run step() on a fixed schedule until done() returns True, measuring how late each wake-up is
+		Also usable in-process, e.g. as a baseline for comparing against the real-time child
+		"""
+		deadline = time.monotonic()
+		while not done():
+			woke = time.monotonic()
+			self.drain()
+			self.step()
+			finished = time.monotonic()
+			self.stats.record(woke - deadline, finished - woke)
+			self.block.write(*self.telemetry(), *self.stats.values())
+			deadline += self.period
+			if deadline < finished: # Overran, skip missed cycles instead of bursting to catch up
+				deadline += ((finished - deadline) // self.period + 1) * self.period
+			time.sleep(max(deadline - time.monotonic(), 0))
+
+	def drain(self):
+		"""
+		Apply queued commands
+		"""
+		while True:
+			try:
+				if self.commands.empty():
+					return
+				command, sent, args = self.commands.get()
+			except (OSError, EOFError, queue.Empty):
+				return
+			self.stats.command_latency_max = max(self.stats.command_latency_max, time.time() - sent)
+			handler = self.handlers.get(command)
+			if handler is None:
+				SmokeLog.common.error("unknown command {command}".format(command=command))
+				continue
+			handler(*args)
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
@@ -0,0 +1,135 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+SPIBus.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Shared hardware SPI bus manager
+Owns one reference-counted SpiDev per chip select, serializes all transactions on a bus behind a single lock, and applies each
+device's mode and clock on every transfer. Clock rates are qualified per device at boot by reading the device
+repeatedly at descending speeds and keeping the fastest speed whose samples all agree with a slow-clock reference.
+"""
+
+import sys
+import threading
+import spidev
+import SmokeLog
+
+SPEED_MIN = 7629 # Slowest clock the Pi SPI controller supports (250 MHz core / 32768), known-good for all devices
+SPEEDS = [4000000, 2000000, 1000000, 500000, 250000, 125000, 62500, 31250, 15625, SPEED_MIN] # Qualification candidates (Hz), fastest first
+
+class SPIDevice:
+	"""
+	Handle for a single chip select on a shared SPIBus, mirrors the subset of the SpiDev API used by TempSensor
+	"""
+	def __init__(self, bus, chip_select, mode, speed_hz):
+		self.bus = bus
+		self.chip_select = chip_select
+		self.mode = mode
+		self.speed_hz = speed_hz
+		self.max_speed_hz = speed_hz # Ceiling for qualification, from device datasheet
+		self.closed = False
+
+	def readbytes(self, count):
+		"""
+		Read count bytes, clocking out zeros
+		"""
+		return self.bus.transfer(self, [0x00] * count)
+
+	def xfer2(self, data):
+		"""
+		Full duplex transfer with chip select held for the whole transaction
+		"""
+		return self.bus.transfer(self, data)
+
+	def qualify(self, sample, tolerance, samples=16):
+		"""
+		Select the fastest clock at which sample() agrees with a reference taken at SPEED_MIN
+		sample() returns a numeric reading, or None if the frame failed the device's own integrity checks
+		A speed qualifies only if every one of samples readings is within tolerance of the reference
+		"""
+		with self.bus.lock:
+			self.speed_hz = SPEED_MIN
+			reference = sample()
+			if reference is None:
+				SmokeLog.common.error("SPI {bus}.{cs} failed integrity check at {speed} Hz, leaving clock at minimum".format(bus=self.bus.bus, cs=self.chip_select, speed=SPEED_MIN))
+				return self.speed_hz
+			for speed in [speed for speed in SPEEDS if speed <= self.max_speed_hz]:
+				self.speed_hz = speed
+				readings = [sample() for _ in range(samples)]
+				if all(reading is not None and abs(reading - reference) <= tolerance for reading in readings):
+					break
+			SmokeLog.common.notice("SPI {bus}.{cs} qualified at {speed} Hz".format(bus=self.bus.bus, cs=self.chip_select, speed=self.speed_hz))
+			return self.speed_hz
+
+	def close(self):
+		"""
+		Release this handle, hardware SPI for the chip select is closed once its last handle is released
+		"""
+		if not self.closed:
+			self.closed = True
+			self.bus.release(self)
+
+class SPIBus:
+	"""
+	Serializes transactions for all devices on one hardware SPI bus
+	"""
+	def __init__(self, bus):
+		self.bus = bus
+		self.lock = threading.RLock() # Reentrant so callers can batch several transfers under one acquisition
+		self.devices = {}
+		self.references = {} # Open SPIDevice handles per chip select
+
+	def device(self, chip_select, mode=0b01, max_speed_hz=5000000):
+		"""
+		Returns SPIDevice handle for chip_select, opening hardware SPI if necessary
+		"""
+		with self.lock:
+			if chip_select not in self.devices:
+				spi = spidev.SpiDev()
+				spi.open(self.bus, chip_select)
+				spi.mode = mode
+				spi.max_speed_hz = SPEED_MIN
+				self.devices[chip_select] = spi
+				self.references[chip_select] = 0
+			self.references[chip_select] += 1
+			handle = SPIDevice(self, chip_select, mode, SPEED_MIN)
+			handle.max_speed_hz = max_speed_hz
+			return handle
+
+	def transfer(self, device, data):
+		"""
+		Perform one transaction for device at its own mode and clock
+		"""
+		with self.lock:
+			spi = self.devices[device.chip_select]
+			if spi.mode != device.mode:
+				spi.mode = device.mode
+			return spi.xfer2(list(data), device.speed_hz)
+
+	def release(self, device):
+		"""
+		Drop one reference to device's chip select, closing hardware SPI when no handles remain
+		"""
+		with self.lock:
+			if device.chip_select not in self.devices:
+				return
+			self.references[device.chip_select] -= 1
+			if self.references[device.chip_select] == 0:
+				del self.references[device.chip_select]
+				self.devices.pop(device.chip_select).close()
+
+buses = {}
+buses_lock = threading.Lock()
+
+def get(bus=0):
+	"""
+	Returns shared SPIBus manager for hardware bus number
+	"""
+	with buses_lock:
+		if bus not in buses:
+			buses[bus] = SPIBus(bus)
+		return buses[bus]
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
@@ -0,0 +1,507 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Simulator.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Hardware simulator for running firmware components on a plain Linux box.
+install() registers a fake RPi.GPIO module whose pin states live in shared memory, so they are visible
+across forked processes (e.g. the Watchdog supervisor), and a fake spidev module whose MAX31865 / MAX31855
+register reads encode the temperatures in Simulator.hardware. Must be called before importing Smoker / Watchdog.
+
+Usage:
+  Simulator.py watchdog [trials]      measure Watchdog reaction time after a control loop stall
+  Simulator.py hold                   compare PID and MPC Hold controllers on setpoint steps
+  Simulator.py smoke                  compare fixed P-setting and adaptive Smoke mode on fuel use and temperature variance
+  Simulator.py realtime [seconds]     compare control loop latency in-process vs in a real-time process, under CPU load
+  Simulator.py transport [host] [port]  compare heartbeat latency / bytes over per-message HTTP vs MQTT (broker required)
+"""
+
+import collections
+import http.server
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+import types
+
+class FakeGPIO(types.ModuleType):
+	"""
+	Minimal RPi.GPIO stand-in backed by a shared memory pin array
+	"""
+	BCM = 11
+	BOARD = 10
+	OUT = 0
+	IN = 1
+	HIGH = 1
+	LOW = 0
+
+	def __init__(self, pin_count=28):
+		super().__init__("RPi.GPIO")
+		self.pins = multiprocessing.get_context("fork").RawArray("b", pin_count)
+		self.mode = None
+
+	def setwarnings(self, flag):
+		pass
+
+	def setmode(self, mode):
+		self.mode = mode
+
+	def setup(self, channel, direction, initial=None):
+		if initial is not None:
+			self.pins[channel] = int(bool(initial))
+
+	def input(self, channel):
+		return self.pins[channel]
+
+	def output(self, channel, state):
+		self.pins[channel] = int(bool(state))
+
+	def cleanup(self):
+		for channel in range(len(self.pins)):
+			self.pins[channel] = 0
+
+class Hardware:
+	"""
+	Simulated sensor temperatures (°F) read by FakeSpiDev
+	The grill RTD (MAX31865) is on bus 0 chip select 0, any other chip select is a MAX31855 meat probe
+	"""
+	def __init__(self):
+		self.grill = 70.0
+		self.probes = {}
+		self.ambient = 70.0
+
+	def probe(self, bus, chip_select):
+		return self.probes.get((bus, chip_select), self.ambient)
+
+hardware = Hardware()
+
+class FakeSpiDev:
+	"""
+	Minimal spidev.SpiDev stand-in encoding Simulator.hardware temperatures into device registers
+	"""
+	R_VALUE = 1000
+	R_REFERENCE = 4300
+	A = 3.90830E-3
+	B = -5.775E-7
+
+	def __init__(self):
+		self.bus = None
+		self.chip_select = None
+		self.mode = 0
+		self.max_speed_hz = 0
+		self.config = 0x00
+
+	def open(self, bus, chip_select):
+		self.bus = bus
+		self.chip_select = chip_select
+
+	def close(self):
+		pass
+
+	def readbytes(self, count):
+		return self.xfer2([0x00] * count)
+
+	def xfer2(self, data, speed_hz=0, delay_usecs=0, bits_per_word=0):
+		if (self.bus, self.chip_select) == (0, 0):
+			return self.max31865(data)
+		return self.max31855(len(data))
+
+	def max31865(self, data):
+		"""
+		Register file: 0x00 config, 0x01-0x02 RTD code << 1, writes have address bit 7 set
+		"""
+		if data[0] & 0x80:
+			self.config = data[1] & 0b11111101 # Fault clear bit self-clears
+			return [0x00] * len(data)
+		celsius = (hardware.grill - 32) / 1.8
+		resistance = self.R_VALUE * (1 + self.A * celsius + self.B * celsius * celsius)
+		code = max(0, min(0x7FFF, int(resistance / self.R_REFERENCE * 32768))) << 1
+		registers = [self.config, code >> 8, code & 0xFF] + [0x00] * 5
+		address = data[0]
+		return [0x00] + registers[address:address + len(data) - 1]
+
+	def max31855(self, count):
+		"""
+		32-bit frame: 14-bit thermocouple temp (0.25°C) in D31-D18, 12-bit cold junction temp (0.0625°C) in D15-D4
+		"""
+		thermocouple = int(round((hardware.probe(self.bus, self.chip_select) - 32) / 1.8 / 0.25)) & 0x3FFF
+		internal = int(round((hardware.ambient - 32) / 1.8 / 0.0625)) & 0xFFF
+		frame = thermocouple << 18 | internal << 4
+		return [(frame >> shift) & 0xFF for shift in (24, 16, 8, 0)][:count]
+
+def install():
+	"""
+	Register simulated hardware modules, returns the FakeGPIO instance
+	"""
+	if isinstance(sys.modules.get("RPi.GPIO"), FakeGPIO):
+		return sys.modules["RPi.GPIO"]
+	gpio = FakeGPIO()
+	package = types.ModuleType("RPi")
+	package.GPIO = gpio
+	sys.modules["RPi"] = package
+	sys.modules["RPi.GPIO"] = gpio
+	spidev = types.ModuleType("spidev")
+	spidev.SpiDev = FakeSpiDev
+	sys.modules["spidev"] = spidev
+	return gpio
+
+class GrillModel:
+	"""
+	Pellet grill thermal model: pellets fed by the auger reach the fire pot after dead_time, the fire pot smooths
+	auger pulses with burn_time, and grill temperature lags fire output with time_constant. Stepped in 1s increments.
+	"""
+	def __init__(self, gain=350.0, time_constant=300.0, dead_time=60, burn_time=30.0, ambient=70.0, temp=None):
+		self.gain = gain
+		self.time_constant = time_constant
+		self.burn_time = burn_time
+		self.ambient = ambient
+		self.temp = ambient if temp is None else temp
+		self.fire = (self.temp - ambient) / gain
+		self.feed = collections.deque([self.fire] * dead_time)
+
+	def step(self, auger_on):
+		"""
+		Advance one second with the auger relay in the given state, returns grill temp (°F)
+		"""
+		self.feed.append(1.0 if auger_on else 0.0)
+		self.fire += (self.feed.popleft() - self.fire) / self.burn_time
+		self.temp += (self.ambient + self.gain * self.fire - self.temp) / self.time_constant
+		return self.temp
+
+class VirtualClock:
+	"""
+	Stand-in for the time module's time() so controllers can run faster than real time
+	"""
+	def __init__(self, start=0.0):
+		self.now = start
+
+	def time(self):
+		return self.now
+
+# MARK: SCENARIOS
+
+def measure_watchdog(trials=10, heartbeat_timeout=1.0, poll_interval=0.05):
+	"""
+	Stall a simulated control loop with the igniter and auger energized, and measure how long the Watchdog
+	takes to make the relays safe after the heartbeat deadline passes. Returns (list of reaction times s, reaction_bound s).
+	"""
+	gpio = install()
+	import Watchdog # pylint: disable=C0415
+	relays = {"auger": 16, "fan": 13, "igniter": 18}
+	reactions = []
+	for _ in range(trials):
+		for pin in relays.values():
+			gpio.setup(pin, gpio.OUT, initial=False)
+		watchdog = Watchdog.Watchdog(relays, heartbeat_timeout=heartbeat_timeout, poll_interval=poll_interval)
+		watchdog.start()
+		gpio.output(relays["auger"], True)
+		gpio.output(relays["igniter"], True)
+		for _ in range(5):
+			watchdog.beat(250)
+			time.sleep(poll_interval)
+		while watchdog.tripped() is None: # Control loop hangs here
+			time.sleep(poll_interval / 10)
+		assert not gpio.input(relays["auger"]) and not gpio.input(relays["igniter"]) and gpio.input(relays["fan"])
+		reactions.append(watchdog.reaction_time())
+		watchdog.stop()
+	return reactions, watchdog.reaction_bound()
+
+def simulate_hold(controller, setpoints, start_temp=180.0, period=20, u_min=0.15, u_max=1.0, plant=None):
+	"""
+	Run a Hold controller ("pid" or "mpc") against a GrillModel in virtual time, mirroring Smokestack's Hold loop:
+	duty u is updated every period seconds and the auger runs for the first u * period seconds of each cycle.
+	setpoints is a list of (start time s, target °F); returns list of (time, temp, target, u) once per second.
+	"""
+	install()
+	import MPC # pylint: disable=C0415
+	import PID # pylint: disable=C0415
+	plant = plant or GrillModel(temp=start_temp)
+	clock = VirtualClock()
+	previous_time, PID.time = PID.time, clock # PID.update measures its own interval with time.time()
+	try:
+		pid = PID.PID(60.0, 180.0, 45.0, target=setpoints[0][1])
+		mpc = MPC.MPC(u_min=u_min, u_max=u_max)
+		history = collections.deque(maxlen=6) # Smoker.grill_history: last 6 reads, 10s apart
+		duration = setpoints[-1][0] + 3 * 60 * 60
+		trace = []
+		target, u = None, u_min
+		for second in range(duration):
+			clock.now = float(second)
+			retargeted = False
+			for start, setpoint in setpoints:
+				if second == start:
+					target = setpoint
+					pid.set_pid_target(target)
+					retargeted = True # Like Smokestack, the first update with a new target comes one period later
+			if second % 10 == 0:
+				history.append(plant.temp)
+			if second % period == 0 and not retargeted:
+				if controller == "pid":
+					u = pid.update(sum(history) / len(history))
+				else:
+					u = mpc.update(plant.temp, target)
+				u = min(max(u, u_min), u_max)
+			plant.step(second % period < u * period)
+			trace.append((second, plant.temp, target, u))
+	finally:
+		PID.time = previous_time
+	return trace
+
+def step_response(trace, start, end, band=5.0):
+	"""
+	Returns (settling time s, overshoot °F, RMS error °F) for the setpoint step at start, evaluated until end
+	Settling time is measured to the last excursion outside target +- band
+	"""
+	window = [sample for sample in trace if start <= sample[0] < end]
+	target = window[0][2]
+	direction = 1 if target >= window[0][1] else -1
+	outside = [sample[0] for sample in window if abs(sample[1] - target) > band]
+	settling = (outside[-1] + 1 - start) if outside else 0
+	overshoot = max(0.0, max(direction * (sample[1] - target) for sample in window))
+	rms = math.sqrt(sum((sample[1] - target) ** 2 for sample in window) / len(window))
+	return settling, overshoot, rms
+
+def compare_hold(setpoints=((0, 225), (4 * 60 * 60, 275))):
+	"""
+	Print settling time, overshoot and RMS error per setpoint step for PID and MPC
+	"""
+	import SmokeLog # pylint: disable=C0415
+	SmokeLog.common.set_level("error") # PID logs every retarget at notice
+	setpoints = list(setpoints)
+	bounds = [start for start, _ in setpoints] + [setpoints[-1][0] + 3 * 60 * 60]
+	for controller in ["pid", "mpc"]:
+		trace = simulate_hold(controller, setpoints)
+		for index, (start, target) in enumerate(setpoints):
+			settling, overshoot, rms = step_response(trace, start, bounds[index + 1])
+			print("{controller:<4} step to {target}F: settling {settling:>5.0f}s, overshoot {overshoot:>5.1f}F, rms error {rms:>5.1f}F".format(controller=controller, target=target, settling=settling, overshoot=overshoot, rms=rms))
+
+def simulate_smoke(controller, plant, target=180.0, duration=4 * 60 * 60, changes=()):
+	"""
+	Run Smoke mode ("p-setting" at P2, or "adaptive") against a GrillModel in virtual time, mirroring Smokestack's Smoke
+	loop: each auger cycle runs on_time seconds then pauses off_time seconds, and the adaptive controller is fed the
+	60s grill average when a cycle ends. changes is a list of (time s, GrillModel attribute, value), e.g. wind picking up.
+	Returns list of (time, temp, auger on) once per second.
+	"""
+	install()
+	import AdaptiveSmoke # pylint: disable=C0415
+	smoke = AdaptiveSmoke.AdaptiveSmoke(target)
+	history = collections.deque(maxlen=6) # Smoker.grill_history: last 6 reads, 10s apart
+	on_time, off_time = smoke.on_time, smoke.off_time # Both start at P2
+	cycle_start = 0
+	trace = []
+	for second in range(duration):
+		for time_changed, attribute, value in changes:
+			if second == time_changed:
+				setattr(plant, attribute, value)
+		if second % 10 == 0:
+			history.append(plant.temp)
+		if second - cycle_start >= on_time + off_time:
+			if controller == "adaptive":
+				on_time, off_time = smoke.update(sum(history) / len(history), second - cycle_start)
+			cycle_start = second
+		auger_on = second - cycle_start < on_time
+		plant.step(auger_on)
+		trace.append((second, plant.temp, auger_on))
+	return trace
+
+SMOKE_CONDITIONS = [ # (name, GrillModel parameters: ambient °F and fire gain standing in for pellet quality / wind, changes for simulate_smoke)
+	("mild", {"ambient": 70.0, "gain": 500.0}, ()),
+	("cold, windy", {"ambient": 30.0, "gain": 420.0}, ()),
+	("hot, dense pellets", {"ambient": 95.0, "gain": 580.0}, ()),
+	("wind after 1h", {"ambient": 70.0, "gain": 500.0}, ((60 * 60, "gain", 380.0),))
+]
+
+def compare_smoke(target=180.0, warmup=30 * 60):
+	"""
+	Print pellet use, temperature spread and time in band for the fixed P-setting and adaptive Smoke mode, across
+	SMOKE_CONDITIONS, ignoring the first warmup seconds
+	"""
+	install()
+	import AdaptiveSmoke # pylint: disable=C0415
+	import Smoker # pylint: disable=C0415
+	low, high = target - AdaptiveSmoke.BAND, target + AdaptiveSmoke.BAND
+	for name, parameters, changes in SMOKE_CONDITIONS:
+		for controller in ["p-setting", "adaptive"]:
+			trace = simulate_smoke(controller, GrillModel(temp=target - 20, **parameters), target, changes=changes)[warmup:]
+			temps = [temp for _, temp, _ in trace]
+			pellets = sum(auger_on for _, _, auger_on in trace) / len(trace) * Smoker.AUGER_FEED_RATE
+			in_band = sum(low <= temp <= high for temp in temps) / len(temps)
+			print("{name:<18} {controller:<9}: pellets {pellets:4.2f}lb/h, mean {mean:5.1f}F, stdev {stdev:4.1f}F, in {low:.0f}-{high:.0f}F {in_band:5.1%}".format(name=name, controller=controller, pellets=pellets, mean=statistics.mean(temps), stdev=statistics.pstdev(temps), low=low, high=high, in_band=in_band))
+
+def busy(stop_event):
+	"""
+	CPU hog standing in for other processes on a busy Pi
+	"""
+	while not stop_event.is_set():
+		sum(range(10000))
+
+def networking(stop_event, control):
+	"""
+	Stand-in for Smokestack's networking and logging work: serializes state-sized JSON and sends a command every 50ms
+	"""
+	payload = {"temps": {"probes": [{"current": 150, "target": 203, "eta": 3600.0, "etaConfidence": 0.8}] * 4}, "steps": [{"mode": "Hold", "trigger": "Time", "limit": 3600}] * 50}
+	last_command = 0.0
+	while not stop_event.is_set():
+		json.loads(json.dumps(payload))
+		if time.monotonic() - last_command > 0.05:
+			control.send("ping")
+			last_command = time.monotonic()
+
+def measure_realtime(duration=10.0, period=0.02, hogs=None):
+	"""
+	Run a control loop (simulated sensor reads + PID) under CPU load in two layouts: in the networking process, and in
+	a SCHED_FIFO child process. Returns {layout: loop stats dict}, latencies in seconds
+	"""
+	install()
+	import PID # pylint: disable=C0415
+	import Realtime # pylint: disable=C0415
+	import SmokeLog # pylint: disable=C0415
+	import Smoker # pylint: disable=C0415
+	SmokeLog.common.set_level("error")
+	smoker = Smoker.Smoker()
+	pid = PID.PID(60.0, 180.0, 45.0, target=225)
+	def step():
+		smoker.read_temps()
+		pid.update(smoker.average_for_pid)
+	context = multiprocessing.get_context("fork")
+	stop_event = context.Event()
+	workers = [context.Process(target=busy, args=(stop_event,), daemon=True) for _ in range(hogs if hogs is not None else os.cpu_count())]
+	for worker in workers:
+		worker.start()
+	results = {}
+	try:
+		control = Realtime.ControlProcess(step, {"ping": lambda: None}, "", lambda: [], period=period)
+		noise_stop = threading.Event()
+		noise = threading.Thread(target=networking, args=(noise_stop, control), daemon=True)
+		noise.start()
+		end = time.monotonic() + duration
+		control.loop(lambda: time.monotonic() > end)
+		noise_stop.set()
+		noise.join()
+		control.stats.summarize()
+		results["in-process"] = dict(zip(["loops", "latency_p50", "latency_p99", "latency_max", "command_latency_max", "step_time_max", "step_time_mean"], control.stats.values()))
+
+		control = Realtime.ControlProcess(step, {"ping": lambda: None}, "", lambda: [], period=period, cpus={os.cpu_count() - 1})
+		control.start()
+		noise_stop = threading.Event()
+		noise = threading.Thread(target=networking, args=(noise_stop, control), daemon=True)
+		noise.start()
+		time.sleep(duration)
+		noise_stop.set()
+		noise.join()
+		results["realtime"] = control.read()[2]
+		control.stop()
+	finally:
+		stop_event.set()
+		for worker in workers:
+			worker.join()
+	return results
+
+class HeartbeatHandler(http.server.BaseHTTPRequestHandler):
+	"""
+	Minimal Vapor /smoker/heartbeat stand-in, counts bytes on the wire in both directions
+	"""
+	bytes_in = 0
+	bytes_out = 0
+
+	def do_POST(self): # pylint: disable=C0103
+		body = self.rfile.read(int(self.headers["Content-Length"]))
+		HeartbeatHandler.bytes_in += len(self.requestline) + 2 + len(str(self.headers)) + len(body)
+		response = b'{"program":null,"state":null}'
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(response)))
+		self.end_headers()
+		self.wfile.write(response)
+		HeartbeatHandler.bytes_out += len(response) + 128 # Status line and headers, approximately
+
+	def log_message(self, format, *args): # pylint: disable=W0622
+		pass
+
+def measure_transport(host="localhost", port=1883, samples=200):
+	"""
+	Send the same heartbeat-sized payload as Smokestack.post_heartbeat (new HTTP connection per request) and over
+	Transport.MQTTTransport (one persistent connection, QoS 1), and time a command round trip over MQTT
+	Returns {name: {"latency": [s, ...], "bytes": per message}}
+	"""
+	import paho.mqtt.client as mqtt # pylint: disable=C0415
+	import requests # pylint: disable=C0415
+	import SmokeLog # pylint: disable=C0415
+	import SmokerState # pylint: disable=C0415
+	import Transport # pylint: disable=C0415
+	SmokeLog.common.set_level("error")
+	state = SmokerState.SmokerState(probes=4, mode="Hold", online=True, power=True, grillCurrent=226, grillTarget=225, probeCurrent=151, probeTarget=203, probeConnected=True)
+	for index in range(4):
+		state.set_probe(index, current=151 + index, target=203, eta=3600.0 + index, etaConfidence=0.8)
+	payload = state.snapshot(compact=True)
+	results = {}
+
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), HeartbeatHandler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	url = "http://127.0.0.1:{port}/api/smoker/heartbeat".format(port=server.server_address[1])
+	latencies = []
+	for _ in range(samples):
+		started = time.perf_counter()
+		requests.post(url, headers={"Firmware-Version": "simulator"}, json=payload, auth=requests.auth.HTTPBasicAuth("firmware", "password"), timeout=5).json()
+		latencies.append(time.perf_counter() - started)
+	server.shutdown()
+	results["http"] = {"latency": latencies, "bytes": (HeartbeatHandler.bytes_in + HeartbeatHandler.bytes_out) / samples}
+
+	prefix = "smokestack-simulator-{pid}".format(pid=os.getpid())
+	transport = Transport.MQTTTransport(host, port, prefix=prefix, qos=1)
+	transport.start()
+	deadline = time.monotonic() + 5
+	while not transport.connected:
+		if time.monotonic() > deadline:
+			transport.close()
+			raise ConnectionError("no MQTT broker at {host}:{port}".format(host=host, port=port))
+		time.sleep(0.01)
+	latencies = []
+	for _ in range(samples):
+		started = time.perf_counter()
+		transport.publish("history", payload).wait_for_publish()
+		latencies.append(time.perf_counter() - started)
+	topic = transport.topic("history")
+	body = len(json.dumps(payload, separators=(",", ":")))
+	remaining = 2 + len(topic) + 2 + body
+	results["mqtt"] = {"latency": latencies, "bytes": 1 + (1 if remaining < 128 else 2) + remaining + 4} # PUBLISH + PUBACK
+
+	commander = mqtt.Client()
+	commander.connect(host, port)
+	commander.loop_start()
+	latencies = []
+	for _ in range(samples // 4):
+		started = time.perf_counter()
+		commander.publish(transport.topic("command/state"), json.dumps(payload), qos=1)
+		while len(transport.poll()) == 0:
+			time.sleep(0.0005)
+		latencies.append(time.perf_counter() - started)
+	results["mqtt command"] = {"latency": latencies, "bytes": None}
+	commander.loop_stop()
+	commander.disconnect()
+	for name in ["state", "history"]:
+		transport.client.publish(transport.topic(name), b"", retain=True).wait_for_publish() # Clear retained test messages
+	transport.close()
+	return results
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2 or sys.argv[1] not in ["watchdog", "hold", "smoke", "realtime", "transport"]:
+		sys.exit(__doc__.strip())
+	if sys.argv[1] == "transport":
+		for name, result in measure_transport(sys.argv[2] if len(sys.argv) > 2 else "localhost", int(sys.argv[3]) if len(sys.argv) > 3 else 1883).items():
+			print("{name:<13} latency median {median:6.2f}ms p99 {p99:6.2f}ms{size}".format(name=name, median=statistics.median(result["latency"]) * 1000, p99=sorted(result["latency"])[int(len(result["latency"]) * 0.99)] * 1000, size=", {bytes:.0f} bytes/message".format(bytes=result["bytes"]) if result["bytes"] else ""))
+	if sys.argv[1] == "realtime":
+		for layout, stats in measure_realtime(duration=float(sys.argv[2]) if len(sys.argv) > 2 else 10.0).items():
+			print("{layout:<11} {loops:>6} loops, wake-up latency p50 {p50:7.2f}ms p99 {p99:7.2f}ms max {max:7.2f}ms, command latency max {command:7.2f}ms, step {step:5.2f}ms".format(layout=layout, loops=stats["loops"], p50=stats["latency_p50"] * 1000, p99=stats["latency_p99"] * 1000, max=stats["latency_max"] * 1000, command=stats["command_latency_max"] * 1000, step=stats["step_time_mean"] * 1000))
+	if sys.argv[1] == "hold":
+		compare_hold()
+	if sys.argv[1] == "smoke":
+		compare_smoke()
+	if sys.argv[1] == "watchdog":
+		results, bound = measure_watchdog(trials=int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+		print("watchdog reaction after stall deadline: mean {mean:.3f}s, max {max:.3f}s over {n} trials (bound {bound}s)".format(mean=statistics.mean(results), max=max(results), n=len(results), bound=bound))
@@ -8,14 +8,35 @@ https://github.com/magnolialogic/smokestack-firmware
 import syslog
 import sys
 
+LEVELS = {
+	"debug": syslog.LOG_DEBUG,
+	"info": syslog.LOG_INFO,
+	"notice": syslog.LOG_NOTICE,
+	"error": syslog.LOG_ERR
+}
+DEFAULT_LEVEL = "debug"		# Log everything unless config.yaml sets a valid log-level
+
 class SmokeLog:
 	"""
 	Syslog logger for Smokestack firmware
 	"""
+	threshold = LEVELS[DEFAULT_LEVEL] # Least severe priority that is logged, messages below it are dropped before formatting
 
 	def __init__(self):
 		syslog.openlog(ident="smokestack", logoption=syslog.LOG_PID, facility=syslog.LOG_DAEMON)
 
+	@staticmethod
+	def set_level(level):
+		"""
+		Drop messages less severe than level ("debug", "info", "notice", "error") from STDOUT and syslog
+		Falls back to DEFAULT_LEVEL (with an error) if level is unknown, so a typo in config.yaml can't stop boot
+		"""
+		if not isinstance(level, str) or level not in LEVELS:
+			SmokeLog.threshold = LEVELS[DEFAULT_LEVEL]
+			SmokeLog.error("unknown log level {level}, expected one of {levels}: logging {default} and above".format(level=level, levels=", ".join(LEVELS), default=DEFAULT_LEVEL))
+			return
+		SmokeLog.threshold = LEVELS[level]
+
 	def syslog_formatted(sender, message):
 		"""
 		Prints message to STDOUT and then condenses whitespace + removes newlines to clean up syslog output
@@ -30,6 +51,8 @@ class SmokeLog:
 		"""
 		Send message to syslog with Debug priority
 		"""
+		if syslog.LOG_DEBUG > SmokeLog.threshold:
+			return
 		sender = sys._getframe(1).f_code.co_name
 		syslog.syslog(syslog.LOG_DEBUG, SmokeLog.syslog_formatted(sender, message))
 
@@ -38,6 +61,8 @@ class SmokeLog:
 		"""
 		Send message to syslog with Info priority
 		"""
+		if syslog.LOG_INFO > SmokeLog.threshold:
+			return
 		sender = sys._getframe(1).f_code.co_name
 		syslog.syslog(syslog.LOG_INFO, SmokeLog.syslog_formatted(sender, message))
 
@@ -46,6 +71,8 @@ class SmokeLog:
 		"""
 		Send message to syslog with Notice priority
 		"""
+		if syslog.LOG_NOTICE > SmokeLog.threshold:
+			return
 		sender = sys._getframe(1).f_code.co_name
 		syslog.syslog(syslog.LOG_NOTICE, SmokeLog.syslog_formatted(sender, message))
 
@@ -54,6 +81,8 @@ class SmokeLog:
 		"""
 		Send message to syslog with Error priority
 		"""
+		if syslog.LOG_ERR > SmokeLog.threshold:
+			return
 		sender = sys._getframe(1).f_code.co_name
 		syslog.syslog(syslog.LOG_ERR, SmokeLog.syslog_formatted(sender, message))
 
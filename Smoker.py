@@ -5,18 +5,34 @@ Smoker.py
 https://github.com/magnolialogic/smokestack-firmware
 """
 
+import collections
 import sys
 import time
 import RPi.GPIO as GPIO
+from AdaptiveSmoke import AdaptiveSmoke
+from Disturbance import DisturbanceDetector
+from Estimator import CookEstimator
+import FlightRecorder
+from MPC import MPC
 from PID import PID
 import SmokeLog
+from SmokerState import SmokerState
 import TempSensor
 
+AUGER_FEED_RATE = 8.0		# Pellets (lb/h) fed with the auger running continuously, override with auger-feed-rate in config.yaml
+FEED_WINDOW = 60 * 60		# Period (s) pellet feed rate is averaged over
+
 class Smoker:
 	"""
 	Smoker state machine for Smokestack firmware
 	"""
-	def __init__(self):
+	def __init__(self, probes=None, controller="pid", smoke="adaptive", auger_feed_rate=AUGER_FEED_RATE):
+		"""
+		probes is a list of {"chip_select": int, "bus": int} meat probe channels, defaults to a single probe on chip select 1
+		controller selects the Hold mode controller, "pid" or "mpc"
+		smoke selects the Smoke mode auger cycle, "adaptive" or the fixed "p-setting"
+		auger_feed_rate is pellets (lb/h) fed with the auger running continuously
+		"""
 		SmokeLog.common.info("FIRE IT UP")
 		self.relays = {
 			"auger": 16,
@@ -24,7 +40,7 @@ class Smoker:
 			"igniter": 18
 		}
 		self.sensors = {
-			"probe": TempSensor.MAX31855(chip_select=1),
+			"probes": TempSensor.ProbeArray(probes or [{"chip_select": 1}]),
 			"grill": TempSensor.MAX31865(chip_select=0)
 		}
 		self.connected = False
@@ -35,9 +51,27 @@ class Smoker:
 		self.timers = {}
 		self.timers["last_pid_update"] = None
 		self.timers["last_heartbeat"] = None
+		self.timers["last_grill_sample"] = None
+		self.timers["last_read_temps"] = None
+		self.timers["last_control_stats"] = None
+		self.timers["last_smoke_update"] = None
 		self.timers["last_toggled"] = {}
 		self.grill_history = []
 		self.average_for_pid = None
+		self.estimators = [CookEstimator() for _ in range(len(self.sensors["probes"]))]
+		self.probe_target = (0, None)
+		self.disturbance = DisturbanceDetector()
+		if controller not in ["pid", "mpc"]:
+			SmokeLog.common.error("unknown controller {controller}, using pid".format(controller=controller))
+			controller = "pid"
+		self.controller = controller
+		self.mpc = MPC() # Identified grill model survives initialize(), so it carries over between cooks
+		if smoke not in ["adaptive", "p-setting"]:
+			SmokeLog.common.error("unknown smoke mode {smoke}, using adaptive".format(smoke=smoke))
+			smoke = "adaptive"
+		self.smoke_control = smoke
+		self.smoke = AdaptiveSmoke() # Learned like the MPC model, carries over between cooks
+		self.auger_feed_rate = auger_feed_rate
 		self.initialize()
 
 	def initialize(self):
@@ -47,21 +81,11 @@ class Smoker:
 		time_startup = time.time()
 		GPIO.setwarnings(False)
 		GPIO.setmode(GPIO.BCM)
-		self.thermocouple_connected = self.sensors["probe"].connected
+		self.thermocouple_connected = any(self.sensors["probes"].connected)
 		self.timers["boot"] = time_startup
 		self.timers["last_program_started"] = time_startup
-		self.state = {
-			"mode": "Idle",
-			"online": self.connected,
-			"power": False,
-			"temps": {
-				"grillCurrent": self.sensors["grill"].read(),
-				"grillTarget": None,
-				"probeCurrent": None,
-				"probeTarget": None
-				},
-			"probeConnected": self.thermocouple_connected
-		}
+		self.auger_runs = collections.deque() # (time switched off, seconds on) for each auger run in the last FEED_WINDOW
+		self.state = SmokerState(probes=len(self.sensors["probes"]), online=self.connected, grillCurrent=self.sensors["grill"].read(), probeConnected=self.thermocouple_connected)
 		self.pid_values = { #60, 45, 180 holds +- 5F
 			"PB": 60.0,
 			"Td": 45.0,
@@ -90,8 +114,12 @@ class Smoker:
 		"""
 		if not self.get_state(relay) == target_state:
 			SmokeLog.common.debug("{relay} {current_state} -> {target_state}".format(relay=relay, current_state=self.get_state(relay), target_state=target_state))
-			self.timers["last_toggled"][relay] = time.time()
+			now = time.time()
+			if relay == "auger" and not target_state and relay in self.timers["last_toggled"]:
+				self.auger_runs.append((now, now - self.timers["last_toggled"][relay]))
+			self.timers["last_toggled"][relay] = now
 			GPIO.output(self.relays[relay], target_state)
+			FlightRecorder.common.record(FlightRecorder.RELAY, relay, target_state)
 
 	def timer_expired(self, timer, timeout):
 		"""
@@ -102,26 +130,123 @@ class Smoker:
 		else:
 			return False
 
+	def pellet_rate(self):
+		"""
+		Returns pellet feed (lb/h) from auger on-time over the last FEED_WINDOW, or since boot if sooner
+		"""
+		now = time.time()
+		while len(self.auger_runs) > 0 and now - self.auger_runs[0][0] > FEED_WINDOW:
+			self.auger_runs.popleft()
+		on_time = sum(seconds for _, seconds in self.auger_runs)
+		if self.get_state("auger"):
+			on_time += now - self.timers["last_toggled"]["auger"]
+		elapsed = min(now - self.timers["boot"], FEED_WINDOW)
+		return min(on_time / elapsed, 1.0) * self.auger_feed_rate if elapsed > 0 else 0.0
+
+	def set_auger_cycle(self, auger_on, auger_off):
+		"""
+		Set auger on and off times (s), as cycle length and duty
+		"""
+		self.pid_values["cycle_timer"] = auger_on + auger_off
+		self.pid_values["u"] = auger_on / (auger_on + auger_off)
+
 	def set_pause_cycle(self, pSetting=2):
 		"""
 		Set pause time for auger in Smoke mode
 		http://tipsforbbq.com/Definition/Traeger-P-Setting
 		"""
-		auger_on = 15
-		auger_off = 45 + pSetting * 10
-		self.pid_values["cycle_timer"] = auger_on + auger_off
-		self.pid_values["u"] = auger_on / (auger_on + auger_off)
+		self.set_auger_cycle(15, 45 + pSetting * 10)
+
+	def sample_grill(self):
+		"""
+		Read grill temperature and feed disturbance detector, returns grill temp
+		"""
+		grill_current = self.sensors["grill"].read()
+		self.timers["last_grill_sample"] = time.time()
+		self.state.grillCurrent = grill_current
+		FlightRecorder.common.record(FlightRecorder.SAMPLE, "grill", grill_current)
+		target = self.smoke.target if self.state.mode == "Smoke" else self.state.grillTarget
+		self.disturbance.update(self.timers["last_grill_sample"], grill_current, self.state.mode in ["Smoke", "Hold"], target)
+		return grill_current
 
 	def read_temps(self):
 		"""
 		Read and log current temperatures
 		"""
-		grill_current = self.sensors["grill"].read()
-		self.state["temps"]["grillCurrent"] = grill_current
+		grill_current = self.sample_grill()
+		self.timers["last_read_temps"] = self.timers["last_grill_sample"]
 		self.grill_history.append(grill_current)
 		self.grill_history = self.grill_history[-6:]
 		self.average_for_pid = sum(self.grill_history) / len(self.grill_history)
-		self.state["temps"]["probeCurrent"] = self.sensors["probe"].read()
+		probe_temps = self.sensors["probes"].scan()
+		now = time.time()
+		for index, (probe, estimator, temp) in enumerate(zip(self.state.probes, self.estimators, probe_temps)):
+			FlightRecorder.common.record(FlightRecorder.SAMPLE, f"probe{index}", temp)
+			estimator.update(now, temp)
+			if probe.target is not None:
+				eta, confidence = estimator.estimate(probe.target)
+				self.state.set_probe(index, current=temp, eta=eta, etaConfidence=confidence)
+			else:
+				self.state.set_probe(index, current=temp)
+		self.state.probeCurrent = probe_temps[0]
+		self.state.probeConnected = any(self.sensors["probes"].connected)
+		self.state.pelletRate = round(self.pellet_rate(), 2)
+		self.update_eta()
+
+	def update_eta(self):
+		"""
+		Publish ETA for the current probe target: a "min" group finishes with its slowest probe, "max" with its fastest
+		"""
+		probe, group = self.probe_target
+		estimates = [self.state.probes[index] for index in self.probe_selection(probe, group)]
+		estimates = [entry for entry in estimates if entry.target is not None and entry.eta is not None]
+		if len(estimates) == 0:
+			self.state.eta, self.state.etaConfidence = None, None
+			return
+		pick = max if probe == "min" else min
+		chosen = pick(estimates, key=lambda entry: entry.eta)
+		self.state.eta, self.state.etaConfidence = chosen.eta, chosen.etaConfidence
+
+	def probe_selection(self, probe=0, group=None):
+		"""
+		Returns indices of connected probes addressed by a program step
+		probe is a single probe index, or "min" / "max" to aggregate over group (list of indices, default all probes)
+		Anything that isn't an index of a probe on this smoker is ignored
+		"""
+		connected = self.sensors["probes"].connected
+		if probe in ["min", "max"]:
+			indices = group if isinstance(group, list) else range(len(connected))
+		else:
+			indices = [probe]
+		return [index for index in indices if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < len(connected) and connected[index]]
+
+	def probe_reading(self, probe=0, group=None):
+		"""
+		Returns current temperature for probe selection (see probe_selection), or None if no selected probe has a reading
+		"""
+		temps = [self.state.probes[index].current for index in self.probe_selection(probe, group)]
+		temps = [temp for temp in temps if temp is not None]
+		if len(temps) == 0:
+			return None
+		if probe == "min":
+			return min(temps)
+		if probe == "max":
+			return max(temps)
+		return temps[0]
+
+	def set_probe_target(self, target, probe=0, group=None):
+		"""
+		Set target on selected probes and clear it on all others, target None clears all probe targets
+		"""
+		selected = self.probe_selection(probe, group) if target is not None else []
+		for index in range(len(self.state.probes)):
+			if index in selected:
+				self.state.set_probe(index, target=target)
+			else:
+				self.state.set_probe(index, target=None, eta=None, etaConfidence=None)
+		self.state.probeTarget = target
+		self.probe_target = (probe, group)
+		self.update_eta()
 
 if __name__ == "__main__":
 	sys.exit("I am a module, not a script.")
\ No newline at end of file
@@ -0,0 +1,147 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+SmokerState.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Typed smoker state, mirroring Vapor's State model
+Fields are __slots__ attributes named as on the wire (temps are flattened), and assigning a new value marks the field
+dirty. snapshot() publishes dirty fields into a new immutable wire dict that shares every unchanged part with the
+previous snapshot, so publishing costs O(changed fields) and the snapshot is handed to requests as-is. Changes made
+inside transaction() stay invisible to snapshot() until the outermost transaction exits. There is no rollback: relays
+and controllers may already have acted on a change, so callers validate input before opening a transaction, and a
+transaction that raises drops its deferred pushes instead.
+"""
+
+import collections
+import contextlib
+import sys
+
+FIELDS = ("mode", "online", "power", "probeConnected", "eta", "etaConfidence", "pelletRate", "event")
+TEMPS = ("grillCurrent", "grillTarget", "probeCurrent", "probeTarget") # Serialized under "temps", along with probes
+UNSET = object()
+
+ProbeState = collections.namedtuple("ProbeState", ["current", "target", "eta", "etaConfidence"], defaults=[None, None, None, None])
+
+class FrozenDict(dict):
+	"""
+	dict that refuses mutation, serializes as a plain JSON object
+	"""
+	def _immutable(self, *args, **kwargs):
+		raise TypeError("state snapshots are immutable")
+
+	__setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+class SmokerState:
+	"""
+	Smoker state with dirty tracking, snapshots and transactions
+	"""
+	__slots__ = FIELDS + TEMPS + ("probes", "_dirty", "_snapshot", "_compact", "_probes", "_depth", "_deferred")
+
+	def __init__(self, probes=1, **values):
+		"""
+		probes is the number of probe channels, values overrides field defaults
+		"""
+		for name, value in [("_dirty", set()), ("_snapshot", None), ("_compact", None), ("_probes", ()), ("_depth", 0), ("_deferred", [])]:
+			object.__setattr__(self, name, value)
+		for name in FIELDS + TEMPS:
+			setattr(self, name, None)
+		self.mode = "Idle"
+		self.online = False
+		self.power = False
+		self.probeConnected = False
+		self.probes = tuple(ProbeState() for _ in range(probes))
+		for name, value in values.items():
+			setattr(self, name, value)
+		self.snapshot()
+
+	def __setattr__(self, name, value):
+		if name[0] != "_":
+			previous = getattr(self, name, UNSET)
+			if previous is value or (previous == value and type(previous) is type(value)): # 1 == True == 1.0, but the wire tells them apart
+				return
+			self._dirty.add(name)
+		object.__setattr__(self, name, value)
+
+	def __repr__(self):
+		return "SmokerState({wire})".format(wire=self.snapshot())
+
+	def set_probe(self, index, **values):
+		"""
+		Replace fields of one probe channel, e.g. set_probe(0, current=150)
+		"""
+		probes = list(self.probes)
+		probes[index] = probes[index]._replace(**values)
+		self.probes = tuple(probes)
+
+	def snapshot(self, compact=False):
+		"""
+		Returns immutable wire dict of committed state
+		compact omits unset (None) temps, as /smoker/boot and /smoker/heartbeat expect
+		"""
+		if self._dirty and self._depth == 0:
+			self.publish()
+		return self._compact if compact else self._snapshot
+
+	def publish(self):
+		"""
+		Build snapshot for dirty fields, reusing everything else from the previous snapshot
+		"""
+		dirty = self._dirty
+		previous = self._snapshot or dict(dict.fromkeys(("mode", "online", "power", "temps") + FIELDS[3:]), temps={"probes": ()}) # Vapor's key order
+		wire = dict(previous)
+		for name in dirty.intersection(FIELDS):
+			wire[name] = getattr(self, name)
+		compact = self._compact["temps"] if self._compact is not None else None
+		if "probes" in dirty or not dirty.isdisjoint(TEMPS):
+			probes = previous["temps"]["probes"]
+			if "probes" in dirty:
+				published = dict(zip(map(id, self._probes), probes))
+				probes = tuple(published.get(id(probe)) or FrozenDict(probe._asdict()) for probe in self.probes)
+				object.__setattr__(self, "_probes", self.probes)
+			temps = {name: getattr(self, name) for name in TEMPS}
+			wire["temps"] = FrozenDict(temps, probes=probes)
+			compact = FrozenDict({name: value for name, value in temps.items() if value is not None}, probes=probes)
+		object.__setattr__(self, "_snapshot", FrozenDict(wire))
+		object.__setattr__(self, "_compact", FrozenDict(wire, temps=compact) if compact is not None else self._snapshot)
+		dirty.clear()
+
+	@contextlib.contextmanager
+	def transaction(self):
+		"""
+		Publish several changes together: snapshot() keeps returning the pre-transaction state until the outermost
+		transaction exits, and callbacks passed to defer() run once it does
+		If an exception escapes, deferred callbacks are dropped so a half-applied update is never pushed (e.g. to
+		Vapor); the changes themselves are kept, so state never disagrees with side effects (relays, control commands)
+		that already happened
+		"""
+		if self._depth == 0:
+			self.snapshot()
+		object.__setattr__(self, "_depth", self._depth + 1)
+		try:
+			yield self
+		except BaseException:
+			object.__setattr__(self, "_depth", self._depth - 1)
+			if self._depth == 0:
+				self._deferred.clear()
+			raise
+		object.__setattr__(self, "_depth", self._depth - 1)
+		if self._depth == 0:
+			deferred = list(self._deferred)
+			self._deferred.clear()
+			for callback in deferred:
+				callback()
+
+	def defer(self, callback):
+		"""
+		Returns True if callback has been queued to run once the open transaction exits (duplicates run once),
+		False if no transaction is open and the caller should go ahead now
+		"""
+		if self._depth == 0:
+			return False
+		if callback not in self._deferred:
+			self._deferred.append(callback)
+		return True
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
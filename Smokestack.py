@@ -5,15 +5,20 @@ Smokestack.py
 https://github.com/magnolialogic/smokestack-firmware
 """
 
-import copy
+import FlightRecorder
 import json
 import os
+import ProgramCache
+import Realtime
 import requests
 import SmokeLog
 import Smoker
+import SmokerState
 import sys
 import time
 import traceback
+import Transport
+import Watchdog
 import yaml
 
 # MARK: CONSTANTS
@@ -23,17 +28,32 @@ SMOKESTACK_FIRMWARE_PATH = os.path.dirname(os.path.realpath(__file__)) #whereami
 SMOKESTACK_FIRMWARE_VERSION = "2.0.0a (2021.12.15)"
 FREQUENCY_POST_BOOT = 10		# Period (s) between calls to /smoker/boot during startup
 FREQUENCY_LOG_TEMPS = 10		# Period (s) between temperature measurements
+FREQUENCY_SAMPLE_GRILL = 2		# Period (s) between grill-only samples for disturbance detection
 FREQUENCY_UPDATE_PID = 20		# Period (s) between control loop updates during Hold mode
 FREQUENCY_IDLE_TIMER = 0.25		# Period (s) between main runloop cycles
+FREQUENCY_LOG_CONTROL = 60		# Period (s) between control process latency reports
 TEMPERATURE_IGNITER = 100		# Upper limit (°F) of grill temperatures that trigger the igniter
 TEMPERATURE_START = 140			# Temp limit (°F) to indicate we've finished Start mode and it's OK to transition into Hold
 TIMEOUT_IGNITER = 15 * 60		# Maximum time (s) igniter should be on
+TIMEOUT_RELIGHT = 5 * 60		# Maximum time (s) igniter stays on trying to re-light after a flame-out
 TIMEOUT_SHUTDOWN = 10 * 60		# Time (s) to run fan after shutdown
+TIMEOUT_REQUEST = 5				# Maximum time (s) to wait on Vapor for connect and for each read
+TIMEOUT_WATCHDOG = 30			# Maximum time (s) between main runloop heartbeats before Watchdog makes relays safe
+TIMEOUT_WATCHDOG_IGNITER = TIMEOUT_IGNITER + 60	# Igniter on-time (s) before Watchdog makes relays safe, margin over manage_igniter's own limit
+TEMPERATURE_MAX = 550			# Upper limit (°F) of grill temperatures before Watchdog makes relays safe
 U_MIN = 0.15 					# Maintenance levels
 U_MAX = 1.0
+MODES = ["Idle", "Start", "Smoke", "Hold", "Keep Warm", "Shutdown", "Off"]
+TRIGGERS = ["Time", "Temp"]
 
 # MARK: NETWORKING METHODS
 
+def record_request(route, started, response=None):
+	"""
+	Record Vapor request outcome (status code, or 0 if the request raised) and latency in flight recorder
+	"""
+	FlightRecorder.common.record(FlightRecorder.HTTP, route, response.status_code if response is not None else 0, time.time() - started)
+
 def post_boot():
 	"""
 	POST /smoker/boot
@@ -41,15 +61,17 @@ def post_boot():
 	Called on boot, posts firmware version ("Firmware-Version" header) and initial state (body)
 	"""
 	route = SMOKESTACK_API_ROOT + "/smoker/boot"
+	started = time.time()
 	try:
-		smoker.state["online"] = True
-		boot_json = copy.deepcopy(smoker.state)
-		boot_json["temps"] = {k: v for k, v in boot_json["temps"].items() if v is not None}
+		smoker.state.online = True
+		boot_json = smoker.state.snapshot(compact=True)
 		SmokeLog.common.info(boot_json)
-		response = requests.post(route, headers={"Firmware-Version": SMOKESTACK_FIRMWARE_VERSION}, json=boot_json, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD))
+		response = requests.post(route, headers={"Firmware-Version": SMOKESTACK_FIRMWARE_VERSION}, json=boot_json, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 	except Exception:
-		sys.exit(SmokeLog.common.error("{code}: request failed to initialize state! {error}".format(code=response.status_code, error=response.text)))
+		record_request("/smoker/boot", started)
+		sys.exit(SmokeLog.common.error("request failed to initialize state! {error}".format(error=traceback.format_exc())))
 	else:
+		record_request("/smoker/boot", started, response)
 		if response.ok:
 			SmokeLog.common.info("ok")
 			smoker.connected = True
@@ -57,6 +79,12 @@ def post_boot():
 			SmokeLog.common.error("{code} vapor offline".format(code=response.status_code))
 			smoker.connected = False
 
+def heartbeat_payload():
+	"""
+	Returns JSON body for /smoker/heartbeat: current state with unset temps omitted
+	"""
+	return smoker.state.snapshot(compact=True)
+
 def post_heartbeat():
 	"""
 	POST /smoker/heartbeat
@@ -66,18 +94,25 @@ def post_heartbeat():
 	"""
 	route = SMOKESTACK_API_ROOT + "/smoker/heartbeat"
 	if smoker.timer_expired("last_heartbeat", FREQUENCY_LOG_TEMPS):
-		heartbeat_json = copy.deepcopy(smoker.state)
-		heartbeat_json["temps"] = {k: v for k, v in smoker.state["temps"].items() if v is not None}
+		heartbeat_json = heartbeat_payload()
 		smoker.timers["last_heartbeat"] = time.time()
 		SmokeLog.common.info(heartbeat_json)
+		for transport in transports:
+			transport.publish_history(history_sample(heartbeat_json))
+		started = time.time()
 		try:
-			response = requests.post(route, headers={"Firmware-Version": SMOKESTACK_FIRMWARE_VERSION}, json=heartbeat_json, auth=requests.auth.HTTPBasicAuth("firmware", SMOKESTACK_PASSWORD))
+			response = requests.post(route, headers={"Firmware-Version": SMOKESTACK_FIRMWARE_VERSION}, json=heartbeat_json, auth=requests.auth.HTTPBasicAuth("firmware", SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 		except Exception:
+			record_request("/smoker/heartbeat", started)
 			smoker.connected = False
 			SmokeLog.common.error("request caught exception!")
 		else:
+			record_request("/smoker/heartbeat", started, response)
 			if response.ok:
-				smoker.connected = True
+				if not smoker.connected:
+					SmokeLog.common.notice("reconnected, revalidating program")
+					smoker.connected = True
+					get_program()
 				SmokeLog.common.info("ok")
 				if response.json()["program"] != None:
 					handle_program_update(response.json()["program"])
@@ -88,17 +123,23 @@ def post_heartbeat():
 
 def put_state():
 	"""
-	Push current state to remote DB (complete replacement)
+	Push current state to remote DB (complete replacement), once any open state transaction has exited
 	"""
+	if smoker.state.defer(put_state):
+		return
 	route = SMOKESTACK_API_ROOT + "/state"
+	state_json = smoker.state.snapshot()
+	started = time.time()
 	try:
-		response = requests.put(route, json=smoker.state, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD))
+		response = requests.put(route, json=state_json, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 	except Exception:
+		record_request("/state", started)
 		sys.exit(SmokeLog.common.error("failed to push updated state! {error}".format(error=traceback.format_exc())))
 	else:
+		record_request("/state", started, response)
 		smoker.timers["last_state_push"] = time.time()
 		if response.ok:
-			SmokeLog.common.info("ok {response}".format(response=smoker.state))
+			SmokeLog.common.info("ok {response}".format(response=state_json))
 		else:
 			SmokeLog.common.error("vapor error: {error}".format(error=response.status_code))
 
@@ -107,82 +148,257 @@ def patch_state(patch_data):
 	Patch specific state keys in remote DB
 	"""
 	route = SMOKESTACK_API_ROOT + "/state"
+	started = time.time()
 	try:
-		response = requests.patch(route, json=patch_data, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD))
+		response = requests.patch(route, json=patch_data, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 	except Exception:
+		record_request("/state", started)
 		sys.exit(SmokeLog.common.error("failed to patch state! {error}".format(error=traceback.format_exc())))
 	else:
+		record_request("/state", started, response)
 		if response.ok:
 			SmokeLog.common.info("ok {response}".format(response=patch_data))
 		else:
 			SmokeLog.common.error("status {code}: failed to patch state! {error}".format(code=response.status_code, error=response.text.translate(str.maketrans("", "", "\"'"))))
 
-def check_for_program_id():
+def get_program():
 	"""
-	Check whether program exists in remote DB
+	GET /program
+
+	Fetch current program id and steps in a single conditional request, revalidating the cached program with If-None-Match
+	Vapor answers 304 if the cached program is still current, or the full program with a new ETag
+	Older Vapor releases return only the program id, in which case steps are fetched (conditionally) by id
 	"""
 	route = SMOKESTACK_API_ROOT + "/program"
+	cached_id, cached = program_cache.current()
+	headers = {"Accept": "application/json"}
+	if cached is not None and cached["etag"] is not None:
+		headers["If-None-Match"] = cached["etag"]
+	started = time.time()
 	try:
-		response = requests.get(route, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD))
+		response = requests.get(route, headers=headers, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 	except Exception:
-		sys.exit(SmokeLog.common.error("failed to get program! {error}".format(error=traceback.format_exc())))
+		record_request("/program", started)
+		SmokeLog.common.error("failed to get program, keeping cached program {id}! {error}".format(id=cached_id, error=traceback.format_exc()))
 	else:
-		if response.ok:
-			SmokeLog.common.notice("found {id}".format(id=response.text))
-			get_steps_for_id(response.text)
+		record_request("/program", started, response)
+		if response.status_code == 304:
+			SmokeLog.common.notice("cached program {id} is current".format(id=cached_id))
+			load_program(cached_id, cached["steps"])
+		elif response.ok:
+			try:
+				program = response.json()
+			except ValueError:
+				program = None
+			if isinstance(program, dict) and "steps" in program:
+				SmokeLog.common.notice("found {id}".format(id=program["id"]))
+				program_cache.store(program["id"], program["steps"], etag=response.headers.get("ETag"))
+				load_program(program["id"], program["steps"])
+			else:
+				SmokeLog.common.notice("found {id}".format(id=response.text))
+				get_steps_for_id(response.text)
 		else:
 			SmokeLog.common.info(response.status_code)
+			if response.status_code == 404:
+				SmokeLog.common.notice("no current program, clearing program {id}".format(id=smoker.program_id))
+				program_cache.clear_current()
+				smoker.program_id = None
+				smoker.program_index = None
+				smoker.program_steps = []
+				if smoker.state.power:
+					set_program() # Program was deleted while running, hand control back
 
 def get_steps_for_id(id):
 	"""
-	Get program data from remote DB
+	Get program data from remote DB, revalidating cached steps for id with If-None-Match
+	Failures keep the current program, like get_program(), so a dropped connection mid-cook doesn't stop the firmware
 	"""
 	route = SMOKESTACK_API_ROOT + "/program/" + id
+	cached = program_cache.get(id)
+	headers = {}
+	if cached is not None and cached["etag"] is not None:
+		headers["If-None-Match"] = cached["etag"]
+	started = time.time()
 	try:
-		response = requests.get(route, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD))
+		response = requests.get(route, headers=headers, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 	except Exception:
-		sys.exit(SmokeLog.common.error("failed to get program! {error}".format(error=traceback.format_exc())))
+		record_request("/program/id", started)
+		SmokeLog.common.error("failed to get program {id}, keeping program {current}! {error}".format(id=id, current=smoker.program_id, error=traceback.format_exc()))
 	else:
-		if response.ok:
-			smoker.program_id = id
-			smoker.program_index = 0
-			smoker.program_steps = response.json()
-			SmokeLog.common.info("found {steps}".format(steps=smoker.program_steps))
+		record_request("/program/id", started, response)
+		if response.status_code == 304:
+			program_cache.store(id, cached["steps"], etag=cached["etag"])
+			load_program(id, cached["steps"])
+		elif response.ok:
+			try:
+				steps = response.json()
+			except ValueError:
+				SmokeLog.common.error("unreadable steps for program {id}, keeping program {current}".format(id=id, current=smoker.program_id))
+				return
+			program_cache.store(id, steps, etag=response.headers.get("ETag"))
+			load_program(id, steps)
 		else:
 			SmokeLog.common.error("status {code}: no program found".format(code=response.status_code))
 
+def load_program(id, steps):
+	"""
+	Make program the smoker's current program, starting from its first step
+	A different program arriving while program control is running is started like a heartbeat program interrupt
+	"""
+	if id == smoker.program_id and steps == smoker.program_steps:
+		return
+	error = program_error({"id": id, "steps": steps})
+	if error is not None:
+		SmokeLog.common.error("rejected program {id}: {error}".format(id=id, error=error))
+		return
+	if smoker.state.power:
+		SmokeLog.common.notice("program changed while running, starting {id}".format(id=id))
+		smoker.program_id = None # Same id with edited steps is still a new program
+		handle_program_update({"id": id, "steps": steps})
+		return
+	smoker.program_id = id
+	smoker.program_index = 0
+	smoker.program_steps = steps
+	SmokeLog.common.info("found {steps}".format(steps=smoker.program_steps))
+
 def delete_program():
 	"""
 	Clear all programs in remote DB
 	"""
 	route = SMOKESTACK_API_ROOT + "/smoker/program"
+	started = time.time()
 	try:
-		response = requests.delete(route, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD))
+		response = requests.delete(route, auth=requests.auth.HTTPBasicAuth(SMOKESTACK_USERNAME, SMOKESTACK_PASSWORD), timeout=TIMEOUT_REQUEST)
 	except Exception:
+		record_request("/smoker/program", started)
 		sys.exit(SmokeLog.common.error("failed to delete program! {error}".format(error=traceback.format_exc())))
 	else:
+		record_request("/smoker/program", started, response)
 		if response.ok:
+			program_cache.clear_current()
 			smoker.timers["last_program_push"] = time.time()
 			SmokeLog.common.info("ok")
 		else:
 			SmokeLog.common.error("status {code}: failed to delete program! {error}".format(code=response.status_code, error=response.text.translate(str.maketrans("", "", "\"'"))))
 
+# MARK: TRANSPORTS
+
+transports = []					# Transport.Transport instances publishing / receiving alongside Vapor, see config "mqtt"
+published_state = None			# Last state snapshot handed to transports
+
+def history_sample(heartbeat_json):
+	"""
+	Returns history sample for transports: heartbeat temps with a timestamp
+	"""
+	return {"timestamp": round(smoker.timers["last_heartbeat"], 3), "mode": heartbeat_json["mode"], "event": heartbeat_json["event"], "temps": heartbeat_json["temps"]}
+
+def publish_state():
+	"""
+	Publish state to transports if it changed since the last publish
+	"""
+	global published_state
+	state = smoker.state.snapshot()
+	if state is not published_state: # Snapshots are immutable and only rebuilt on change, identity is enough
+		published_state = state
+		for transport in transports:
+			transport.publish_state(state)
+
+def poll_transports():
+	"""
+	Apply commands received by transports, in the main loop like Vapor heartbeat interrupts
+	"""
+	for transport in transports:
+		for command, payload in transport.poll():
+			SmokeLog.common.notice("{command} command via {transport}".format(command=command, transport=type(transport).__name__))
+			try:
+				if command == "program":
+					handle_program_update(payload)
+				else:
+					handle_state_update(payload)
+			except (KeyError, TypeError, ValueError):
+				SmokeLog.common.error("rejected malformed {command} command: {error}".format(command=command, error=traceback.format_exc()))
+
 # MARK: HEARTBEAT HANDLERS
 
+def is_temp(value):
+	"""
+	Returns Boolean for a valid temperature field: None or a number
+	"""
+	return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+def is_probe_index(value):
+	"""
+	Returns Boolean for a valid probe index field: a non-negative int
+	"""
+	return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def state_error(new_state):
+	"""
+	Returns why new_state (State JSON from a heartbeat or transport) can't be applied, or None if it is complete and well-typed
+	"""
+	if not isinstance(new_state, dict):
+		return "state is not an object"
+	if not isinstance(new_state.get("mode"), str) or new_state["mode"] not in MODES:
+		return "unknown mode {mode}".format(mode=new_state.get("mode"))
+	if not isinstance(new_state.get("power"), bool):
+		return "power is not a Boolean"
+	if not isinstance(new_state.get("temps"), dict):
+		return "temps is not an object"
+	for key in SmokerState.TEMPS:
+		if key in ["grillTarget", "probeTarget"] and key not in new_state["temps"]:
+			return "missing temps.{key}".format(key=key)
+		if not is_temp(new_state["temps"].get(key)):
+			return "temps.{key} is not a temperature".format(key=key)
+	return None
+
+def program_error(new_program):
+	"""
+	Returns why new_program (Program JSON from a heartbeat or transport) can't be applied, or None if it is complete and well-typed
+	"""
+	if not isinstance(new_program, dict):
+		return "program is not an object"
+	if not isinstance(new_program.get("id"), str):
+		return "id is not a string"
+	if not isinstance(new_program.get("steps"), list) or len(new_program["steps"]) == 0:
+		return "steps is not a list of steps"
+	for index, step in enumerate(new_program["steps"]):
+		if not isinstance(step, dict):
+			return "step {index} is not an object".format(index=index)
+		if not isinstance(step.get("mode"), str) or step["mode"] not in MODES:
+			return "step {index} has unknown mode {mode}".format(index=index, mode=step.get("mode"))
+		if not isinstance(step.get("trigger"), str) or step["trigger"] not in TRIGGERS:
+			return "step {index} has unknown trigger {trigger}".format(index=index, trigger=step.get("trigger"))
+		if step.get("limit") is None or not is_temp(step["limit"]):
+			return "step {index} limit is not a number".format(index=index)
+		if "targetGrill" not in step or not is_temp(step["targetGrill"]):
+			return "step {index} targetGrill is not a temperature".format(index=index)
+		if "probe" in step and step["probe"] not in ["min", "max"] and not is_probe_index(step["probe"]):
+			return "step {index} probe is not a probe index, min or max".format(index=index)
+		if step.get("probes") is not None and (not isinstance(step["probes"], list) or not all(is_probe_index(probe) for probe in step["probes"])):
+			return "step {index} probes is not a list of probe indices".format(index=index)
+	return None
+
 def handle_program_update(new_program):
 	"""
-	Handle newly received program
+	Handle newly received program, rejecting it before anything changes if it is malformed
 	"""
+	error = program_error(new_program)
+	if error is not None:
+		SmokeLog.common.error("rejected program: {error}".format(error=error))
+		return
 	if new_program["id"] != smoker.program_id:
 		SmokeLog.common.notice(new_program)
 		smoker.program_id = new_program["id"]
 		smoker.program_index = 0
 		smoker.program_steps = new_program["steps"]
-		skip_start_mode = smoker.state["power"] and smoker.state["mode"] in ["Smoke", "Hold"]
-		if skip_start_mode and new_program_data[0]["mode"] == "Start":
+		cached = program_cache.get(new_program["id"])
+		etag = cached["etag"] if cached is not None and cached["steps"] == new_program["steps"] else None # Keep get_program's ETag for the same steps
+		program_cache.store(new_program["id"], new_program["steps"], etag=etag)
+		skip_start_mode = smoker.state.power and smoker.state.mode in ["Smoke", "Hold"]
+		if skip_start_mode and new_program["steps"][0]["mode"] == "Start":
 			SmokeLog.common.info("skipping Start program since smoker has alredy warmed up")
 			smoker.program_index = 1
-		if smoker.state["power"]:
+		if smoker.state.power:
 			set_program()
 	else:
 		SmokeLog.common.info("new program matches existing program, ignoring")
@@ -190,42 +406,47 @@ def handle_program_update(new_program):
 def handle_state_update(new_state):
 	"""
 	Evaluate new state from remote DB and update smoker state if necessary
+	The whole state is validated first, a malformed state is rejected before anything (state, relays, controllers) changes
 	"""
 	def state_changed(key, old_value, new_value):
 		SmokeLog.common.info("{key} {old_value} -> {new_value}".format(key=key, old_value=old_value, new_value=new_value))
 
 	SmokeLog.common.notice(new_state)
-	if new_state["mode"] != smoker.state["mode"]:
-		state_changed("mode", smoker.state["mode"], new_state["mode"])
-		smoker.state["mode"] = new_state["mode"]
-		smoker.state["temps"]["grillTarget"] = new_state["temps"]["grillTarget"] # TODO: fix this! what if a temp is None??
-		set_mode(new_state["mode"])
-	if new_state["temps"]["grillTarget"] != smoker.state["temps"]["grillTarget"]:
-		if new_state["temps"]["grillTarget"] is None and new_state["mode"] not in ["Idle", "Off", "Shutdown"]:
-			SmokeLog.common.error("Invalid grillTarget (None) for mode {new_mode}".format(new_mode=new_state["mode"]))
-		if new_state["temps"]["grillTarget"] is None and new_state["mode"] in ["Start", "Hold", "Smoke"]:
-			state_changed("grillTarget", smoker.state["temps"]["grillTarget"], new_state["temps"]["grillTarget"])
-			smoker.state["temps"]["grillTarget"] = new_state["temps"]["grillTarget"]
-			smoker.pid.set_pid_target(float(new_state["grillTarget"]))
-	if new_state["temps"]["probeTarget"] != smoker.state["temps"]["probeTarget"]:
-		state_changed("probeTarget", smoker.state["temps"]["probeTarget"], new_state["temps"]["probeTarget"])
-		for key, value in new_state["temps"].items():
-			smoker.state["temps"][key] = value
-	if new_state["power"] != smoker.state["power"]:
-		state_changed("power", smoker.state["power"], new_state["power"])
-		if new_state["power"] and len(smoker.program_steps) == 0:
-			SmokeLog.common.notice("no program exists, rejecting program control! 1 -> 0")
-			smoker.state["power"] = False
-			patch_state({"power": False})
-		elif not new_state["power"] and new_state["mode"] == "Off":
-			sys.exit(SmokeLog.common.notice("program stopped and mode == Off, shutting down smoker."))
-		elif not new_state["power"] and len(smoker.program_steps) > 0:
-			SmokeLog.common.notice("suspending program control")
-			smoker.state["power"] = False
-			smoker.timers["last_program_started"] = time.time()
-		elif len(smoker.program_steps) > 0:
-			smoker.state["power"] = new_state["power"]
-			set_program()
+	error = state_error(new_state)
+	if error is not None:
+		SmokeLog.common.error("rejected state: {error}".format(error=error))
+		return
+	with smoker.state.transaction(): # Mode changes push state, push once with the whole (validated) update applied
+		if new_state["mode"] != smoker.state.mode:
+			state_changed("mode", smoker.state.mode, new_state["mode"])
+			smoker.state.mode = new_state["mode"]
+			smoker.state.grillTarget = new_state["temps"]["grillTarget"] # TODO: fix this! what if a temp is None??
+			set_mode(new_state["mode"])
+		if new_state["temps"]["grillTarget"] != smoker.state.grillTarget:
+			if new_state["temps"]["grillTarget"] is None and new_state["mode"] not in ["Idle", "Off", "Shutdown"]:
+				SmokeLog.common.error("Invalid grillTarget (None) for mode {new_mode}".format(new_mode=new_state["mode"]))
+			if new_state["temps"]["grillTarget"] is not None and new_state["mode"] in ["Start", "Hold", "Smoke"]:
+				state_changed("grillTarget", smoker.state.grillTarget, new_state["temps"]["grillTarget"])
+				smoker.state.grillTarget = new_state["temps"]["grillTarget"]
+				control_command("grill_target", float(new_state["temps"]["grillTarget"]))
+		if new_state["temps"]["probeTarget"] != smoker.state.probeTarget:
+			state_changed("probeTarget", smoker.state.probeTarget, new_state["temps"]["probeTarget"])
+			set_probe_target(new_state["temps"]["probeTarget"], *smoker.probe_target) # Same probes as the current target
+		if new_state["power"] != smoker.state.power:
+			state_changed("power", smoker.state.power, new_state["power"])
+			if new_state["power"] and len(smoker.program_steps) == 0:
+				SmokeLog.common.notice("no program exists, rejecting program control! 1 -> 0")
+				smoker.state.power = False
+				patch_state({"power": False})
+			elif not new_state["power"] and new_state["mode"] == "Off":
+				sys.exit(SmokeLog.common.notice("program stopped and mode == Off, shutting down smoker."))
+			elif not new_state["power"] and len(smoker.program_steps) > 0:
+				SmokeLog.common.notice("suspending program control")
+				smoker.state.power = False
+				smoker.timers["last_program_started"] = time.time()
+			elif len(smoker.program_steps) > 0:
+				smoker.state.power = new_state["power"]
+				set_program()
 
 # MARK: STATE MANAGEMENT
 
@@ -233,8 +454,30 @@ def read_temps():
 	"""
 	Read temperature sensors and record measurements if necessary
 	"""
-	if smoker.state["temps"]["grillCurrent"] is None or smoker.timer_expired("last_heartbeat", FREQUENCY_LOG_TEMPS):
+	if smoker.state.grillCurrent is None or smoker.timer_expired("last_read_temps", FREQUENCY_LOG_TEMPS):
 		smoker.read_temps()
+	elif smoker.timer_expired("last_grill_sample", FREQUENCY_SAMPLE_GRILL):
+		smoker.sample_grill()
+
+def manage_disturbances():
+	"""
+	React to lid-open / flame-out transitions from the grill disturbance detector
+	Freeze PID integrator for the duration of the event, re-arm igniter on flame-out, and report to Vapor on next loop
+	"""
+	event = smoker.disturbance.event
+	if event == smoker.state.event:
+		return
+	FlightRecorder.common.record(FlightRecorder.EVENT, "disturbance:{event}".format(event=event))
+	SmokeLog.common.notice("{old} -> {new} at {temp}F".format(old=smoker.state.event, new=event, temp=smoker.state.grillCurrent))
+	if event is None:
+		smoker.pid.restore(smoker.state.grillCurrent)
+	else:
+		smoker.pid.freeze()
+	if event == "flameOut" and not smoker.get_state("igniter"):
+		SmokeLog.common.notice("enabling igniter due to flame-out")
+		smoker.set_relay("igniter", True)
+	smoker.state.event = event
+	smoker.timers["last_heartbeat"] = None
 
 def manage_igniter():
 	"""
@@ -243,13 +486,16 @@ def manage_igniter():
 	if smoker.get_state("igniter") and time.time() - smoker.timers["last_toggled"]["igniter"] > TIMEOUT_IGNITER:
 		SmokeLog.common.error("disabling igniter due to timeout!")
 		smoker.set_relay("igniter", False)
-		set_mode("Shutdown")
-		smoker.timers["last_program_started"] = time.time()
-	elif not smoker.get_state("igniter") and smoker.state["temps"]["grillCurrent"] < TEMPERATURE_IGNITER:
-		SmokeLog.common.notice("enabling igniter due to low temp: {temp} < {limit}".format(temp=smoker.state["temps"]["grillCurrent"], limit=TEMPERATURE_IGNITER))
+		request_shutdown()
+	elif smoker.get_state("igniter") and smoker.state.event == "flameOut" and time.time() - smoker.timers["last_toggled"]["igniter"] > TIMEOUT_RELIGHT:
+		SmokeLog.common.error("disabling igniter, failed to re-light after flame-out")
+		smoker.set_relay("igniter", False)
+		request_shutdown()
+	elif not smoker.get_state("igniter") and smoker.state.grillCurrent < TEMPERATURE_IGNITER:
+		SmokeLog.common.notice("enabling igniter due to low temp: {temp} < {limit}".format(temp=smoker.state.grillCurrent, limit=TEMPERATURE_IGNITER))
 		smoker.set_relay("igniter", True)
-	elif smoker.get_state("igniter") and smoker.state["temps"]["grillCurrent"] > TEMPERATURE_IGNITER:
-		SmokeLog.common.notice("disabling igniter due to high temp: {temp} > {limit}".format(temp=smoker.state["temps"]["grillCurrent"], limit=TEMPERATURE_IGNITER))
+	elif smoker.get_state("igniter") and smoker.state.grillCurrent > TEMPERATURE_IGNITER and smoker.state.event != "flameOut":
+		SmokeLog.common.notice("disabling igniter due to high temp: {temp} > {limit}".format(temp=smoker.state.grillCurrent, limit=TEMPERATURE_IGNITER))
 		smoker.set_relay("igniter", False)
 
 def manage_auger():
@@ -259,6 +505,8 @@ def manage_auger():
 	if smoker.get_state("auger") and time.time() - smoker.timers["last_toggled"]["auger"] > smoker.pid_values["cycle_timer"] * smoker.pid_values["u"] and smoker.pid_values["u"] < 1.0: # Auger currently on AND TimeSinceToggle > auger On Time AND maintenance not continuous
 		smoker.set_relay("auger", False)
 	elif not smoker.get_state("auger") and time.time() - smoker.timers["last_toggled"]["auger"] > smoker.pid_values["cycle_timer"] * (1 - smoker.pid_values["u"]): # Auger currently off AND TimeSinceToggle > auger Off Time
+		if smoker.state.mode == "Smoke" and smoker.smoke_control == "adaptive":
+			update_smoke() # Cycle just finished, pick on / off times for the next one
 		smoker.set_relay("auger", True)
 
 def set_mode(new_mode): # pylint: disable=R0915
@@ -266,83 +514,178 @@ def set_mode(new_mode): # pylint: disable=R0915
 	Update smoker state to match new_mode, and post update to Vapor
 	"""
 	SmokeLog.common.notice(new_mode)
-	smoker.state["mode"] = new_mode
+	FlightRecorder.common.record(FlightRecorder.EVENT, "mode:{mode}".format(mode=new_mode))
+	smoker.state.mode = new_mode
 	if new_mode == "Off":
 		patch_state({"mode": "Off", "temps": {"grillTarget": None, "probeTarget": None}})
 		sys.exit(SmokeLog.common.notice("restarting smoker..."))
 	elif new_mode == "Shutdown":
-		smoker.state["power"] = False
+		smoker.state.power = False
 		smoker.timers["last_program_started"] = time.time()
+		smoker.program_steps = []
+		smoker.state.grillTarget = None
+	elif new_mode == "Start":
+		smoker.state.power = True
+	control_command("mode", new_mode, smoker.state.grillTarget)
+	if new_mode == "Shutdown":
+		delete_program()
+
+	put_state()
+
+def apply_mode(new_mode, grill_target):
+	"""
+	Drive relays and controllers for new_mode, in the control process when it runs separately
+	"""
+	global shutdown_requested
+	smoker.state.mode = new_mode
+	smoker.state.grillTarget = grill_target
+	smoker.disturbance.reset() # Controller is about to change course, don't read its transient as a disturbance
+	if new_mode == "Shutdown":
 		smoker.set_relay("fan", True)
 		smoker.set_relay("auger", False)
 		smoker.set_relay("igniter", False)
-		smoker.state["power"] = False
-		smoker.program_steps = []
-		smoker.state["temps"]["grillTarget"] = None
-		delete_program()
 	elif new_mode == "Start":
-		smoker.state["power"] = True
+		shutdown_requested = False
 		smoker.set_relay("fan", True)
 		smoker.set_relay("auger", True)
 		smoker.set_relay("igniter", True)
 		smoker.pid_values["cycle_timer"] = 15 + 45
 		smoker.pid_values["u"] = 15.0 / (15.0 + 45.0) #P0
-		smoker.pid.reset(target=smoker.state["temps"]["grillTarget"])
+		smoker.pid.reset(target=smoker.state.grillTarget)
 	elif new_mode == "Smoke":
-		SmokeLog.common.debug("using p-setting {p_setting}".format(p_setting=smoker.p_setting))
 		smoker.set_relay("fan", True)
 		smoker.set_relay("auger", True)
 		manage_igniter()
-		smoker.set_pause_cycle(smoker.p_setting)
+		if smoker.smoke_control == "adaptive":
+			smoker.smoke.reset(target=grill_target)
+			smoker.set_auger_cycle(smoker.smoke.on_time, smoker.smoke.off_time)
+			smoker.timers["last_smoke_update"] = time.time()
+		else:
+			SmokeLog.common.debug("using p-setting {p_setting}".format(p_setting=smoker.p_setting))
+			smoker.set_pause_cycle(smoker.p_setting)
 	elif new_mode == "Hold":
 		smoker.set_relay("fan", True)
 		smoker.set_relay("auger", True)
 		manage_igniter()
 		smoker.pid_values["cycle_timer"] = FREQUENCY_UPDATE_PID
 		smoker.pid_values["u"] = U_MIN
+		smoker.mpc.reset(U_MIN)
 
-	put_state()
+def apply_grill_target(grill_target):
+	"""
+	Retarget Hold and Smoke controllers, in the control process when it runs separately
+	"""
+	smoker.state.grillTarget = grill_target
+	smoker.pid.set_pid_target(grill_target)
+	if grill_target is not None:
+		smoker.smoke.target = grill_target
+	smoker.disturbance.reset() # Grill coasting down to a lower target is not a flame-out
+
+def set_probe_target(target, probe=0, group=None):
+	"""
+	Set probe target for limits and state, and in the control process (which runs the ETA estimators) when separate
+	"""
+	smoker.set_probe_target(target, probe, group)
+	if control is not None and not control.in_child:
+		control.send("probe_target", target, probe, group)
+
+def check_watchdog():
+	"""
+	Post heartbeat to Watchdog, and shut down if it has tripped and taken over the relays
+	When the control loop runs in its own process, it posts the heartbeats and this only checks for a trip
+	"""
+	if control is None or control.in_child:
+		watchdog.beat(smoker.state.grillCurrent)
+	if control is not None and control.in_child:
+		return
+	if watchdog.tripped() is not None and smoker.state.mode not in ["Shutdown", "Off"]:
+		SmokeLog.common.error("watchdog tripped: {reason}".format(reason=watchdog.tripped()))
+		FlightRecorder.common.record(FlightRecorder.EVENT, "watchdog:{reason}".format(reason=watchdog.tripped()))
+		FlightRecorder.common.dump("watchdog")
+		if control is not None:
+			control.send("dump", "watchdog") # Sensor, relay and controller records are in the control process
+		set_mode("Shutdown")
+
+def runloop():
+	"""
+	Single main runloop iteration
+	"""
+	if control is not None:
+		sync_telemetry()
+		poll_transports()
+		monitor_limits()
+		post_heartbeat()
+		publish_state()
+		check_watchdog()
+		return
+	read_temps()
+	poll_transports()
+	monitor_limits()
+	post_heartbeat()
+	run_mode()
+	publish_state()
+	check_watchdog()
 
 def run_mode():
 	"""
 	Main loop actions for each mode
 	"""
-	if smoker.state["mode"] in ["Start", "Smoke", "Hold", "Keep Warm"]:
+	manage_disturbances()
+	if smoker.state.mode in ["Start", "Smoke", "Hold", "Keep Warm"]:
 		manage_igniter()
 		manage_auger()
-	if smoker.state["mode"] in ["Hold", "Keep Warm"]:
+	if smoker.state.mode in ["Hold", "Keep Warm"]:
 		update_pid()
 
 def update_pid():
 	"""
-	Handle newly received 60s average grill temperature, and update PID we're in Hold mode
+	Handle newly received 60s average grill temperature, and update PID (or MPC) if we're in Hold mode
 	"""
-	if smoker.state["mode"] == "Hold" and smoker.timer_expired("last_pid_update", FREQUENCY_UPDATE_PID):
-		smoker.pid_values["u"] = smoker.pid.update(smoker.average_for_pid)	# Update u based on provided average of temps from last 60s
+	if smoker.state.mode == "Hold" and smoker.timer_expired("last_pid_update", FREQUENCY_UPDATE_PID):
+		if smoker.controller == "mpc":
+			smoker.pid_values["u"] = smoker.mpc.update(smoker.state.grillCurrent, smoker.state.grillTarget, learn=smoker.state.event is None) # Model handles lag itself, use latest temp; don't learn from disturbances
+			FlightRecorder.common.record(FlightRecorder.PID, "mpc", smoker.pid_values["u"], smoker.mpc.model.b / (1 - smoker.mpc.model.a), smoker.mpc.model.dead_time)
+		else:
+			smoker.pid_values["u"] = smoker.pid.update(smoker.average_for_pid)	# Update u based on provided average of temps from last 60s
+			FlightRecorder.common.record(FlightRecorder.PID, "pid", smoker.pid.P, smoker.pid.I, smoker.pid.D)
 		smoker.pid_values["u"] = max(smoker.pid_values["u"], U_MIN)			# Ensure updated u >= U_MIN
 		smoker.pid_values["u"] = min(smoker.pid_values["u"], U_MAX)			# Ensure updated u <= U_MAX
 		SmokeLog.common.debug("updated u: {u}".format(u=smoker.pid_values["u"]))
 		smoker.timers["last_pid_update"] = time.time()
 
+def update_smoke():
+	"""
+	Feed the auger cycle that just finished to the adaptive Smoke controller, and set on / off times for the next one
+	"""
+	now = time.time()
+	if smoker.average_for_pid is not None:
+		on_time, off_time = smoker.smoke.update(smoker.average_for_pid, now - smoker.timers["last_smoke_update"], learn=smoker.state.event is None) # Don't learn from disturbances
+		smoker.set_auger_cycle(on_time, off_time)
+		FlightRecorder.common.record(FlightRecorder.PID, "smoke", smoker.pid_values["u"], smoker.smoke.model[1], smoker.smoke.bias)
+		SmokeLog.common.debug("auger {on_time:.0f}s on, {off_time:.0f}s off, {rate}lb/h".format(on_time=on_time, off_time=off_time, rate=smoker.state.pelletRate))
+	smoker.timers["last_smoke_update"] = now
+
 def monitor_limits():
 	"""
 	Check whether program limit has been reached
 	"""
 
-	if smoker.state["power"] and len(smoker.program_steps) >= smoker.program_index+1:
+	if smoker.state.power and len(smoker.program_steps) >= smoker.program_index+1:
 		finished = False
 		if smoker.program_steps[smoker.program_index]["trigger"] == "Time":
 			if time.time() - smoker.timers["last_program_started"] > smoker.program_steps[smoker.program_index]["limit"]:
 				finished = True
 				SmokeLog.common.notice("timer expired")
-		elif smoker.program_steps[smoker.program_index]["trigger"] == "Temp" and smoker.state["temps"]["probeCurrent"] is not None:
-			if smoker.state["temps"]["probeCurrent"] > smoker.program_steps[smoker.program_index]["limit"]:
+		elif smoker.program_steps[smoker.program_index]["trigger"] == "Temp":
+			step = smoker.program_steps[smoker.program_index]
+			probe_temp = smoker.probe_reading(step.get("probe", 0), step.get("probes"))
+			if probe_temp is not None and probe_temp > step["limit"]:
 				finished = True
-				SmokeLog.common.notice("probe reached requested temperature")
+				SmokeLog.common.notice("probe {probe} reached requested temperature".format(probe=step.get("probe", 0)))
 		if finished:
 			next_program()
 
-	if smoker.state["mode"] == "Shutdown" and smoker.timer_expired("last_program_started", TIMEOUT_SHUTDOWN):
+	if smoker.state.mode == "Shutdown" and smoker.timer_expired("last_program_started", TIMEOUT_SHUTDOWN):
 		SmokeLog.common.notice("shutdown timer expired, setting mode to Off")
 		set_mode("Off")
 
@@ -350,34 +693,35 @@ def set_program():
 	"""
 	Apply settings from current program
 	"""
-	if smoker.state["power"] and len(smoker.program_steps) > 0 and smoker.program_index != None:
+	if smoker.state.power and len(smoker.program_steps) > 0 and smoker.program_index != None:
 		SmokeLog.common.notice(smoker.program_steps[smoker.program_index])
-		smoker.state["temps"]["grillTarget"] = smoker.program_steps[smoker.program_index]["targetGrill"]
+		smoker.state.grillTarget = smoker.program_steps[smoker.program_index]["targetGrill"]
 		if smoker.program_steps[smoker.program_index]["trigger"] == "Temp":
-			if not smoker.state["probeConnected"]:
+			step = smoker.program_steps[smoker.program_index]
+			if len(smoker.probe_selection(step.get("probe", 0), step.get("probes"))) == 0:
 				SmokeLog.common.notice("no probe connected, rejecting program with temp limit")
-				smoker.state["power"] = False
+				smoker.state.power = False
 				patch_state({"power": False})
-			smoker.state["temps"]["probeTarget"] = smoker.program_steps[smoker.program_index]["limit"]
+			set_probe_target(step["limit"], step.get("probe", 0), step.get("probes"))
 		else:
-			smoker.state["temps"]["probeTarget"] = None
-		smoker.pid.set_pid_target(smoker.state["temps"]["grillTarget"])
+			set_probe_target(None)
+		control_command("grill_target", smoker.state.grillTarget)
 		set_mode(smoker.program_steps[smoker.program_index]["mode"])
 	else:
-		if len(smoker.program_steps) > 0 and not smoker.state["power"]:
+		if len(smoker.program_steps) > 0 and not smoker.state.power:
 			SmokeLog.common.notice("program mode disabled! clearing remaining programs")
 			smoker.program_steps = []
-		elif len(smoker.program_steps) == 0 and smoker.state["power"]:
+		elif len(smoker.program_steps) == 0 and smoker.state.power:
 			SmokeLog.common.notice("no program found! Disabling program control")
-			smoker.state["power"] = False
+			smoker.state.power = False
 			set_mode("Hold")
 		elif smoke.program_index == None:
 			SmokeLog.common.error("failed to apply program, program_index is missing. disabling program control and clearing program.")
-			smoker.state["power"] = False
+			smoker.state.power = False
 			smoker.program_steps = []
 			set_mode("Hold")
-		smoker.state["temps"]["probeTarget"] = None
-		if smoker.state["mode"] in ["Idle", "Start", "Hold", "Smoke"]:
+		set_probe_target(None)
+		if smoker.state.mode in ["Idle", "Start", "Hold", "Smoke"]:
 			set_mode("Shutdown")
 
 	smoker.timers["last_program_started"] = time.time()
@@ -396,6 +740,103 @@ def next_program():
 	else:
 		sys.exit(SmokeLog.common.error("invalid program index, exiting"))
 
+# MARK: CONTROL PROCESS
+
+control = None				# Realtime.ControlProcess when the control loop runs in its own process
+shutdown_requested = False	# Set by the control process, which can't talk to Vapor, to have the networking process shut down
+EVENTS = [None, "lidOpen", "flameOut"]
+
+def control_command(command, *args):
+	"""
+	Apply control-side change directly, or queue it for the control process when it runs separately
+	"""
+	if control is None or control.in_child:
+		CONTROL_COMMANDS[command](*args)
+	else:
+		control.send(command, *args)
+
+def request_shutdown():
+	"""
+	Shut down from the control loop, via the networking process when the control loop runs separately
+	The control process makes its relays safe straight away, the networking process then catches up state and Vapor
+	"""
+	global shutdown_requested
+	if control is not None and control.in_child:
+		apply_mode("Shutdown", smoker.state.grillTarget) # Mode stays Shutdown here, so the next iteration can't relight
+		shutdown_requested = True
+	else:
+		set_mode("Shutdown")
+		smoker.timers["last_program_started"] = time.time()
+
+def control_step():
+	"""
+	Single control loop iteration in the control process
+	"""
+	read_temps()
+	run_mode()
+	check_watchdog()
+
+def telemetry_layout():
+	"""
+	Returns struct format of control_telemetry() values
+	"""
+	return "ffffffBBB" + "fffB" * len(smoker.state.probes)
+
+def control_telemetry():
+	"""
+	Returns values published by the control process each loop: grill, controller and probe readings, see sync_telemetry()
+	"""
+	values = [Realtime.to_field(smoker.state.grillCurrent), Realtime.to_field(smoker.average_for_pid), smoker.pid_values["u"], Realtime.to_field(smoker.state.eta), Realtime.to_field(smoker.state.etaConfidence), Realtime.to_field(smoker.state.pelletRate), smoker.state.probeConnected, EVENTS.index(smoker.state.event), shutdown_requested]
+	for probe, connected in zip(smoker.state.probes, smoker.sensors["probes"].connected):
+		values.extend([Realtime.to_field(probe.current), Realtime.to_field(probe.eta), Realtime.to_field(probe.etaConfidence), connected])
+	return values
+
+def sync_telemetry():
+	"""
+	Mirror latest control process telemetry into smoker state, and act on its disturbance events and shutdown requests
+	If the control process has exited, take the control loop back into this process and shut down
+	"""
+	global control
+	if not control.alive():
+		SmokeLog.common.error("control process exited, taking over control loop")
+		FlightRecorder.common.record(FlightRecorder.EVENT, "control:exited")
+		control = None
+		if smoker.state.mode not in ["Shutdown", "Off"]:
+			set_mode("Shutdown")
+		return
+	sequence, values, stats = control.read()
+	if sequence == 0:
+		return
+	grill, average, u, eta, confidence, pellet_rate, probe_connected, event, shutdown = values[:9]
+	smoker.state.grillCurrent = Realtime.from_field(grill, integral=True)
+	smoker.average_for_pid = Realtime.from_field(average)
+	smoker.pid_values["u"] = u
+	for index, probe in enumerate(smoker.sensors["probes"].probes):
+		current, probe_eta, probe_confidence, connected = values[9 + 4 * index:13 + 4 * index]
+		smoker.state.set_probe(index, current=Realtime.from_field(current, integral=True), eta=Realtime.from_field(probe_eta), etaConfidence=Realtime.from_field(probe_confidence))
+		probe.connected = bool(connected)
+	smoker.state.probeCurrent = smoker.state.probes[0].current if len(smoker.state.probes) > 0 else None
+	smoker.state.probeConnected = bool(probe_connected)
+	smoker.state.eta, smoker.state.etaConfidence = Realtime.from_field(eta), Realtime.from_field(confidence)
+	pellet_rate = Realtime.from_field(pellet_rate)
+	smoker.state.pelletRate = None if pellet_rate is None else round(pellet_rate, 2) # float32 field, round again for the wire
+	if EVENTS[event] != smoker.state.event:
+		SmokeLog.common.notice("{old} -> {new} at {temp}F".format(old=smoker.state.event, new=EVENTS[event], temp=smoker.state.grillCurrent))
+		smoker.state.event = EVENTS[event]
+		smoker.timers["last_heartbeat"] = None
+	if shutdown and smoker.state.mode not in ["Shutdown", "Off"]:
+		SmokeLog.common.error("control process requested shutdown")
+		set_mode("Shutdown")
+	if smoker.timer_expired("last_control_stats", FREQUENCY_LOG_CONTROL):
+		SmokeLog.common.info("control loop: {stats}".format(stats=stats))
+		smoker.timers["last_control_stats"] = time.time()
+
+CONTROL_COMMANDS = {
+	"mode": apply_mode,
+	"grill_target": apply_grill_target,
+	"probe_target": lambda target, probe, group: smoker.set_probe_target(target, probe, group),
+	"dump": lambda reason: FlightRecorder.common.dump("control-" + reason)
+}
 
 # MARK: MAIN
 
@@ -411,18 +852,38 @@ if __name__ == "__main__":
 		else:
 			SMOKESTACK_API_ROOT = config["api-url"].rstrip() + "/api"
 			SMOKESTACK_PASSWORD = config["api-key"].rstrip()
-
-	smoker = Smoker.Smoker()
+			if "log-level" in config:
+				SmokeLog.common.set_level(config["log-level"])
+
+	FlightRecorder.common.install(os.path.join(SMOKESTACK_FIRMWARE_PATH, "flightrecorder"))
+
+	smoker = Smoker.Smoker(probes=config.get("probes"), controller=config.get("controller", "pid"), smoke=config.get("smoke", "adaptive"), auger_feed_rate=config.get("auger-feed-rate", Smoker.AUGER_FEED_RATE))
+	program_cache = ProgramCache.ProgramCache(os.path.join(SMOKESTACK_FIRMWARE_PATH, "program-cache.json"))
+	cached_program_id, cached_program = program_cache.current()
+	if cached_program is not None:
+		SmokeLog.common.notice("using cached program {id}".format(id=cached_program_id))
+		load_program(cached_program_id, cached_program["steps"])
+	watchdog = Watchdog.Watchdog(smoker.relays, heartbeat_timeout=TIMEOUT_WATCHDOG, igniter_timeout=TIMEOUT_WATCHDOG_IGNITER, temperature_max=TEMPERATURE_MAX, read_temp=lambda: smoker.sensors["grill"].read(log=False))
+	watchdog.start()
+	if config.get("realtime", False):
+		control = Realtime.ControlProcess(control_step, CONTROL_COMMANDS, telemetry_layout(), control_telemetry, period=FREQUENCY_IDLE_TIMER, priority=config.get("realtime-priority", Realtime.PRIORITY), cpus=config.get("realtime-cpus"))
+		control.start()
+
+	if config.get("mqtt") is not None:
+		try:
+			transports.append(Transport.MQTTTransport(**config["mqtt"]))
+		except RuntimeError as error:
+			SmokeLog.common.error("MQTT transport disabled: {error}".format(error=error))
+	for transport in transports:
+		transport.start()
 
 	while not smoker.connected:
 		post_boot()
+		watchdog.beat()
 		if not smoker.connected: time.sleep(FREQUENCY_POST_BOOT)
 
-	check_for_program_id()
+	get_program()
 
 	while True:
-		read_temps()
-		monitor_limits()
-		post_heartbeat()
-		run_mode()
+		runloop()
 		time.sleep(FREQUENCY_IDLE_TIMER)
\ No newline at end of file
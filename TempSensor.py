@@ -9,24 +9,28 @@ Adapted from MIT-Licenses work at https://github.com/adafruit
 import time
 import math
 import sys
-import spidev
+import Calibration
 import SmokeLog
+import SPIBus
 
 class MAX31855:
 	"""
 	MAX31855 thermocouple driver
 	"""
-	def __init__(self, chip_select):
+	def __init__(self, chip_select, bus=0):
 		"""
-		Initialize MAX31855 device with hardware SPI on specified chip-select pin
+		Initialize MAX31855 device with hardware SPI on specified bus and chip-select pin
 		"""
 		self.connected = False
+		self.bus = bus
 		self.chip_select = chip_select
 		self.linear = True
-		self.spi = spidev.SpiDev()
-		self.spi.open(0, chip_select)
-		self.spi.max_speed_hz = 7629
-		self.spi.mode = 0b01
+		self.correction = None
+		correction = Calibration.coefficients(bus, chip_select)
+		if correction is not None:
+			self.correction = Calibration.max31855_table(correction)
+		self.spi = SPIBus.get(bus).device(chip_select, mode=0b01, max_speed_hz=5000000)
+		self.spi.qualify(self.sample, tolerance=16) # 16 LSB = 1°C of cold junction temp
 		self.temperature = self.read()
 
 	def read_32(self):
@@ -39,25 +43,37 @@ class MAX31855:
 		value = raw[0] << 24 | raw [1] << 16 | raw[2] << 8 | raw[3]
 		return value
 
-	def read_internal(self):
+	def sample(self):
 		"""
-		Returns internal temp in degrees Celsius
+		Returns raw cold junction reading for clock qualification, or None if reserved bits D17 / D3 are set (corrupt frame)
 		"""
-		voltage = self.read_32()
+		value = self.read_32()
+		if value & 0x20008:
+			return None
+		return (value >> 4) & 0xFFF
+
+	def read_internal(self, value=None):
+		"""
+		Returns internal temp in degrees Celsius, decoded from value if provided or from a new SPI read
+		"""
+		voltage = self.read_32() if value is None else value
 		voltage >>= 4 # Ignore bottom 4 bits of thermocouple data
 		internal = voltage & 0x7FF # Grab bottom 11 bits as internal temperature data
 		if voltage & 0x800:
 			internal -= 4096 # Negative value, take two's complement and compute with subtraction because Python is a little odd about handling signed/unsigned
 		return internal * 0.0625 # Scale by 0.0625 degrees C per bit and return value
 
-	def read(self):
+	def read(self, value=None, corrected=True):
 		"""
 		Returns thermocouple temp from specified read method and returns in degrees Fahrenheit
+		Decodes value if provided (see ProbeArray.scan), otherwise performs a single new SPI read
+		Applies calibration correction table if one exists, unless corrected is False
 		"""
+		value = self.read_32() if value is None else value
 		if self.linear:
-			temp = self.read_linearized_temp()
+			temp = self.read_linearized_temp(value)
 		else:
-			temp = self.read_temp()
+			temp = self.read_temp(value)
 
 		if float(format((temp * 1.8), ".2f")) == 0.0:
 			self.connected = False
@@ -65,16 +81,18 @@ class MAX31855:
 			self.connected = True
 
 		if self.connected:
-			temp = float(format((temp * 1.8 + 32), ".1f")) # Convert C to F and round to 1 decimal places
-			SmokeLog.common.info(f"MAX31855: {temp}F")
-			return int(temp)
+			temp = int(float(format((temp * 1.8 + 32), ".1f"))) # Convert C to F and round to 1 decimal places
+			if corrected and self.correction is not None and Calibration.MAX31855_RANGE[0] <= temp <= Calibration.MAX31855_RANGE[1]:
+				temp = self.correction[temp - Calibration.MAX31855_RANGE[0]]
+			SmokeLog.common.info(f"MAX31855 {self.chip_select}: {temp}F")
+			return temp
 		return None
 
-	def read_temp(self):
+	def read_temp(self, value=None):
 		"""
-		Returns thermocouple temp in degrees Celsius
+		Returns thermocouple temp in degrees Celsius, decoded from value if provided or from a new SPI read
 		"""
-		voltage = self.read_32()
+		voltage = self.read_32() if value is None else value
 
 		if voltage & 0x7: # Check for error reading value
 			self.connected = False
@@ -101,13 +119,15 @@ class MAX31855:
 			"fault": (voltage & (1 << 16)) > 0
 		}
 
-	def read_linearized_temp(self):
+	def read_linearized_temp(self, value=None):
 		"""
 		Return the NIST-linearized thermocouple temperature value in degrees celsius.
 		See https://learn.adafruit.com/calibrating-sensors/maxim-31855-linearization for more info.
+		Thermocouple and cold junction temps are decoded from the same 32-bit frame, so this costs one SPI read.
 		"""
-		voltage_thermocouple = (self.read_temp() - self.read_internal()) * 0.041276 # MAX31855 thermocouple voltage reading in mV
-		temperature_cold_junction = self.read_internal() # MAX31855 cold junction voltage reading in mV
+		value = self.read_32() if value is None else value
+		temperature_cold_junction = self.read_internal(value) # MAX31855 cold junction temperature in degrees Celsius
+		voltage_thermocouple = (self.read_temp(value) - temperature_cold_junction) * 0.041276 # MAX31855 thermocouple voltage reading in mV
 		voltage_cold_junction = (-0.176004136860E-01 +
 			0.389212049750E-01  * temperature_cold_junction +
 			0.185587700320E-04  * math.pow(temperature_cold_junction, 2.0) +
@@ -173,25 +193,60 @@ class MAX31855:
 		"""
 		self.spi.close()
 
+class ProbeArray:
+	"""
+	Bank of MAX31855 meat probes sampled together
+	"""
+	def __init__(self, channels):
+		"""
+		Initialize one MAX31855 per channel, channels is a list of {"chip_select": int, "bus": int} dicts
+		"""
+		self.probes = [MAX31855(chip_select=channel["chip_select"], bus=channel.get("bus", 0)) for channel in channels]
+
+	def __len__(self):
+		return len(self.probes)
+
+	@property
+	def connected(self):
+		"""
+		Returns list of Booleans indicating which probes returned a valid reading on the last scan
+		"""
+		return [probe.connected for probe in self.probes]
+
+	def scan(self):
+		"""
+		Returns list of probe temps in degrees Fahrenheit (None if disconnected)
+		Reads one raw 32-bit frame per probe back-to-back in a single pass, then decodes, so cost is one SPI read per probe
+		"""
+		frames = [probe.read_32() for probe in self.probes]
+		return [probe.read(frame) for probe, frame in zip(self.probes, frames)]
+
+	def close(self):
+		"""
+		Close hardware SPI devices
+		"""
+		for probe in self.probes:
+			probe.close()
+
 class MAX31865:
 	"""
 	MAX31865 RTD driver
 	"""
 
-	def __init__(self, chip_select):
+	def __init__(self, chip_select, bus=0):
 		"""
-		Initialize MAX31865 device with hardware SPI on specified chip-select pin
+		Initialize MAX31865 device with hardware SPI on specified bus and chip-select pin
 		"""
+		self.bus = bus
 		self.chip_select = chip_select
 		self.r_value = 1000
 		self.r_reference = 4300
 		self.A = 3.90830E-3
 		self.B = -5.775E-7
-		self.spi = spidev.SpiDev()
-		self.spi.open(0, chip_select)
-		self.spi.max_speed_hz = 7629
-		self.spi.mode = 0b01
+		self.table = Calibration.max31865_table(self.r_value, self.r_reference, self.A, self.B, Calibration.coefficients(bus, chip_select)) # RTD code -> corrected °F
+		self.spi = SPIBus.get(bus).device(chip_select, mode=0b01, max_speed_hz=5000000)
 		self.config()
+		self.spi.qualify(self.sample, tolerance=8) # 8 LSB ~= 1 ohm
 		self.temperature = self.read()
 
 	def config(self):
@@ -210,27 +265,36 @@ class MAX31865:
 		self.spi.xfer2([0x80, config])
 		time.sleep(0.25)
 
-	def read(self):
+	def sample(self):
 		"""
-		Returns RTD temperature in degrees Fahrenheit
+		Returns raw RTD ADC code for clock qualification, or None if the config register does not read back as written
 		"""
-		msb = self.spi.xfer2([0x01, 0x00])[1]
-		lsb = self.spi.xfer2([0x02, 0x00])[1]
+		if self.spi.xfer2([0x00, 0x00])[1] & 0b11111101 != 0b11000000: # Fault clear bit (D1) self-clears
+			return None
+		msb, lsb = self.spi.xfer2([0x01, 0x00, 0x00])[1:]
+		return ((msb << 8) + lsb) >> 1
+
+	def read_code(self):
+		"""
+		Returns 15-bit RTD ADC code
+		"""
+		msb, lsb = self.spi.xfer2([0x01, 0x00, 0x00])[1:] # Register address auto-increments, read RTD MSB + LSB in one transaction
 
 		if lsb & 0b00000001: # Check fault
 			SmokeLog.common.error(f"fault detected on SPI {self.chip_select}")
 			self.get_fault()
 
-		adc_measured = ((msb<<8) + lsb)>>1 # Shift MSB up 8 bits, add to LSB, remove fault bit (last bit)
-		r_measured = float(adc_measured * self.r_reference) / (2**15)
+		return ((msb<<8) + lsb)>>1 # Shift MSB up 8 bits, add to LSB, remove fault bit (last bit)
 
-		try:
-			temp = self.resistance_to_temp(r_measured)
-			temp = float(format((temp * 1.8 + 32), ".1f")) # Convert C to F and round to 1 decimal places
-		except: # pylint: disable=W0702
-			temp = 0 # TODO: add actual error handling here and remove pylint override, this is a hack for bringup to return 0 when no RTD is present
-		SmokeLog.common.info(f"MAX31865: {temp}F")
-		return int(temp)
+	def read(self, log=True):
+		"""
+		Returns calibrated RTD temperature in degrees Fahrenheit, 0 if no RTD is present
+		Conversion and calibration are precomputed per ADC code, see Calibration.max31865_table
+		"""
+		temp = self.table[self.read_code()]
+		if log:
+			SmokeLog.common.info(f"MAX31865: {temp}F")
+		return temp
 
 	def resistance_to_temp(self, r_measured):
 		"""
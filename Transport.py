@@ -0,0 +1,172 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Transport.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Telemetry and command transports running alongside Vapor's HTTP API
+A transport publishes state whenever it changes and a history sample on every temperature log, and queues commands it
+receives for the main loop to apply, so network callbacks never touch smoker state. paho-mqtt is only required when the
+MQTT transport is configured.
+
+MQTT topics, under prefix (default "smokestack"):
+  <prefix>/online              "true" / "false" (last will), retained
+  <prefix>/state               full state JSON, retained
+  <prefix>/history             latest temperature sample JSON, retained
+  <prefix>/command/state       state JSON, applied like a Vapor heartbeat state interrupt
+  <prefix>/command/program     program JSON ({"id", "steps"}), applied like a Vapor heartbeat program interrupt
+"""
+
+import collections
+import json
+import queue
+import sys
+import threading
+import FlightRecorder
+import SmokeLog
+
+try:
+	import paho.mqtt.client as mqtt
+except ImportError:
+	mqtt = None
+
+BUFFER_SIZE = 720 # History samples kept while the broker is unreachable (2h at FREQUENCY_LOG_TEMPS)
+
+class Transport:
+	"""
+	Transport interface, all methods are no-ops
+	"""
+	def start(self):
+		pass
+
+	def publish_state(self, state):
+		pass
+
+	def publish_history(self, sample):
+		pass
+
+	def poll(self):
+		"""
+		Returns list of (command, payload) received since the last poll, command is "state" or "program"
+		"""
+		return []
+
+	def close(self):
+		pass
+
+class MQTTTransport(Transport):
+	"""
+	MQTT transport over one persistent broker connection, buffering publishes while disconnected
+	"""
+	def __init__(self, host, port=1883, prefix="smokestack", qos=1, username=None, password=None, tls=False, keepalive=60, buffer_size=BUFFER_SIZE):
+		if mqtt is None:
+			raise RuntimeError("paho-mqtt is not installed")
+		self.host = host
+		self.port = port
+		self.prefix = prefix.rstrip("/")
+		self.qos = qos
+		self.keepalive = keepalive
+		self.connected = False
+		self.lock = threading.Lock() # Guards connected and the offline buffers, paho callbacks run on its network thread
+		self.pending_state = None
+		self.pending_history = collections.deque(maxlen=buffer_size)
+		self.commands = queue.SimpleQueue()
+		self.client = mqtt.Client(client_id="smokestack-firmware-{prefix}".format(prefix=self.prefix.replace("/", "-")), clean_session=True)
+		if username is not None:
+			self.client.username_pw_set(username, password)
+		if tls:
+			self.client.tls_set()
+		self.client.will_set(self.topic("online"), "false", qos=qos, retain=True)
+		self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+		self.client.on_connect = self.on_connect
+		self.client.on_disconnect = self.on_disconnect
+		self.client.on_message = self.on_message
+
+	def topic(self, name):
+		return "{prefix}/{name}".format(prefix=self.prefix, name=name)
+
+	def start(self):
+		"""
+		Connect in the background, publishes are buffered until the broker accepts the connection
+		"""
+		self.client.connect_async(self.host, self.port, keepalive=self.keepalive)
+		self.client.loop_start()
+		SmokeLog.common.notice("connecting to {host}:{port} as {prefix}".format(host=self.host, port=self.port, prefix=self.prefix))
+
+	def close(self):
+		if self.connected:
+			self.client.publish(self.topic("online"), "false", qos=self.qos, retain=True).wait_for_publish(timeout=1)
+		self.client.disconnect()
+		self.client.loop_stop()
+
+	def publish(self, name, payload):
+		return self.client.publish(self.topic(name), json.dumps(payload, separators=(",", ":")), qos=self.qos, retain=True)
+
+	def publish_state(self, state):
+		"""
+		Publish state, only the latest state is kept while disconnected
+		"""
+		with self.lock:
+			if not self.connected:
+				self.pending_state = state
+				return
+		self.publish("state", state)
+
+	def publish_history(self, sample):
+		"""
+		Publish history sample, up to buffer_size samples are kept while disconnected and sent in order on reconnect
+		"""
+		with self.lock:
+			if not self.connected:
+				self.pending_history.append(sample)
+				return
+		self.publish("history", sample)
+
+	def poll(self):
+		commands = []
+		while not self.commands.empty():
+			commands.append(self.commands.get())
+		return commands
+
+	def on_connect(self, client, userdata, flags, rc):
+		if rc != 0:
+			SmokeLog.common.error("broker refused connection: {reason}".format(reason=mqtt.connack_string(rc)))
+			return
+		client.publish(self.topic("online"), "true", qos=self.qos, retain=True)
+		client.subscribe(self.topic("command/+"), qos=self.qos)
+		with self.lock:
+			for sample in self.pending_history:
+				self.publish("history", sample)
+			if self.pending_state is not None:
+				self.publish("state", self.pending_state)
+			SmokeLog.common.notice("connected, flushed {count} buffered messages".format(count=len(self.pending_history) + (self.pending_state is not None)))
+			self.pending_history.clear()
+			self.pending_state = None
+			self.connected = True
+		FlightRecorder.common.record(FlightRecorder.EVENT, "mqtt:connected")
+
+	def on_disconnect(self, client, userdata, rc):
+		with self.lock:
+			self.connected = False
+		if rc == 0: # Requested by close()
+			return
+		SmokeLog.common.error("disconnected from broker: {reason}".format(reason=mqtt.error_string(rc)))
+		FlightRecorder.common.record(FlightRecorder.EVENT, "mqtt:disconnected")
+
+	def on_message(self, client, userdata, message):
+		if message.retain: # Stale command left on the broker, don't replay it on every reconnect
+			SmokeLog.common.notice("ignoring retained command on {topic}".format(topic=message.topic))
+			return
+		command = message.topic.rsplit("/", 1)[-1]
+		if command not in ["state", "program"]:
+			SmokeLog.common.error("unknown command topic {topic}".format(topic=message.topic))
+			return
+		try:
+			payload = json.loads(message.payload)
+		except ValueError:
+			SmokeLog.common.error("invalid JSON on {topic}".format(topic=message.topic))
+			return
+		self.commands.put((command, payload))
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
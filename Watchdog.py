@@ -0,0 +1,172 @@
+#!/opt/smokestack-firmware/env/bin/python
+
+"""
+Watchdog.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Independent safety supervisor for the Smokestack control loop.
+The control loop posts a heartbeat (timestamp + last grill temp) into shared memory every cycle. A separate
+process polls the heartbeat and drives the relays to a safe state (auger + igniter off, fan on) when:
+ - the heartbeat is older than heartbeat_timeout (control loop stalled, e.g. hung HTTP request)
+ - the igniter has been energized for longer than igniter_timeout, set with a margin over the control loop's own limit
+ - the grill temperature exceeds temperature_max, as reported by the control loop or read by the supervisor itself
+   (read_temp), so a control loop reporting a stale or wrong temperature can't hide an overheating grill
+ - the control process has died
+Faults are acted on within poll_interval of becoming detectable (reaction_bound), so the relays are safe at most
+heartbeat_timeout + poll_interval after the last heartbeat of a stalled control loop (stall_bound).
+"""
+
+import math
+import multiprocessing
+import os
+import sys
+import time
+import RPi.GPIO as GPIO
+import SmokeLog
+
+TRIP_NONE = 0
+TRIP_STALL = 1
+TRIP_IGNITER = 2
+TRIP_TEMPERATURE = 3
+TRIP_ORPHANED = 4
+
+TRIP_REASONS = {
+	TRIP_NONE: None,
+	TRIP_STALL: "control loop stalled",
+	TRIP_IGNITER: "igniter on-time exceeded",
+	TRIP_TEMPERATURE: "grill temperature exceeded",
+	TRIP_ORPHANED: "control process exited"
+}
+
+class Watchdog:
+	"""
+	Heartbeat supervisor running in its own process
+	"""
+	def __init__(self, relays, heartbeat_timeout=30.0, igniter_timeout=16 * 60, temperature_max=550, poll_interval=0.5, read_temp=None):
+		"""
+		relays maps relay names ("auger", "fan", "igniter") to BCM pin numbers, and must already be set up as outputs
+		read_temp returns grill temp (°F) and is called from the supervisor process every poll, without logging
+		"""
+		self.relays = relays
+		self.heartbeat_timeout = heartbeat_timeout
+		self.igniter_timeout = igniter_timeout
+		self.temperature_max = temperature_max
+		self.poll_interval = poll_interval
+		self.read_temp = read_temp
+		context = multiprocessing.get_context("fork") # Child inherits GPIO channel setup from parent
+		self.last_beat = context.RawValue("d", time.monotonic())
+		self.grill_temp = context.RawValue("d", math.nan)
+		self.trip_reason = context.RawValue("i", TRIP_NONE)
+		self.trip_time = context.RawValue("d", 0.0)
+		self.trip_deadline = context.RawValue("d", 0.0)
+		self.stop_event = context.Event()
+		self.process = context.Process(target=self.run, name="smokestack-watchdog", daemon=True)
+
+	def start(self):
+		"""
+		Start supervisor process
+		"""
+		self.beat()
+		self.process.start()
+		SmokeLog.common.notice("supervising pid {pid}, reacting within {bound}s, {stall}s after a stall".format(pid=os.getpid(), bound=self.reaction_bound(), stall=self.stall_bound()))
+
+	def stop(self):
+		"""
+		Stop supervisor process without tripping
+		"""
+		self.stop_event.set()
+		self.process.join(timeout=self.poll_interval * 4)
+
+	def beat(self, grill_temp=None):
+		"""
+		Post heartbeat from control loop, called once per main loop iteration
+		"""
+		if grill_temp is not None:
+			self.grill_temp.value = grill_temp
+		self.last_beat.value = time.monotonic()
+
+	def tripped(self):
+		"""
+		Returns trip reason string, or None if the watchdog has not tripped
+		"""
+		return TRIP_REASONS[self.trip_reason.value]
+
+	def reaction_time(self):
+		"""
+		Returns seconds between the moment a fault became detectable and the relays being made safe, or None if not tripped
+		"""
+		if self.trip_reason.value == TRIP_NONE:
+			return None
+		return self.trip_time.value - self.trip_deadline.value
+
+	def reaction_bound(self):
+		"""
+		Returns worst-case reaction_time() (s): every condition is checked once per poll_interval
+		"""
+		return self.poll_interval
+
+	def stall_bound(self):
+		"""
+		Returns worst-case time (s) from a stalled control loop's last heartbeat to the relays being made safe
+		"""
+		return self.heartbeat_timeout + self.reaction_bound()
+
+	def read_grill(self):
+		"""
+		Returns (grill temp °F read by the supervisor, monotonic time of the read), temp is NaN if there is no reader or
+		the read failed
+		"""
+		sampled = time.monotonic()
+		if self.read_temp is None:
+			return math.nan, sampled
+		try:
+			return float(self.read_temp()), sampled
+		except Exception: # pylint: disable=W0703
+			return math.nan, sampled
+
+	def run(self):
+		"""
+		Supervisor process main loop
+		"""
+		parent = os.getppid()
+		igniter_on_since = None
+		while not self.stop_event.is_set():
+			now = time.monotonic()
+			reason, deadline = TRIP_NONE, now
+			if GPIO.input(self.relays["igniter"]):
+				igniter_on_since = igniter_on_since or now
+			else:
+				igniter_on_since = None
+			if os.getppid() != parent:
+				reason = TRIP_ORPHANED
+			elif now - self.last_beat.value > self.heartbeat_timeout:
+				reason, deadline = TRIP_STALL, self.last_beat.value + self.heartbeat_timeout
+			elif igniter_on_since is not None and now - igniter_on_since > self.igniter_timeout:
+				reason, deadline = TRIP_IGNITER, igniter_on_since + self.igniter_timeout
+			else:
+				readings = [(self.grill_temp.value, self.last_beat.value), self.read_grill()] # Reported, own
+				over = [sampled for temp, sampled in readings if temp > self.temperature_max]
+				if over:
+					reason, deadline = TRIP_TEMPERATURE, min(over)
+			if reason != TRIP_NONE or self.trip_reason.value != TRIP_NONE:
+				self.make_safe()
+				if self.trip_reason.value == TRIP_NONE:
+					self.trip_time.value = time.monotonic()
+					self.trip_deadline.value = deadline
+					self.trip_reason.value = reason
+					SmokeLog.common.error("tripped: {reason}, relays safe after {delay:.3f}s".format(reason=TRIP_REASONS[reason], delay=self.trip_time.value - deadline))
+				if reason == TRIP_ORPHANED:
+					return
+			time.sleep(self.poll_interval)
+
+	def make_safe(self):
+		"""
+		Drive relays to safe state: stop feeding pellets, kill igniter, keep fan running to burn off remaining fuel
+		Trip is latched, safe state is re-asserted on every poll until the supervisor is stopped
+		"""
+		GPIO.output(self.relays["auger"], False)
+		GPIO.output(self.relays["igniter"], False)
+		GPIO.output(self.relays["fan"], True)
+
+if __name__ == "__main__":
+	sys.exit("I am a module, not a script.")
@@ -0,0 +1,69 @@
+"""
+tests
+https://github.com/magnolialogic/smokestack-firmware
+
+Firmware tests against simulated hardware (Simulator.py), run from the repository root:
+ python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Simulator # pylint: disable=C0413
+Simulator.install() # Before anything imports RPi.GPIO / spidev
+
+import PID # pylint: disable=C0413
+import ProgramCache # pylint: disable=C0413
+import SmokeLog # pylint: disable=C0413
+import Smoker # pylint: disable=C0413
+import Smokestack # pylint: disable=C0413
+import Watchdog # pylint: disable=C0413
+
+SmokeLog.common.set_level("error")
+
+class FirmwareTestCase(unittest.TestCase):
+	"""
+	Smoker on simulated hardware wired into Smokestack globals, on a virtual clock, with Vapor calls stubbed out
+	"""
+	def setUp(self):
+		Simulator.hardware.grill = 225.0
+		Simulator.hardware.probes[(0, 1)] = 150.0
+		self.clock = Simulator.VirtualClock(1000000.0)
+		for module in [Smoker, Smokestack, PID]:
+			patcher = mock.patch.object(module, "time", self.clock)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.vapor = {}
+		for name in ["put_state", "patch_state", "delete_program"]:
+			patcher = mock.patch.object(Smokestack, name)
+			self.vapor[name] = patcher.start()
+			self.addCleanup(patcher.stop)
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		self.smoker = Smoker.Smoker()
+		self.smoker.connected = True
+		globals_ = {"smoker": self.smoker, "watchdog": Watchdog.Watchdog(self.smoker.relays), "control": None, "transports": [], "SMOKESTACK_API_ROOT": "http://localhost/api", "SMOKESTACK_PASSWORD": "", "program_cache": ProgramCache.ProgramCache(os.path.join(self.directory, "program-cache.json"))}
+		for name, value in globals_.items():
+			patcher = mock.patch.object(Smokestack, name, value, create=True)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.smoker.read_temps()
+
+	def run_for(self, seconds, plant=None):
+		"""
+		Advance the virtual clock one second at a time running the control loop (4 iterations per second, as
+		FREQUENCY_IDLE_TIMER), with plant (Simulator.GrillModel) driving the grill RTD if given
+		"""
+		for _ in range(int(seconds)):
+			self.clock.now += 1
+			if plant is not None:
+				Simulator.hardware.grill = plant.step(self.smoker.get_state("auger"))
+			for _ in range(4):
+				Smokestack.read_temps()
+				Smokestack.run_mode()
@@ -0,0 +1,62 @@
+"""
+test_AdaptiveSmoke.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Adaptive Smoke mode against the fixed P-setting cycle on a simulated grill, and in the firmware's Smoke loop
+"""
+
+import unittest
+from tests import FirmwareTestCase
+import AdaptiveSmoke
+import Simulator
+import Smokestack
+
+CONDITIONS = {name: (parameters, changes) for name, parameters, changes in Simulator.SMOKE_CONDITIONS} # Same as Simulator.py smoke
+
+def in_band(controller, name, target=180.0, warmup=30 * 60):
+	"""
+	Returns fraction of time within target +- BAND after warmup, for Simulator.simulate_smoke in CONDITIONS[name]
+	"""
+	parameters, changes = CONDITIONS[name]
+	trace = Simulator.simulate_smoke(controller, Simulator.GrillModel(temp=target - 20, **parameters), target, changes=changes)[warmup:]
+	return sum(abs(temp - target) <= AdaptiveSmoke.BAND for _, temp, _ in trace) / len(trace)
+
+class TestCycleTimes(unittest.TestCase):
+	def test_limits(self):
+		self.assertEqual(AdaptiveSmoke.cycle_times(AdaptiveSmoke.DUTY_MIN), (AdaptiveSmoke.ON_TIME, AdaptiveSmoke.OFF_TIME_MAX))
+		on_time, off_time = AdaptiveSmoke.cycle_times(AdaptiveSmoke.DUTY_MAX)
+		self.assertAlmostEqual(on_time, AdaptiveSmoke.ON_TIME_MAX)
+		self.assertEqual(off_time, AdaptiveSmoke.OFF_TIME_MIN)
+		self.assertEqual(AdaptiveSmoke.cycle_times(15 / 80), (15, 65)) # P2
+
+	def test_duty_preserved(self):
+		for step in range(101):
+			duty = AdaptiveSmoke.DUTY_MIN + (AdaptiveSmoke.DUTY_MAX - AdaptiveSmoke.DUTY_MIN) * step / 100
+			on_time, off_time = AdaptiveSmoke.cycle_times(duty)
+			self.assertAlmostEqual(on_time / (on_time + off_time), duty)
+			self.assertTrue(AdaptiveSmoke.OFF_TIME_MIN <= off_time <= AdaptiveSmoke.OFF_TIME_MAX)
+
+class TestSmokeBand(unittest.TestCase):
+	def test_holds_band(self):
+		for name in CONDITIONS:
+			self.assertGreater(in_band("adaptive", name), 0.9, name)
+
+	def test_beats_p_setting(self):
+		for name in ["cold, windy", "hot, dense pellets", "wind after 1h"]:
+			self.assertLess(in_band("p-setting", name), 0.5, name)
+
+class TestSmokeMode(FirmwareTestCase):
+	def test_cold_grill(self):
+		parameters, _ = CONDITIONS["cold, windy"]
+		plant = Simulator.GrillModel(temp=165.0, **parameters)
+		Simulator.hardware.grill = plant.temp
+		Smokestack.apply_mode("Smoke", 180)
+		self.run_for(90 * 60, plant)
+		self.assertEqual(self.smoker.state.mode, "Smoke")
+		self.assertIsNone(self.smoker.state.event)
+		self.assertLess(abs(self.smoker.state.grillCurrent - 180), AdaptiveSmoke.BAND)
+		self.assertLess(self.smoker.smoke.off_time, 65) # Feeding faster than P2 to hold the band
+		self.assertGreater(self.smoker.state.pelletRate, 0.0)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,59 @@
+"""
+test_Calibration.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Correction curve fitting and precomputed sensor lookup tables
+"""
+
+import math
+import unittest
+import tests # pylint: disable=W0611
+import Calibration
+
+R_VALUE, R_REFERENCE, A, B = 1000, 4300, 3.90830E-3, -5.775E-7 # As in TempSensor.MAX31865
+
+def max31865_reference(code):
+	"""
+	MAX31865.read before lookup tables: Callendar-Van Dusen per read, 0 if there is no real solution (no RTD)
+	"""
+	r_measured = float(code * R_REFERENCE) / 2 ** 15
+	try:
+		celsius = (-A + math.sqrt(A * A - 4 * B * (1 - r_measured / R_VALUE))) / (2 * B)
+	except ValueError:
+		return 0
+	return int(float(format(celsius * 1.8 + 32, ".1f")))
+
+class TestFit(unittest.TestCase):
+	def test_single_point_is_offset(self):
+		self.assertEqual([round(value, 6) for value in Calibration.fit([[0, 210.0, 212.0]])], [2.0])
+
+	def test_recovers_quadratic(self):
+		error = lambda reading: 1.5 - 0.01 * reading + 2e-5 * reading * reading
+		points = [[0, reading, reading + error(reading)] for reading in [32.0, 150.0, 212.0, 350.0, 500.0]]
+		for fitted, actual in zip(Calibration.fit(points), [1.5, -0.01, 2e-5]):
+			self.assertAlmostEqual(fitted, actual)
+
+	def test_degree_capped_by_points(self):
+		self.assertEqual(len(Calibration.fit([[0, 32.0, 33.0], [0, 212.0, 210.0]], degree=3)), 2)
+
+class TestTables(unittest.TestCase):
+	def test_max31865_uncalibrated_matches_conversion(self):
+		table = Calibration.max31865_table(R_VALUE, R_REFERENCE, A, B)
+		self.assertEqual(len(table), 2 ** 15)
+		self.assertEqual(table, [max31865_reference(code) for code in range(2 ** 15)])
+
+	def test_max31865_correction(self):
+		table = Calibration.max31865_table(R_VALUE, R_REFERENCE, A, B)
+		corrected = Calibration.max31865_table(R_VALUE, R_REFERENCE, A, B, [2.0])
+		self.assertTrue(all(after == before + 2 for before, after in zip(table, corrected) if before > 0)) # Truncation is towards zero, around 0 the shift differs
+
+	def test_max31855_table(self):
+		low, high = Calibration.MAX31855_RANGE
+		self.assertEqual(Calibration.max31855_table(None), list(range(low, high + 1)))
+		corrected = Calibration.max31855_table(Calibration.fit([[0, 32.0, 33.0], [0, 212.0, 210.0]], degree=1))
+		self.assertEqual(corrected[32 - low], 33)
+		self.assertEqual(corrected[212 - low], 210)
+		self.assertEqual(len(corrected), high - low + 1)
+
+if __name__ == "__main__":
+	unittest.main()
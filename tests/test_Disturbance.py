@@ -0,0 +1,101 @@
+"""
+test_Disturbance.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Lid-open / flame-out detection against a simulated grill, and the firmware's reaction to it
+"""
+
+import unittest
+from tests import FirmwareTestCase
+import Disturbance
+import Simulator
+import Smokestack
+
+def steady_plant(target):
+	"""
+	Returns (GrillModel at steady state holding target on the default gain, duty that holds it)
+	"""
+	plant = Simulator.GrillModel(temp=target)
+	return plant, plant.fire
+
+def detect(plant, duty, target, seconds, change=None, period=20):
+	"""
+	Run plant at constant duty sampling every 2s like Smoker.sample_grill, change(plant) after the first third
+	Returns list of (time, event) transitions
+	"""
+	detector = Disturbance.DisturbanceDetector()
+	transitions = []
+	for second in range(seconds):
+		if change is not None and second == seconds // 3:
+			change(plant)
+		plant.step(second % period < duty * period)
+		if second % 2 == 0:
+			event = detector.update(second, round(plant.temp), True, target)
+			if len(transitions) == 0 or transitions[-1][1] != event:
+				transitions.append((second, event))
+	return transitions
+
+class TestDisturbanceDetector(unittest.TestCase):
+	def test_setpoint_drop_is_not_a_disturbance(self):
+		for controller in ["pid", "mpc"]:
+			trace = Simulator.simulate_hold(controller, [(0, 275), (4 * 60 * 60, 225)])
+			detector = Disturbance.DisturbanceDetector()
+			target = None
+			for second, temp, setpoint, _ in trace[::2]:
+				if setpoint != target: # Smokestack.apply_grill_target
+					target = setpoint
+					detector.reset()
+				self.assertIsNone(detector.update(second, round(temp), True, target), "{controller} at {second}s, {temp:.0f}F".format(controller=controller, second=second, temp=temp))
+
+	def test_flame_out(self):
+		for target in [180, 225, 275]:
+			plant, duty = steady_plant(target)
+			transitions = detect(plant, duty, target, 1800, change=lambda plant: setattr(plant, "gain", 0.0))
+			self.assertEqual(transitions[-1][1], "flameOut") # At high temps the first minutes can look like lid-open, escalated after LID_TIMEOUT
+			self.assertNotIn(None, [event for _, event in transitions[1:]])
+			self.assertLess(transitions[1][0] - 600, 3 * 60)
+
+	def test_lid_open(self):
+		def open_lid(plant):
+			plant.temp -= 40
+		plant, duty = steady_plant(225)
+		transitions = detect(plant, duty, 225, 1800, change=open_lid)
+		self.assertEqual([event for _, event in transitions], [None, "lidOpen", None])
+		self.assertLess(transitions[1][0] - 600, 10)
+
+	def test_flame_out_clears_within_band(self):
+		detector = Disturbance.DisturbanceDetector()
+		detector.update(0, 225, True, 225)
+		detector.start_event("flameOut", 0, 180)
+		self.assertEqual(detector.update(2, 185, True, 225), "flameOut")
+		self.assertIsNone(detector.update(4, 225 - Disturbance.FLAME_BAND + 1, True, 225))
+
+class TestFlameOutHandling(FirmwareTestCase):
+	def test_setpoint_drop_keeps_cooking(self):
+		plant = Simulator.GrillModel(temp=275)
+		Simulator.hardware.grill = plant.temp
+		self.smoker.controller = "mpc"
+		Smokestack.apply_grill_target(275)
+		Smokestack.apply_mode("Hold", 275)
+		self.run_for(30 * 60, plant)
+		Smokestack.apply_grill_target(225)
+		self.run_for(60 * 60, plant)
+		self.assertIsNone(self.smoker.state.event)
+		self.assertFalse(self.smoker.get_state("igniter"))
+		self.assertEqual(self.smoker.state.mode, "Hold")
+		self.assertLess(abs(self.smoker.state.grillCurrent - 225), 10)
+
+	def test_relight_is_capped(self):
+		Smokestack.apply_mode("Hold", 225)
+		Simulator.hardware.grill = 180.0 # Fire out, not recovering
+		self.smoker.disturbance.start_event("flameOut", self.clock.now, 180)
+		self.run_for(1)
+		self.assertTrue(self.smoker.get_state("igniter"))
+		self.run_for(Smokestack.TIMEOUT_RELIGHT - 10)
+		self.assertTrue(self.smoker.get_state("igniter"))
+		self.run_for(11)
+		self.assertFalse(self.smoker.get_state("igniter"))
+		self.assertEqual(self.smoker.state.mode, "Shutdown")
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,84 @@
+"""
+test_Estimator.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Cook completion ETA on simulated probe curves, and its publication in smoker state
+"""
+
+import math
+import unittest
+from tests import FirmwareTestCase
+import Estimator
+import Simulator
+import Smokestack
+
+def estimates(curve, target, duration, period=10):
+	"""
+	Feed integer probe readings of curve(t) every period seconds, like Smoker.read_temps
+	Returns (estimator, list of (time, eta, confidence, stalled) every 15 min)
+	"""
+	estimator = Estimator.CookEstimator()
+	results = []
+	for second in range(0, duration, period):
+		estimator.update(second, round(curve(second)))
+		if second % (15 * 60) == 0:
+			results.append((second, *estimator.estimate(target), estimator.stalled))
+	return estimator, results
+
+class TestCookEstimator(unittest.TestCase):
+	def test_linear_rise(self):
+		rate = 30 / 3600
+		finish = (203 - 40) / rate
+		_, results = estimates(lambda second: 40 + rate * second, 203, int(finish))
+		self.assertEqual(results[0][1:3], (None, 0.0)) # Less than MIN_SPAN of samples
+		for second, eta, confidence, _ in results[1:]:
+			self.assertLess(abs(second + eta - finish), 0.02 * finish)
+			self.assertGreater(confidence, 0.9)
+
+	def test_approach_to_grill_temp(self):
+		"""
+		Meat heats as a first-order lag towards the grill, the straight-line projection is early but converges
+		"""
+		time_constant = 3 * 60 * 60
+		finish = -time_constant * math.log((250 - 203) / 210)
+		_, results = estimates(lambda second: 250 - 210 * math.exp(-second / time_constant), 203, int(finish))
+		errors = [finish - (second + eta) for second, eta, _, _ in results[1:]]
+		self.assertTrue(all(error > 0 for error in errors))
+		self.assertEqual(errors, sorted(errors, reverse=True))
+		self.assertLess(max(errors[-2:]), 15 * 60) # Within 15 min over the last half hour
+
+	def test_stall(self):
+		rate = 40 / 3600
+		stall_start = (160 - 40) / rate
+		def curve(second):
+			if second < stall_start:
+				return 40 + rate * second
+			if second < stall_start + 3 * 60 * 60:
+				return 160 + 2 * (second - stall_start) / (3 * 60 * 60)
+			return 162 + rate * (second - stall_start - 3 * 60 * 60)
+		estimator, results = estimates(curve, 203, int(stall_start + 3 * 60 * 60))
+		stalled = [result for result in results if result[3]]
+		self.assertLess(stalled[0][0] - stall_start, 2 * 60 * 60)
+		self.assertTrue(all(second > stall_start for second, _, _, _ in stalled))
+		for second, eta, confidence, _ in stalled: # Projected at the pre-stall rate
+			self.assertLess(abs(eta - (203 - round(curve(second))) / rate), 5 * 60)
+			self.assertEqual(confidence, Estimator.STALL_CONFIDENCE)
+		self.assertAlmostEqual(estimator.pre_stall_rate, rate, delta=0.05 * rate)
+		for second in range(int(stall_start + 3 * 60 * 60), int(stall_start + 4 * 60 * 60), 10):
+			estimator.update(second, round(curve(second)))
+		self.assertFalse(estimator.stalled)
+
+class TestETAState(FirmwareTestCase):
+	def test_eta_published(self):
+		Simulator.hardware.probes[(0, 1)] = 100.0
+		Smokestack.set_probe_target(203)
+		for minute in range(60):
+			Simulator.hardware.probes[(0, 1)] = 100.0 + 30 * minute / 60
+			self.run_for(60)
+		remaining = (203 - 130) / 30 * 60 * 60
+		self.assertLess(abs(self.smoker.state.eta - remaining), 0.05 * remaining)
+		self.assertGreater(self.smoker.state.etaConfidence, 0.8)
+		self.assertEqual(self.smoker.state.probes[0].eta, self.smoker.state.eta)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,71 @@
+"""
+test_MPC.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Model identification and Hold performance of the model-predictive controller against a simulated grill
+"""
+
+import random
+import time
+import unittest
+import tests # pylint: disable=W0611
+import MPC
+import PID
+import Simulator
+
+SETPOINTS = [(0, 225), (4 * 60 * 60, 275)]
+
+def hold(controller, **plant):
+	"""
+	Returns Simulator.simulate_hold trace for SETPOINTS on a GrillModel with the given parameters
+	"""
+	return Simulator.simulate_hold(controller, SETPOINTS, plant=Simulator.GrillModel(temp=180.0, **plant))
+
+def settled_error(trace):
+	"""
+	Returns largest |temp - target| (°F) from 2h after each setpoint step
+	"""
+	return max(abs(temp - target) for second, temp, target, _ in trace if any(start + 2 * 60 * 60 <= second < start + 4 * 60 * 60 for start, _ in SETPOINTS))
+
+class TestIdentify(unittest.TestCase):
+	def test_recovers_model(self):
+		actual = MPC.FOPDT.from_physical(400.0, 600.0, 60.0)
+		generator = random.Random(1)
+		temps, duties = [150.0], []
+		for sample in range(MPC.WINDOW - 1):
+			duties.append(generator.choice([0.2, 0.5, 0.8]))
+			temps.append(actual.step(temps[-1], duties[sample - actual.dead_time] if sample >= actual.dead_time else 0.2))
+		model = MPC.identify(temps, duties)
+		self.assertEqual(model.dead_time, actual.dead_time)
+		self.assertAlmostEqual(model.a, actual.a, places=3)
+		self.assertAlmostEqual(model.b / (1 - model.a), 600.0, delta=10.0)
+
+	def test_no_learning_during_disturbance(self):
+		controller = MPC.MPC()
+		for _ in range(10):
+			controller.update(200.0, 225)
+		model = controller.model
+		controller.update(150.0, 225, learn=False)
+		self.assertIs(controller.model, model)
+		self.assertEqual(len(controller.temps), 0) # Disturbed samples never enter the identification window
+
+class TestHold(unittest.TestCase):
+	def test_step_response(self):
+		pid, mpc = hold("pid"), hold("mpc")
+		for index, (start, _) in enumerate(SETPOINTS):
+			end = start + 4 * 60 * 60 if index == 0 else start + 3 * 60 * 60
+			settling, overshoot, rms = Simulator.step_response(mpc, start, end)
+			self.assertLess(settling, 20 * 60)
+			self.assertLess(overshoot, 5.0)
+			self.assertLess(rms, Simulator.step_response(pid, start, end)[2])
+
+	def test_clock_restored(self):
+		hold("pid")
+		self.assertIs(PID.time, time) # Virtual clock doesn't leak into later tests
+
+	def test_holds_across_plants(self):
+		for plant in [{"gain": 250.0}, {"gain": 700.0}, {"time_constant": 600.0}]:
+			self.assertLess(settled_error(hold("mpc", **plant)), 6.0, plant)
+
+if __name__ == "__main__":
+	unittest.main()
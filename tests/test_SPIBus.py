@@ -0,0 +1,30 @@
+"""
+test_SPIBus.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Shared SPI bus handle lifetime
+"""
+
+import unittest
+from unittest import mock
+import tests # pylint: disable=W0611
+import SPIBus
+
+class TestRelease(unittest.TestCase):
+	def test_closes_after_last_handle(self):
+		with mock.patch.object(SPIBus.spidev, "SpiDev") as spidev:
+			bus = SPIBus.SPIBus(0)
+			first, second = bus.device(1), bus.device(1)
+			spidev.assert_called_once()
+			first.close()
+			first.close() # Repeated close doesn't release second's reference
+			spidev.return_value.close.assert_not_called()
+			second.readbytes(4)
+			second.close()
+			spidev.return_value.close.assert_called_once()
+			self.assertEqual(bus.devices, {})
+			bus.device(1) # Reopens
+			self.assertEqual(spidev.call_count, 2)
+
+if __name__ == "__main__":
+	unittest.main()
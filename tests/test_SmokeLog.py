@@ -0,0 +1,42 @@
+"""
+test_SmokeLog.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Log level filtering
+"""
+
+import syslog
+import unittest
+from unittest import mock
+import tests # pylint: disable=W0611
+import SmokeLog
+
+class TestSetLevel(unittest.TestCase):
+	def setUp(self):
+		self.addCleanup(setattr, SmokeLog.SmokeLog, "threshold", SmokeLog.SmokeLog.threshold)
+		for patcher in [mock.patch.object(SmokeLog.syslog, "syslog"), mock.patch("builtins.print")]:
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.syslog = SmokeLog.syslog.syslog
+
+	def logged(self):
+		return [call.args for call in self.syslog.call_args_list]
+
+	def test_level_drops_less_severe(self):
+		SmokeLog.common.set_level("notice")
+		SmokeLog.common.info("dropped")
+		SmokeLog.common.notice("kept")
+		self.assertEqual(self.logged(), [(syslog.LOG_NOTICE, "test_level_drops_less_severe: kept")])
+
+	def test_unknown_level_logs_everything(self):
+		SmokeLog.common.set_level("error")
+		for level in ["warning", ["debug"], None]:
+			self.syslog.reset_mock()
+			SmokeLog.common.set_level(level)
+			self.assertEqual(SmokeLog.SmokeLog.threshold, SmokeLog.LEVELS[SmokeLog.DEFAULT_LEVEL])
+			self.assertEqual([priority for priority, _ in self.logged()], [syslog.LOG_ERR])
+			SmokeLog.common.debug("kept")
+			self.assertEqual(self.logged()[-1], (syslog.LOG_DEBUG, "test_unknown_level_logs_everything: kept"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,54 @@
+"""
+test_SmokerState.py
+https://github.com/magnolialogic/smokestack-firmware
+
+State snapshots and transactions
+"""
+
+import unittest
+import tests # pylint: disable=W0611
+from SmokerState import SmokerState
+
+class TestSnapshot(unittest.TestCase):
+	def test_compact_after_field_change(self):
+		state = SmokerState(grillCurrent=225)
+		temps = state.snapshot(compact=True)["temps"]
+		self.assertEqual(temps, {"grillCurrent": 225, "probes": ({"current": None, "target": None, "eta": None, "etaConfidence": None},)})
+		state.mode = "Hold"
+		state.pelletRate = 1.5
+		compact = state.snapshot(compact=True)
+		self.assertEqual(compact["mode"], "Hold")
+		self.assertIs(compact["temps"], temps) # Unchanged temps are shared, not nested
+		state.grillTarget = 250
+		self.assertEqual(state.snapshot(compact=True)["temps"]["grillTarget"], 250)
+		self.assertNotIn("probeTarget", state.snapshot(compact=True)["temps"])
+		self.assertIn("probeTarget", state.snapshot()["temps"])
+
+class TestTransaction(unittest.TestCase):
+	def test_changes_publish_on_exit(self):
+		state = SmokerState()
+		pushed = []
+		with state.transaction():
+			state.mode = "Hold"
+			self.assertTrue(state.defer(lambda: pushed.append(state.snapshot()["mode"])))
+			self.assertEqual(state.snapshot()["mode"], "Idle")
+		self.assertEqual(pushed, ["Hold"])
+
+	def test_failed_transaction_drops_pushes(self):
+		state = SmokerState()
+		pushed = []
+		with self.assertRaises(KeyError):
+			with state.transaction():
+				state.mode = "Hold" # Relays may already have switched for this, state has to keep matching them
+				with state.transaction():
+					state.defer(lambda: pushed.append(state.snapshot()["mode"]))
+				state.grillTarget = 225
+				raise KeyError("probeTarget")
+		self.assertEqual(pushed, []) # Half-applied update never pushed
+		self.assertEqual(state.snapshot()["mode"], "Hold")
+		with state.transaction(): # Next transaction starts clean
+			state.defer(lambda: pushed.append(state.snapshot()["temps"]["grillTarget"]))
+		self.assertEqual(pushed, [225])
+
+if __name__ == "__main__":
+	unittest.main()
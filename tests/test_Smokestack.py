@@ -0,0 +1,211 @@
+"""
+test_Smokestack.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Main loop command handling (transport commands, Vapor heartbeat interrupts), program sync with Vapor, and the
+split-process control loop
+"""
+
+import glob
+import multiprocessing
+import os
+import time
+import unittest
+from unittest import mock
+from tests import FirmwareTestCase
+import FlightRecorder
+import Realtime
+import Simulator
+import Smokestack
+import Transport
+
+PUT_STATE = Smokestack.put_state # Unpatched, FirmwareTestCase stubs it out
+
+class QueuedTransport(Transport.Transport):
+	"""
+	Transport that hands out preloaded commands
+	"""
+	def __init__(self, *commands):
+		self.commands = list(commands)
+
+	def poll(self):
+		commands, self.commands = self.commands, []
+		return commands
+
+def state(mode="Hold", power=False, grill_target=225, probe_target=None):
+	return {"mode": mode, "online": True, "power": power, "temps": {"grillCurrent": 70, "grillTarget": grill_target, "probeCurrent": 70, "probeTarget": probe_target, "probes": []}, "probeConnected": True, "eta": None, "etaConfidence": None, "event": None}
+
+class TestCommands(FirmwareTestCase):
+	def relays(self):
+		return {relay: self.smoker.get_state(relay) for relay in self.smoker.relays}
+
+	def poll(self, *commands):
+		Smokestack.transports.append(QueuedTransport(*commands))
+		Smokestack.poll_transports()
+
+	def assert_untouched(self, relays):
+		self.assertEqual(self.smoker.state.mode, "Idle")
+		self.assertIsNone(self.smoker.state.grillTarget)
+		self.assertEqual(self.relays(), relays)
+		self.vapor["put_state"].assert_not_called()
+		self.vapor["patch_state"].assert_not_called()
+
+	def test_malformed_state_command(self):
+		relays = self.relays()
+		missing_probe_target = state()
+		del missing_probe_target["temps"]["probeTarget"]
+		wrong_type = state()
+		wrong_type["temps"]["grillTarget"] = "225"
+		self.poll(("state", missing_probe_target), ("state", state(mode="Broil")), ("state", wrong_type), ("state", dict(state(), power="yes")), ("state", ["Hold"]))
+		self.assert_untouched(relays)
+
+	def test_malformed_program_command(self):
+		relays = self.relays()
+		temp_step = {"mode": "Hold", "trigger": "Temp", "limit": 203, "targetGrill": 225}
+		self.poll(("program", {"id": "abc", "steps": [{"mode": "Hold", "trigger": "Time", "limit": 3600}]}), ("program", {"id": "abc", "steps": []}), ("program", {"steps": []}), ("program", {"id": "abc", "steps": [dict(temp_step, probe="1")]}), ("program", {"id": "abc", "steps": [dict(temp_step, probe="min", probes=[0, "1"])]}))
+		self.assert_untouched(relays)
+		self.assertIsNone(self.smoker.program_id)
+		self.assertEqual(self.smoker.program_steps, [])
+
+	def test_state_command(self):
+		self.poll(("state", state()))
+		self.assertEqual(self.smoker.state.mode, "Hold")
+		self.assertEqual(self.smoker.state.grillTarget, 225)
+		self.assertTrue(self.smoker.get_state("fan"))
+		self.assertTrue(self.smoker.get_state("auger"))
+
+	def test_failed_state_update_not_pushed(self):
+		with mock.patch.object(Smokestack, "put_state", PUT_STATE), mock.patch.object(Smokestack.requests, "put") as put:
+			with mock.patch.object(Smokestack, "set_probe_target", side_effect=RuntimeError):
+				with self.assertRaises(RuntimeError):
+					Smokestack.handle_state_update(state(probe_target=203)) # Mode change defers a push, probe target fails
+		self.assertEqual(self.smoker.state.mode, "Hold") # Kept, relays already switched for it
+		put.assert_not_called()
+
+	def test_probe_target_command(self):
+		Smokestack.control = mock.Mock(in_child=False)
+		self.poll(("state", state(mode="Idle", probe_target=203)))
+		self.assertEqual(self.smoker.state.probeTarget, 203)
+		self.assertEqual(self.smoker.state.probes[0].target, 203)
+		Smokestack.control.send.assert_called_with("probe_target", 203, 0, None) # Control process runs the ETA estimators
+		self.poll(("state", state(mode="Idle", probe_target=None)))
+		self.assertIsNone(self.smoker.state.probes[0].target)
+
+	def test_probe_selection_ignores_bad_indices(self):
+		self.assertEqual(self.smoker.probe_selection("max", [0, "0", True, -1, 5]), [0])
+		self.assertEqual(self.smoker.probe_selection("1"), [])
+		self.assertEqual(self.smoker.probe_selection("min", "0"), [0]) # Not a list, all probes
+
+def response(status_code, body=None):
+	"""
+	Returns stand-in for a requests response from Vapor
+	"""
+	return mock.Mock(status_code=status_code, ok=200 <= status_code < 400, headers={}, text="", json=mock.Mock(return_value=body))
+
+def program(id, mode="Hold"):
+	return {"id": id, "steps": [{"mode": mode, "trigger": "Time", "limit": 3600, "targetGrill": 225}]}
+
+class TestProgram(FirmwareTestCase):
+	def get_program(self, status_code, body=None):
+		self.get_program_reply(response(status_code, body))
+
+	def get_program_reply(self, reply):
+		with mock.patch.object(Smokestack.requests, "get", return_value=reply):
+			Smokestack.get_program()
+
+	def test_deleted_program_is_cleared(self):
+		Smokestack.program_cache.store("abc", program("abc")["steps"])
+		Smokestack.load_program("abc", program("abc")["steps"]) # Loaded from cache at boot
+		self.get_program(404)
+		self.assertIsNone(self.smoker.program_id)
+		self.assertIsNone(self.smoker.program_index)
+		self.assertEqual(self.smoker.program_steps, [])
+		self.assertEqual(Smokestack.program_cache.current(), (None, None))
+		self.smoker.state.power = True
+		Smokestack.set_program() # Next program start has nothing to run
+		self.assertFalse(self.smoker.state.power)
+
+	def test_program_request_failure_keeps_program(self):
+		Smokestack.load_program("abc", program("abc")["steps"])
+		with mock.patch.object(Smokestack.requests, "get", side_effect=Smokestack.requests.ConnectionError):
+			Smokestack.get_steps_for_id("def") # No SystemExit
+		with mock.patch.object(Smokestack.requests, "get", return_value=response(200)) as get:
+			get.return_value.json.side_effect = ValueError
+			Smokestack.get_steps_for_id("def")
+		self.assertEqual(self.smoker.program_id, "abc")
+
+	def test_etag_kept_when_program_starts(self):
+		Smokestack.load_program("old", program("old")["steps"])
+		self.smoker.state.power = True
+		Smokestack.set_program()
+		reply = response(200, program("abc"))
+		reply.headers = {"ETag": "\"1\""}
+		self.get_program_reply(reply) # Started via handle_program_update, which also caches it
+		self.assertEqual(self.smoker.program_id, "abc")
+		self.assertEqual(Smokestack.program_cache.get("abc")["etag"], "\"1\"")
+		with mock.patch.object(Smokestack.requests, "get", return_value=response(304)) as get:
+			Smokestack.get_program()
+		self.assertEqual(get.call_args.kwargs["headers"]["If-None-Match"], "\"1\"")
+
+	def test_program_changed_while_running(self):
+		Smokestack.load_program("abc", program("abc")["steps"])
+		self.smoker.state.power = True
+		Smokestack.set_program()
+		self.assertEqual(self.smoker.state.mode, "Hold")
+		self.get_program(200, program("def", mode="Smoke")) # Reconnect finds a different program
+		self.assertEqual(self.smoker.program_id, "def")
+		self.assertEqual(self.smoker.state.mode, "Smoke")
+		self.assertTrue(self.smoker.get_state("auger"))
+
+class TestControlProcess(FirmwareTestCase):
+	def relays(self):
+		return {relay: self.smoker.get_state(relay) for relay in self.smoker.relays}
+
+	def test_exit_before_first_telemetry(self):
+		Smokestack.apply_mode("Hold", 225)
+		Smokestack.control = mock.Mock(in_child=False, alive=mock.Mock(return_value=False), read=mock.Mock(return_value=(0, (), {})))
+		Smokestack.sync_telemetry()
+		self.assertIsNone(Smokestack.control) # Control loop back in this process
+		self.assertEqual(self.smoker.state.mode, "Shutdown")
+		self.assertFalse(self.smoker.get_state("auger"))
+
+	def test_child_shutdown_makes_relays_safe(self):
+		Simulator.hardware.grill = 80.0 # Never lights
+		self.smoker.read_temps()
+		Smokestack.apply_mode("Start", 225)
+		with mock.patch.object(Smokestack, "control", mock.Mock(in_child=True)), mock.patch.object(Smokestack, "shutdown_requested", False):
+			self.run_for(Smokestack.TIMEOUT_IGNITER + 1)
+			self.assertTrue(Smokestack.shutdown_requested)
+			self.assertEqual(self.smoker.state.mode, "Shutdown") # Before the networking process has seen the request
+			self.assertEqual(self.relays(), {"fan": True, "auger": False, "igniter": False})
+			self.run_for(60)
+			self.assertFalse(self.smoker.get_state("igniter"))
+
+	def test_seqlock_consistent_across_processes(self):
+		context = multiprocessing.get_context("fork")
+		block = Realtime.SeqlockBlock("<QQ", context)
+		def writer():
+			for value in range(1, 20001):
+				block.write(value, value)
+		process = context.Process(target=writer)
+		process.start()
+		while process.is_alive():
+			_, (first, second) = block.read()
+			self.assertEqual(first, second)
+		process.join()
+		self.assertEqual(block.read(), (20000, (20000, 20000)))
+
+	def test_child_dumps_flight_recorder(self):
+		with mock.patch.object(FlightRecorder.common, "directory", self.directory):
+			control = Realtime.ControlProcess(lambda: FlightRecorder.common.record(FlightRecorder.EVENT, "step"), {}, "<f", lambda: (0.0,), period=0.01, priority=0)
+			control.start()
+			while control.read()[0] == 0:
+				time.sleep(0.01)
+			control.stop()
+		self.assertFalse(control.alive())
+		dumps = glob.glob(os.path.join(self.directory, "flight-*-control-exit.bin.gz"))
+		self.assertEqual(len(dumps), 1)
+		self.assertIn("step", [record[2] for record in FlightRecorder.load(dumps[0])[1]])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,68 @@
+"""
+test_Watchdog.py
+https://github.com/magnolialogic/smokestack-firmware
+
+Supervisor trips on simulated relays
+"""
+
+import time
+import unittest
+import tests # pylint: disable=W0611
+import Simulator
+import Smokestack
+import Watchdog
+
+RELAYS = {"auger": 16, "fan": 13, "igniter": 18}
+
+class TestWatchdog(unittest.TestCase):
+	def start(self, **parameters):
+		gpio = Simulator.install()
+		for pin in RELAYS.values():
+			gpio.setup(pin, gpio.OUT, initial=False)
+		gpio.output(RELAYS["auger"], True)
+		watchdog = Watchdog.Watchdog(RELAYS, poll_interval=0.02, **parameters)
+		watchdog.start()
+		self.addCleanup(watchdog.stop)
+		return gpio, watchdog
+
+	def wait_for_trip(self, watchdog, timeout=2.0):
+		deadline = time.monotonic() + timeout
+		while watchdog.tripped() is None and time.monotonic() < deadline:
+			watchdog.beat(250)
+			time.sleep(0.005)
+		return watchdog.tripped()
+
+	def test_reads_temperature_itself(self):
+		gpio, watchdog = self.start(read_temp=lambda: 600.0)
+		self.assertEqual(self.wait_for_trip(watchdog), Watchdog.TRIP_REASONS[Watchdog.TRIP_TEMPERATURE]) # Control loop keeps reporting 250
+		self.assertFalse(gpio.input(RELAYS["auger"]))
+		self.assertTrue(0 <= watchdog.reaction_time() <= watchdog.reaction_bound() + 0.1)
+
+	def test_reported_temperature(self):
+		_, watchdog = self.start(read_temp=lambda: 250.0)
+		self.assertIsNone(self.wait_for_trip(watchdog, timeout=0.2))
+		watchdog.beat(600)
+		while watchdog.tripped() is None:
+			time.sleep(0.005)
+		self.assertEqual(watchdog.tripped(), Watchdog.TRIP_REASONS[Watchdog.TRIP_TEMPERATURE])
+		self.assertTrue(0 <= watchdog.reaction_time() <= watchdog.reaction_bound() + 0.1) # Measured from the beat that reported it
+
+	def test_sensor_failure_does_not_trip(self):
+		def broken():
+			raise OSError("SPI")
+		_, watchdog = self.start(read_temp=broken)
+		self.assertIsNone(self.wait_for_trip(watchdog, timeout=0.2))
+
+	def test_stall_bound(self):
+		_, watchdog = self.start(heartbeat_timeout=0.1)
+		self.assertEqual(watchdog.stall_bound(), 0.1 + watchdog.reaction_bound())
+		while watchdog.tripped() is None:
+			time.sleep(0.005)
+		self.assertEqual(watchdog.tripped(), Watchdog.TRIP_REASONS[Watchdog.TRIP_STALL])
+		self.assertLessEqual(watchdog.reaction_time(), watchdog.reaction_bound() + 0.1)
+
+	def test_igniter_margin(self):
+		self.assertGreaterEqual(Smokestack.TIMEOUT_WATCHDOG_IGNITER - Smokestack.TIMEOUT_IGNITER, 30) # Main loop shuts the igniter off first
+
+if __name__ == "__main__":
+	unittest.main()